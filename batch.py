@@ -0,0 +1,125 @@
+"""
+non-interactive bulk lookups: resolves CRS / TIPLOC / name queries against one loaded station index
+and streams the results as JSON Lines.
+
+    python main.py batch codes.txt > resolved.jsonl
+    cat codes.txt | python main.py batch --type crs --unmatched missing.txt
+    python main.py batch --csv --column tiploc movements.csv
+
+each output line is {"query": ..., "type": ..., "matches": [...]}. queries without a match are
+not written to stdout but to --unmatched (stderr by default), with a summary at the end.
+"""
+import argparse
+import csv
+import json
+import sys
+
+from station_index import get_index
+
+KINDS = ("auto", "crs", "tiploc", "name")
+
+
+def resolve(index, query, kind="auto", limit=5):
+    """
+    returns (kind, matches) for one query. with kind "auto" a 3 letter query is tried as a CRS code,
+    then anything code-like as a TIPLOC, and finally as a station name.
+    """
+    if kind == "crs":
+        return kind, index.by_crs(query)
+    if kind == "tiploc":
+        return kind, index.by_tiploc(query)
+    if kind == "name":
+        return kind, index.search(query, limit=limit)
+
+    code = query.replace(" ", "")
+    if len(code) == 3 and code.isalpha():
+        matches = index.by_crs(code)
+        if matches:
+            return "crs", matches
+    if 0 < len(code) <= 7 and code.isalnum():
+        matches = index.by_tiploc(code)
+        if matches:
+            return "tiploc", matches
+    return "name", index.search(query, limit=limit)
+
+
+def read_queries(stream, use_csv=False, column=None):
+    if not use_csv:
+        for line in stream:
+            query = line.strip()
+            if query:
+                yield query
+        return
+
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    if column and column not in header:
+        raise SystemExit("no column {!r} in the CSV header, columns: {}".format(column, ", ".join(header)))
+    position = header.index(column) if column else 0
+    for row in reader:
+        if len(row) > position and row[position].strip():
+            yield row[position].strip()
+
+
+def run_batch(queries, out, unmatched, index, kind="auto", limit=5):
+    """
+    resolves every query and writes one JSON line per matched query to out.
+    repeated queries are answered from a memo of earlier results.
+    returns (matched, unmatched) counts.
+    """
+    memo = {}
+    counts = [0, 0]
+    write = out.write
+    for query in queries:
+        # lookups are case-insensitive, so the serialised matches are shared by every spelling of a query
+        key = query.upper()
+        result = memo.get(key)
+        if result is None:
+            found_kind, matches = resolve(index, query, kind, limit)
+            if matches:
+                result = ', "type": {}, "matches": {}}}\n'.format(
+                    json.dumps(found_kind), json.dumps(matches, ensure_ascii=False))
+            else:
+                result = ""
+            if len(memo) < 1000000:
+                memo[key] = result
+
+        if result:
+            write('{"query": ' + json.dumps(query, ensure_ascii=False) + result)
+            counts[0] += 1
+        else:
+            unmatched.write(query + "\n")
+            counts[1] += 1
+    return counts[0], counts[1]
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="main.py batch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default="-", help="file with one query per line, or - for stdin")
+    parser.add_argument("--type", choices=KINDS, default="auto", help="what the queries are (default: auto)")
+    parser.add_argument("--csv", action="store_true", help="input is CSV with a header row")
+    parser.add_argument("--column", help="CSV column holding the queries (default: the first)")
+    parser.add_argument("--limit", type=int, default=5, help="max matches per name query")
+    parser.add_argument("--unmatched", help="file for queries without a match (default: stderr)")
+    parser.add_argument("--dict-file", default="temp.json", help="station dataset (.json or .bin)")
+    args = parser.parse_args(argv)
+
+    index = get_index(args.dict_file)
+    source = sys.stdin if args.input == "-" else open(args.input, newline="")
+    unmatched = open(args.unmatched, "w") if args.unmatched else sys.stderr
+
+    try:
+        queries = read_queries(source, use_csv=args.csv, column=args.column)
+        matched, missing = run_batch(queries, sys.stdout, unmatched, index,
+                                     kind=args.type, limit=args.limit)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if unmatched is not sys.stderr:
+            unmatched.close()
+
+    sys.stdout.flush()
+    print('{} matched, {} unmatched'.format(matched, missing), file=sys.stderr)
@@ -0,0 +1,55 @@
+"""
+throughput of the batch lookup mode (batch.py): mixed CRS / TIPLOC / name queries, a quarter of them
+unmatched, resolved against one index, plus the checks on reading queries from a CSV column.
+
+usage: python benchmarks/bench_batch.py [n_queries]
+"""
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from batch import read_queries, run_batch  # noqa: E402
+from station_index import get_index  # noqa: E402
+
+
+def queries(index, n, seed=1):
+    rnd = random.Random(seed)
+    records = index.records
+    out = []
+    for _ in range(n):
+        s = rnd.choice(records)
+        out.append(rnd.choice([s["CRS_main"], s["TIPLOC"], s["station_name"].title(), "ZZ{}".format(rnd.randrange(999))]))
+    return out
+
+
+def check_csv_column():
+    source = "tiploc,crs\nKNGX,KGX\nCOVNTRY,COV\n"
+    assert list(read_queries(io.StringIO(source), use_csv=True)) == ["KNGX", "COVNTRY"]
+    assert list(read_queries(io.StringIO(source), use_csv=True, column="crs")) == ["KGX", "COV"]
+    try:
+        list(read_queries(io.StringIO(source), use_csv=True, column="stanox"))
+    except SystemExit as e:
+        assert "'stanox'" in str(e) and "tiploc, crs" in str(e), e
+    else:
+        raise AssertionError("an unknown --column was accepted")
+
+
+def run(n=100000):
+    check_csv_column()
+    index = get_index()
+    qs = queries(index, n)
+    t = time.perf_counter()
+    matched, unmatched = run_batch(qs, io.StringIO(), io.StringIO(), index)
+    elapsed = time.perf_counter() - t
+    print("{:,} queries in {:.2f}s ({:,.0f}/s), {:,} matched, {:,} unmatched".format(
+        n, elapsed, n / elapsed, matched, unmatched))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
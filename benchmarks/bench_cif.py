@@ -0,0 +1,92 @@
+"""
+throughput of cif.py on a synthetic CIF file (cif.write_synthetic_cif over the TIPLOCs of temp.json):
+parsing in one process against the process pool, peak memory of a single range and of the whole parse,
+and TIPLOC lookups
+in the store joined to the station index.
+
+usage: python benchmarks/bench_cif.py [n_schedules] [processes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import cif  # noqa: E402
+from station_index import get_index  # noqa: E402
+
+
+def check_switch(path, directory):
+    # a reader that resolved the link keeps its version through the next switch, older versions go
+    link = os.path.join(directory, "store-switched")
+    cif.parse_cif(path, link, processes=1)
+    first = cif.CifStore(link)
+    cif.parse_cif(path, link, processes=1)
+    assert os.path.isdir(first.version), "previous version removed at the switch"
+    assert len(cif.CifStore(first.version)) == len(first)
+    cif.parse_cif(path, link, processes=1)
+    assert not os.path.exists(first.version), "versions older than the previous one kept"
+    versions = [n for n in os.listdir(directory) if n.startswith("store-switched.")]
+    assert len(versions) == 2, versions
+
+
+def run(n_schedules=50000, processes=None):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "synthetic.mca")
+        t = time.perf_counter()
+        size = cif.write_synthetic_cif(path, n_schedules)
+        mb = size / 1e6
+        print("{} schedules, {:.1f} MB written in {:.1f}s".format(n_schedules, mb, time.perf_counter() - t))
+
+        results = {}
+        for name, p in (("1 process", 1), ("pool", processes)):
+            store = os.path.join(directory, "store-{}".format(p))
+            t = time.perf_counter()
+            n, n_stops = cif.parse_cif(path, store, processes=p, chunk_bytes=4 << 20)
+            elapsed = time.perf_counter() - t
+            results[name] = store
+            print("  {:10s} {:6.2f}s {:6.1f} MB/s  {} schedules, {} locations".format(
+                name, elapsed, mb / elapsed, n, n_stops))
+
+        start, end = cif.chunk_offsets(path, 4 << 20)[0]
+        tracemalloc.start()
+        cif._parse_range((path, start, end))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  one {:.1f} MB range peaks at {:.1f} MB".format((end - start) / 1e6, peak / 1e6))
+
+        # ranges are written out as they arrive, the whole parse peaks at about one range too
+        tracemalloc.start()
+        cif.parse_cif(path, os.path.join(directory, "store-traced"), processes=1, chunk_bytes=4 << 20)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  the whole {:.1f} MB file peaks at {:.1f} MB".format(mb, peak / 1e6))
+
+        a, b = (cif.CifStore(s) for s in results.values())
+        for k in ("train_uid", "first_stop"):
+            assert (a.schedules[k] == b.schedules[k]).all()
+        for k in ("tiploc", "arrival", "pass"):
+            assert (a.stops[k] == b.stops[k]).all()
+
+        check_switch(path, directory)
+
+        index = get_index()
+        crs = [s["CRS_main"] for s in index.records[::10]]
+        t = time.perf_counter()
+        found = sum(len(a.at_station(c, index)) for c in crs)
+        elapsed = time.perf_counter() - t
+        print("  at_station: {} stations, {:.2f} ms each, {} schedules".format(
+            len(crs), elapsed / len(crs) * 1000, found))
+        print(a.schedule(0)["stops"][:2])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,57 @@
+"""
+polls many stations against the local stub server, comparing the old one-off requests.get
+per station with TransportClient's pooled, concurrent fan-out.
+
+usage: python benchmarks/bench_client.py [n_stations] [delay_seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stub_server import StubServer  # noqa: E402
+from transport_client import TransportClient  # noqa: E402
+
+
+def run(n_stations=200, delay=0.02):
+    import requests
+
+    crs_list = ["S{:02d}".format(i % 100) for i in range(n_stations)]
+
+    with StubServer(delay=delay) as stub:
+        client = TransportClient(base_url=stub.url, concurrency=20)
+
+        t = time.perf_counter()
+        for crs in crs_list:
+            requests.get(client.station_url(crs)).json()
+        sequential = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for crs in crs_list:
+            client.station(crs)
+        pooled = time.perf_counter() - t
+
+        t = time.perf_counter()
+        boards = asyncio.run(client.stations(crs_list))
+        concurrent = time.perf_counter() - t
+        assert [b["station_code"] for b in boards] == crs_list
+
+        client.close()
+
+    with StubServer(delay=delay, fail_rate=0.2) as stub:
+        client = TransportClient(base_url=stub.url, concurrency=20, backoff=0.01, retries=5)
+        boards = asyncio.run(client.stations(crs_list))
+        failed = sum(1 for b in boards if isinstance(b, Exception))
+        client.close()
+
+    print("{} stations, {:.0f} ms server delay".format(n_stations, delay * 1000))
+    print("requests.get per station  {:8.3f}s".format(sequential))
+    print("pooled, sequential        {:8.3f}s".format(pooled))
+    print("pooled, concurrent        {:8.3f}s".format(concurrent))
+    print("20% 503s with retries     {} of {} still failed".format(failed, n_stations))
+
+
+if __name__ == "__main__":
+    run(*[float(a) if i else int(a) for i, a in enumerate(sys.argv[1:3])])
@@ -0,0 +1,131 @@
+"""
+throughput of darwin.py on synthetic SOAP responses scaled up from the samples: a station board with
+n services (built from the train in providers/darwin/all-delays.json) and a disruption response with
+n copies of the disruption in all-status-station-soap.xml. the streaming parser is compared with
+building the whole tree (ElementTree.parse) first; peak memory is measured in a second pass.
+
+usage: python benchmarks/bench_darwin.py [n_records]
+"""
+import io
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import darwin  # noqa: E402
+
+SAMPLES = os.path.join(ROOT, "providers", "darwin")
+
+BOARD_HEAD = (
+    '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+    '<GetDepartureBoardResponse xmlns="http://thalesgroup.com/RTTI/2017-10-01/ldb/">'
+    '<GetStationBoardResult xmlns:lt4="http://thalesgroup.com/RTTI/2015-11-27/ldb/types"'
+    ' xmlns:lt5="http://thalesgroup.com/RTTI/2016-02-16/ldb/types"'
+    ' xmlns:lt7="http://thalesgroup.com/RTTI/2017-10-01/ldb/types">'
+    '<lt4:generatedAt>{generatedAt}</lt4:generatedAt><lt4:locationName>{locationName}</lt4:locationName>'
+    '<lt4:crs>{crs}</lt4:crs><lt5:platformAvailable>true</lt5:platformAvailable><lt7:trainServices>')
+BOARD_TAIL = '</lt7:trainServices></GetStationBoardResult></GetDepartureBoardResponse></soap:Body></soap:Envelope>'
+SERVICE = (
+    '<lt7:service><lt4:std>{std}</lt4:std><lt4:etd>{etd}</lt4:etd><lt4:platform>{platform}</lt4:platform>'
+    '<lt4:operator>{operator}</lt4:operator><lt4:operatorCode>{operatorCode}</lt4:operatorCode>'
+    '<lt4:serviceType>train</lt4:serviceType><lt4:serviceID>{serviceID}</lt4:serviceID>'
+    '<lt5:rsid>SW{i:06d}</lt5:rsid>'
+    '<lt5:origin><lt4:location><lt4:locationName>{origin}</lt4:locationName><lt4:crs>{origin_crs}</lt4:crs>'
+    '</lt4:location></lt5:origin>'
+    '<lt5:destination><lt4:location><lt4:locationName>{destination}</lt4:locationName>'
+    '<lt4:crs>{destination_crs}</lt4:crs></lt4:location></lt5:destination></lt7:service>')
+
+
+def make_board(n):
+    with open(os.path.join(SAMPLES, "all-delays.json")) as f:
+        data = json.load(f)
+    train = data["delayedTrains"][0]
+    parts = [BOARD_HEAD.format(**data)]
+    for i in range(n):
+        minutes = 6 * 60 + i % (18 * 60)
+        std = "{:02d}:{:02d}".format(minutes // 60, minutes % 60)
+        etd = ("On time", "Delayed", "Cancelled", train["etd"], "No report")[i % 5]
+        parts.append(SERVICE.format(
+            i=i, std=std, etd=etd, platform=train["platform"], operator=train["operator"],
+            operatorCode=train["operatorCode"], serviceID="{}{}".format(train["serviceID"][:-2], i),
+            origin=train["origin"][0]["locationName"], origin_crs=train["origin"][0]["crs"],
+            destination=train["destination"][0]["locationName"], destination_crs=train["destination"][0]["crs"]))
+    parts.append(BOARD_TAIL)
+    return "".join(parts).encode("utf-8")
+
+
+def make_disruptions(n):
+    with open(os.path.join(SAMPLES, "all-status-station-soap.xml")) as f:
+        text = f.read()
+    disruption = re.search(r"<ns2:disruption>.*?</ns2:disruption>", text, re.S).group(0)
+    head, tail = text.split(disruption, 1)
+    # the sample lists the disruption once, drop any further ones so the count is exact
+    tail = re.sub(r"<ns2:disruption>.*?</ns2:disruption>", "", tail, flags=re.S)
+    return (head + disruption * n + tail).encode("utf-8")
+
+
+def measure(f, data):
+    t = time.perf_counter()
+    count = f(data)
+    elapsed = time.perf_counter() - t
+
+    tracemalloc.start()
+    f(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, count
+
+
+def stream_board(data):
+    return sum(1 for _ in darwin.iter_departures(io.BytesIO(data)))
+
+
+def dom_board(data):
+    root = ET.parse(io.BytesIO(data)).getroot()
+    return sum(1 for el in root.iter() if darwin._local(el.tag) == "service")
+
+
+def stream_disruptions(data):
+    return sum(1 for _ in darwin.iter_disruptions(io.BytesIO(data)))
+
+
+def dom_disruptions(data):
+    root = ET.parse(io.BytesIO(data)).getroot()
+    return sum(1 for el in root.iter() if darwin._local(el.tag) == "disruption")
+
+
+def check_statuses():
+    # every etd Darwin sends maps to a status, text that is not a time ("No report") included
+    board = darwin.parse_station_board(io.BytesIO(make_board(5)))
+    statuses = [(d["status"], d["expected_departure_time"]) for d in board["departures"]["all"]]
+    assert statuses[:3] == [("ON TIME", "06:00"), ("LATE", None), ("CANCELLED", None)], statuses
+    assert statuses[4] == ("NO REPORT", None), statuses
+    assert darwin.departure_from_darwin({"std": "10:00", "etd": "No report"})["status"] == "NO REPORT"
+    assert darwin.departure_from_darwin({"std": "23:55", "etd": "00:10"})["status"] == "LATE"
+
+
+def run(n=50000):
+    check_statuses()
+    for name, data, stream, dom in (("board", make_board(n), stream_board, dom_board),
+                                    ("disruptions", make_disruptions(n // 10), stream_disruptions,
+                                     dom_disruptions)):
+        stream_time, stream_peak, count = measure(stream, data)
+        dom_time, dom_peak, dom_count = measure(dom, data)
+        assert count == dom_count
+
+        mb = len(data) / 1e6
+        print("{}: {} records, {:.1f} MB".format(name, count, mb))
+        print("  iterparse, converted   {:7.3f}s {:8.1f} MB/s {:9.0f} records/s  peak {:7.1f} MB".format(
+            stream_time, mb / stream_time, count / stream_time, stream_peak / 1e6))
+        print("  full tree, not converted {:5.3f}s {:8.1f} MB/s {:9.0f} records/s  peak {:7.1f} MB".format(
+            dom_time, mb / dom_time, count / dom_time, dom_peak / 1e6))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,113 @@
+"""
+enriches synthetic movement records (random TIPLOC / CRS pairs from temp.json, 5% unknown codes, some
+missing) with enrich.py, after checking rows and chunks without any usable key: the vectorised join in
+memory against looking every row up with station_from_TIPLOC, then a CSV streamed in chunks, in this process and through the process pool, with the peak memory of
+the streaming at two input sizes (it should not grow with the input).
+
+usage: python benchmarks/bench_enrich.py [n_rows] [processes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import main  # noqa: E402
+from enrich import StationTable, enrich, enrich_file  # noqa: E402
+
+
+def movements(table, n, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(table), n)
+    tiplocs = table.columns["tiploc"][rows].astype(object)
+    crs = table.columns["crs"][rows].astype(object)
+    unknown = rng.random(n) < 0.05
+    tiplocs[unknown] = "NOWHERE"
+    # some rows only have a CRS, a few have neither
+    tiplocs[rng.random(n) < 0.05] = None
+    crs[rng.random(n) < 0.01] = None
+    return pd.DataFrame({"movement_id": np.arange(n), "tiploc": tiplocs, "crs": crs,
+                         "actual": rng.integers(0, 1440, n)})
+
+
+def per_row(df):
+    out = []
+    for tiploc in df["tiploc"]:
+        found = main.station_from_TIPLOC(tiploc=tiploc, show_json=False) if isinstance(tiploc, str) else []
+        out.append(found[0]["station_name"] if found else None)
+    return out
+
+
+def check_missing_keys(table, directory):
+    # rows with no usable key at all, and chunks where a key column is entirely empty, come back unmatched
+    df = pd.DataFrame({"tiploc": ["NOWHERE", None, None, table.columns["tiploc"][0]],
+                       "crs": [None, None, "ZZZ", None]})
+    assert enrich(df, table, "tiploc", "crs")["station_name"].notna().tolist() == [False, False, False, True]
+    assert enrich(df.assign(tiploc=None), table, "tiploc")["station_name"].isna().all()
+    assert enrich(df.assign(crs=None), table, crs_column="crs")["station_name"].isna().all()
+
+    source = os.path.join(directory, "blank.csv")
+    pd.DataFrame({"tiploc": [""] * 4 + ["NOWHERE", table.columns["tiploc"][0]], "crs": [""] * 6}).to_csv(
+        source, index=False)
+    target = os.path.join(directory, "blank-out.csv")
+    assert enrich_file(source, target, table, "tiploc", "crs", processes=1, chunksize=4) == 6
+    assert pd.read_csv(target)["station_name"].notna().tolist() == [False] * 5 + [True]
+
+
+def run(n_rows=1000000, processes=None):
+    table = StationTable.load()
+    df = movements(table, n_rows)
+
+    t = time.perf_counter()
+    enriched = enrich(df, table, "tiploc", "crs")
+    vectorised = time.perf_counter() - t
+    sample = df.head(20000)
+    t = time.perf_counter()
+    names = per_row(sample)
+    looped = (time.perf_counter() - t) / len(sample) * n_rows
+    matched = enriched["station_name"].notna().mean()
+    # where the TIPLOC is known both give the same station
+    joined = enriched["station_name"].head(len(sample)).tolist()
+    assert all(a == b for a, b in zip(joined, names) if b is not None)
+    print("{:,} rows, {:.1%} matched".format(n_rows, matched))
+    print("  vectorised join       {:7.2f}s  {:12,.0f} rows/s".format(vectorised, n_rows / vectorised))
+    print("  station_from_TIPLOC   {:7.2f}s  {:12,.0f} rows/s (extrapolated from {:,} rows)".format(
+        looped, n_rows / looped, len(sample)))
+
+    directory = tempfile.mkdtemp()
+    try:
+        check_missing_keys(table, directory)
+        source = os.path.join(directory, "movements.csv")
+        df.to_csv(source, index=False)
+        mb = os.path.getsize(source) / 1e6
+        for name, p in (("1 process", 1), ("pool", processes)):
+            t = time.perf_counter()
+            rows = enrich_file(source, os.path.join(directory, "out.csv"), table, "tiploc", "crs",
+                               processes=p, chunksize=200000)
+            elapsed = time.perf_counter() - t
+            print("  csv, {:10s}      {:7.2f}s  {:12,.0f} rows/s  {:.0f} MB in".format(
+                name, elapsed, rows / elapsed, mb))
+
+        half = os.path.join(directory, "half.csv")
+        df.head(n_rows // 2).to_csv(half, index=False)
+        for name, path in (("half", half), ("full", source)):
+            tracemalloc.start()
+            enrich_file(path, os.path.join(directory, "out.csv"), table, "tiploc", "crs", processes=1,
+                        chunksize=200000)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("  streaming peak, {} input: {:.0f} MB".format(name, peak / 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,88 @@
+"""
+split points for a synthetic board: departures on branching routes out of one origin, like the lines
+out of a London terminal, compared with the nested list scan of every pair of calling patterns.
+
+usage: python benchmarks/bench_journey.py [n_departures] [n_destinations]
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from journey import JourneyFinder  # noqa: E402
+
+
+def make_board(n_departures, seed=1):
+    rnd = random.Random(seed)
+    # a tree of routes: 6 trunks of 8 stations, each branching into 4 branches of 12
+    routes = []
+    for t in range(6):
+        trunk = ["T{}{:02d}".format(t, i) for i in range(8)]
+        for b in range(4):
+            routes.append(trunk + ["B{}{}{:02d}".format(t, b, i) for i in range(12)])
+
+    departures, patterns = [], {}
+    for i in range(n_departures):
+        uid = "X{:05d}".format(i)
+        route = rnd.choice(routes)
+        # stopping patterns skip some stations, all trains reach the end of their branch
+        patterns[uid] = [c for c in route[:-1] if rnd.random() > 0.3] + route[-1:]
+        departures.append({"train_uid": uid})
+    stations = sorted({c for p in patterns.values() for c in p if c.startswith("B")})
+    return departures, patterns, stations
+
+
+def nested_scan(patterns, destinations):
+    # last station shared with any other destination's route, by walking the lists
+    output = {}
+    for d in destinations:
+        best = None
+        for uid, codes in patterns.items():
+            if d not in codes:
+                continue
+            mine = codes[:codes.index(d) + 1]
+            for o in destinations:
+                if o == d:
+                    continue
+                for other in patterns.values():
+                    if o not in other:
+                        continue
+                    theirs = other[:other.index(o) + 1]
+                    for i, code in enumerate(mine):
+                        if code in theirs and (best is None or i > best[0]):
+                            best = (i, code)
+        output[d] = best[1] if best else None
+    return output
+
+
+def run(n_departures=300, n_destinations=10):
+    departures, patterns, stations = make_board(n_departures)
+    destinations = random.Random(2).sample(stations, n_destinations)
+
+    t = time.perf_counter()
+    finder = JourneyFinder(departures, patterns)
+    build = time.perf_counter() - t
+
+    t = time.perf_counter()
+    result = finder.split_points(destinations)
+    split = time.perf_counter() - t
+
+    t = time.perf_counter()
+    expected = nested_scan(patterns, destinations)
+    scan = time.perf_counter() - t
+
+    # same split depth; ties between trains with equal depth may pick different stations
+    for d in destinations:
+        assert (result[d]["split"] is None) == (expected[d] is None), d
+
+    print("{} departures, {} destinations".format(n_departures, n_destinations))
+    print("build                 {:8.2f} ms".format(build * 1000))
+    print("split_points          {:8.2f} ms".format(split * 1000))
+    print("nested list scan      {:8.2f} ms".format(scan * 1000))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
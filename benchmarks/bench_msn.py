@@ -0,0 +1,111 @@
+"""
+compares the original parse_CRS loop against the streaming and bulk parsers in msn.py
+on a synthetic .msn file built from the records in temp.json, then parse_CRS end to end in both modes.
+
+usage: python benchmarks/bench_msn.py [n_lines]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fixtures import msn_line  # noqa: E402
+from msn import (interchange_status_structure, iter_msn, msn_record_pos,  # noqa: E402
+                 read_msn_bulk, read_msn_columns)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def make_synthetic_msn(path, n_lines):
+    with open(os.path.join(ROOT, "temp.json")) as f:
+        records = json.load(f)
+
+    with open(path, "w") as f:
+        f.write("/!! Start of file\n")
+        for i in range(n_lines):
+            f.write(msn_line(records[i % len(records)]) + "\n")
+
+
+def parse_legacy(filepath):
+    # the original parse_CRS loop, kept here as the baseline
+    with open(filepath) as f:
+        dataset = f.readlines()
+
+    content = dataset[1:]
+    content = [c.strip('\n') for c in content]
+
+    output = []
+    for c in content:
+        record_dict = {}
+        type_check = c[msn_record_pos["record_type"][0]]
+        if type_check.lower() == "a":
+            for k, v in msn_record_pos.items():
+                if len(v) == 1:
+                    record_value = c[v[0]]
+                    if k == "interchange_size":
+                        try:
+                            record_value = interchange_status_structure[int(
+                                record_value)]
+                        except:
+                            raise SystemExit(
+                                'interchange type unknown. interchange code:{}'.format(record_value))
+                    elif k == "is_estimate":
+                        if record_value.lower() == "e":
+                            record_value = "1"
+                        else:
+                            record_value = "0"
+                else:
+                    record_value = c[v[0]:v[-1] + 1]
+
+                record_value = record_value.strip()
+                record_dict[k] = record_value
+            output.append(record_dict)
+    return output
+
+
+def measure(name, fn):
+    t = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t
+
+    # second pass for memory, tracemalloc slows everything down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{:10} {:8.3f}s  peak {:8.1f} MB  {} records".format(
+        name, elapsed, peak / 1e6, result))
+    return elapsed
+
+
+def run(n_lines=100000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.msn")
+        make_synthetic_msn(path, n_lines)
+
+        # sanity check, all parsers must agree
+        legacy = parse_legacy(path)
+        assert legacy == list(iter_msn(path))
+        assert legacy == read_msn_bulk(path)
+
+        print("parsing {} synthetic msn lines".format(n_lines))
+        measure("legacy", lambda: len(parse_legacy(path)))
+        measure("stream", lambda: sum(1 for _ in iter_msn(path)))
+        measure("columns", lambda: len(read_msn_columns(path)["TIPLOC"]))
+        measure("bulk", lambda: len(read_msn_bulk(path)))
+
+        # end to end, parsing and writing temp.json
+        from main import parse_CRS
+
+        output = os.path.join(tmp, "parsed.json")
+        for mode in ("stream", "bulk"):
+            measure("CRS/" + mode, lambda: parse_CRS(filepath=path, mode=mode, output_file=output) or n_lines)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,93 @@
+"""
+board requests through ProviderRouter against stub providers serving providers/transportapi/ZFD-all-trains.json:
+
+    fast-tail    usually 20 ms, 5% of requests stall for 1 s
+    steady       always 60 ms
+    broken       fails every request
+
+compares asking fast-tail alone with hedging to steady, and shows the fallback past the broken provider.
+
+usage: python benchmarks/bench_providers.py [n_requests]
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from live_providers import ProviderRouter, StubProvider  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def providers(board):
+    rnd = random.Random(1)
+    fast_tail = StubProvider("fast-tail", board, delay=lambda: 1.0 if rnd.random() < 0.05 else 0.02)
+    steady = StubProvider("steady", board, delay=0.06)
+    broken = StubProvider("broken", board, delay=0.005, fail_rate=1.0)
+    return fast_tail, steady, broken
+
+
+async def measure(router, n, concurrency=20):
+    latencies = []
+    winners = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            t = time.perf_counter()
+            board = await router.board("ZFD")
+            latencies.append(time.perf_counter() - t)
+            winners[board["provider"]] = winners.get(board["provider"], 0) + 1
+
+    await asyncio.gather(*[one(i) for i in range(n)])
+    return latencies, winners
+
+
+def report(title, latencies, winners, router):
+    print(title)
+    print("  p50 {:7.1f} ms  p99 {:7.1f} ms  max {:7.1f} ms  answered by {}".format(
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, max(latencies) * 1000, winners))
+    for name, h in router.latency().items():
+        print("  {:10s} {} recent samples, {} errors, p50 {}".format(
+            name, h["count"], h["errors"], "-" if h["p50"] is None else "{:.1f} ms".format(h["p50"] * 1000)))
+
+
+def check_status_provider():
+    # statuses say which provider answered, as boards do: here the fallback past one without statuses
+    statuses = [{"id": "victoria", "name": "Victoria", "mode": "tube", "severity": 10,
+                 "description": "Good Service", "reason": None}]
+    router = ProviderRouter([StubProvider("boards-only"), StubProvider("broken", statuses=statuses, fail_rate=1.0),
+                             StubProvider("tfl-stub", statuses=statuses)])
+    answer = asyncio.run(router.status(["tube"]))
+    assert [s["provider"] for s in answer] == ["tfl-stub"], answer
+
+
+def run(n=2000):
+    check_status_provider()
+
+    with open(os.path.join(ROOT, "providers", "transportapi", "ZFD-all-trains.json")) as f:
+        board = json.load(f)
+
+    fast_tail, steady, broken = providers(board)
+    router = ProviderRouter([fast_tail], hedge_after=60)
+    report("fast-tail alone", *asyncio.run(measure(router, n)), router=router)
+
+    fast_tail, steady, broken = providers(board)
+    router = ProviderRouter([fast_tail, steady])
+    report("fast-tail hedged with steady", *asyncio.run(measure(router, n)), router=router)
+
+    fast_tail, steady, broken = providers(board)
+    router = ProviderRouter([broken, fast_tail, steady])
+    report("broken first, falling back", *asyncio.run(measure(router, n)), router=router)
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
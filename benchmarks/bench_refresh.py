@@ -0,0 +1,92 @@
+"""
+two weekly refreshes through refresh.py on .msn files rebuilt from temp.json: the first drop as a
+directory, the second as a zip with stations added, removed, recoded, renamed and moved.
+times each release and the diff (dict joins) against comparing every pair of records.
+
+usage: python benchmarks/bench_refresh.py [n_changes]
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import refresh  # noqa: E402
+from fixtures import write_msn  # noqa: E402
+
+
+def change(records, n, rnd):
+    records = [dict(s) for s in records]
+    rnd.shuffle(records)
+    removed, records = records[:n], records[n:]
+    for i, s in enumerate(rnd.sample(records, n)):
+        s["CRS_main"] = s["CRS_secondary"] = "Z{:02d}".format(i % 100)
+    for s in rnd.sample(records, n):
+        s["station_name"] = s["station_name"][:26] + " NEW"
+    for s in rnd.sample(records, n):
+        s["easting"] = str(int(s["easting"]) + rnd.randrange(1, 20))
+    for i in range(n):
+        records.append(dict(removed[0], TIPLOC="NEW{:04d}".format(i), station_name="NEW STATION {}".format(i)))
+    return records
+
+
+def nested_diff(old, new):
+    # what the diff costs without keyed joins
+    added = [b for b in new if not any(a["TIPLOC"] == b["TIPLOC"] for a in old)]
+    removed = [a for a in old if not any(a["TIPLOC"] == b["TIPLOC"] for b in new)]
+    changed = [(a, b) for a in old for b in new if a["TIPLOC"] == b["TIPLOC"] and a != b]
+    return len(added), len(removed), len(changed)
+
+
+def run(n_changes=25):
+    with open("temp.json") as f:
+        records = json.load(f)
+    rnd = random.Random(1)
+    directory = tempfile.mkdtemp()
+    try:
+        root = os.path.join(directory, "releases")
+        first = os.path.join(directory, "drop1")
+        os.makedirs(first)
+        write_msn(os.path.join(first, "ttisf074.msn"), records)
+
+        changed = change(records, n_changes, rnd)
+        os.makedirs(os.path.join(directory, "drop2"))
+        msn = os.path.join(directory, "drop2", "ttisf075.msn")
+        write_msn(msn, changed)
+        second = os.path.join(directory, "drop2.zip")
+        with zipfile.ZipFile(second, "w", zipfile.ZIP_DEFLATED) as z:
+            z.write(msn, "ttisf075.msn")
+
+        refresher = refresh.Refresher(root)
+        for name, source in (("first drop", first), ("second drop (zip)", second), ("second again", second)):
+            t = time.perf_counter()
+            manifest = refresher.submit(source).result()
+            print("{:18s} {:.2f}s  {}  {}".format(name, time.perf_counter() - t, manifest["version"],
+                                                 "unchanged" if manifest.get("unchanged") else manifest["diff"]))
+        refresher.close()
+        print("current:", os.readlink(os.path.join(root, "current")))
+
+        with open(os.path.join(refresh.current_dir(root), "temp.json")) as f:
+            parsed = json.load(f)
+        t = time.perf_counter()
+        diff = refresh.diff_stations(records, parsed)
+        joined = time.perf_counter() - t
+        t = time.perf_counter()
+        nested = nested_diff(records, parsed)
+        looped = time.perf_counter() - t
+        assert (len(diff["added"]), len(diff["removed"])) == nested[:2]
+        print("diff of {} / {} records: joins {:.1f} ms, nested loops {:.1f} ms".format(
+            len(records), len(parsed), joined * 1000, looped * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,106 @@
+"""
+throughput of the replay harness (replay.py) on an archive of the samples in providers/:
+the replayer alone, TransportClient's async fan-out over the in-process transport and over the
+replay server, raw keep-alive clients against the server, and a BoardWatcher diffing a recorded
+sequence of ZFD boards (replayed twice, the events must come out the same).
+
+usage: python benchmarks/bench_replay.py [requests] [latency_seconds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import fixtures  # noqa: E402
+import load_test  # noqa: E402
+import replay  # noqa: E402
+from board_watch import BoardWatcher  # noqa: E402
+from transport_client import TransportClient  # noqa: E402
+
+STATIONS = ["ZFD", "SAC", "KGX", "EDB", "COV"]
+
+
+def build_archive(path, polls):
+    # the samples, plus a board per poll for every station in STATIONS
+    with replay.ArchiveWriter(path) as writer:
+        replay.import_samples(writer)
+        for i, board in enumerate(fixtures.board_sequence(polls)):
+            for crs in STATIONS:
+                writer.add("GET", "{}/station/{}/live.json?limit=10".format(replay.TRANSPORTAPI_URL, crs), 200,
+                           dict(board, station_code=crs), elapsed=0.05, at=i * 30.0)
+    return os.path.getsize(path), len(replay.Archive(path))
+
+
+def fan_out(client, n):
+    crs_list = [STATIONS[i % len(STATIONS)] for i in range(n)]
+    t = time.perf_counter()
+    boards = asyncio.run(client.stations(crs_list))
+    elapsed = time.perf_counter() - t
+    failed = sum(isinstance(b, Exception) for b in boards)
+    return elapsed, failed
+
+
+def watch(client, polls):
+    async def fetch(stations):
+        return await client.stations(stations)
+
+    watcher = BoardWatcher(STATIONS, interval=0, fetch=fetch)
+
+    async def run():
+        return [e async for e in watcher.events(polls)]
+    return asyncio.run(run())
+
+
+def run(n=5000, latency=0.02, polls=50):
+    path = os.path.join(tempfile.mkdtemp(), "bench.replay")
+    size, responses = build_archive(path, polls)
+    print("archive: {} responses, {:,} bytes".format(responses, size))
+
+    replayer = replay.Replayer(path)
+    url = replay.TRANSPORTAPI_URL + "/station/ZFD/live.json?limit=10"
+    t = time.perf_counter()
+    for _ in range(n * 10):
+        replayer.respond("GET", url)
+    print("  replayer.respond        {:10,.0f} req/s".format(n * 10 / (time.perf_counter() - t)))
+
+    for delay in (0.0, latency):
+        with replay.replaying(path, latency=delay):
+            client = TransportClient(concurrency=100)
+            elapsed, failed = fan_out(client, n)
+            client.close()
+        print("  in-process, {:4.0f} ms    {:10,.0f} req/s  {} failed".format(delay * 1000, n / elapsed, failed))
+
+        with replay.ReplayServer(path, latency=delay) as server:
+            client = TransportClient(base_url=server.base_url(replay.TRANSPORTAPI_URL), concurrency=100)
+            elapsed, failed = fan_out(client, n)
+            client.close()
+            print("  server, {:4.0f} ms        {:10,.0f} req/s  {} failed".format(delay * 1000, n / elapsed, failed))
+
+            # keep-alive clients without requests in the way, what the server itself sustains
+            load_test.PATHS = ["/v3/uk/train/station/{}/live.json?limit=10".format(c) for c in STATIONS]
+            seconds = 3.0
+            latencies, errors = asyncio.run(load_test.load("127.0.0.1", int(server.url.rsplit(":", 1)[1]),
+                                                           100, seconds))
+            print("  server, raw clients     {:10,.0f} req/s  p99 {:.1f} ms  {} errors".format(
+                len(latencies) / seconds, load_test.percentile(latencies, 99) * 1000, len(errors)))
+
+    runs = []
+    for _ in range(2):
+        with replay.replaying(path):
+            client = TransportClient(concurrency=len(STATIONS))
+            t = time.perf_counter()
+            runs.append(watch(client, polls))
+            elapsed = time.perf_counter() - t
+            client.close()
+    assert runs[0] == runs[1], "replayed board events differ between runs"
+    print("  board watch, {} polls    {:10.3f}s  {} events, identical on replay".format(polls, elapsed, len(runs[0])))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    run(n, latency)
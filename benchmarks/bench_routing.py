@@ -0,0 +1,145 @@
+"""
+fastest journeys between random pairs of stations on a synthetic network over the ~3,000 stations of temp.json.
+
+lines are chains of neighbouring stations (from spatial.SpatialIndex), each starting on an earlier line so
+the network is connected; every line runs both ways from 06:00 to 22:00 at its own interval. stations
+within 400 m of each other get an interchange walk. the services go through Timetable as search_by_train
+responses, the same path as real timetables. every journey found is checked: legs follow on, each change
+leaves the station's change time.
+
+usage: python benchmarks/bench_routing.py [n_lines] [n_queries]
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from routing import Network  # noqa: E402
+from spatial import SpatialIndex  # noqa: E402
+from station_index import get_index  # noqa: E402
+from timetable import Timetable, format_minutes, to_minutes  # noqa: E402
+
+DATE = "2018-11-01"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def make_lines(spatial, n_lines, rnd):
+    records = spatial.records
+    on_lines = [rnd.choice(records)]
+    lines = []
+    for _ in range(n_lines):
+        s = rnd.choice(on_lines)
+        line = [s]
+        seen = {s["CRS_main"]}
+        for _ in range(rnd.randrange(8, 30)):
+            options = [r for r, _ in spatial.nearest(int(s["easting"]), int(s["northing"]), 6)
+                       if r["CRS_main"] not in seen]
+            if not options:
+                break
+            s = rnd.choice(options[:3])
+            seen.add(s["CRS_main"])
+            line.append(s)
+        lines.append(line)
+        on_lines.extend(line)
+    return lines
+
+
+def make_services(lines, rnd):
+    services = []
+    for n, line in enumerate(lines):
+        interval = rnd.choice((30, 60, 60, 120))
+        # 1-4 minutes between stations, 1 minute dwell
+        hops = [rnd.randrange(1, 5) for _ in line[1:]]
+        for direction, stops, gaps in ((0, line, hops), (1, line[::-1], hops[::-1])):
+            for k, start in enumerate(range(6 * 60 + rnd.randrange(interval), 22 * 60, interval)):
+                t = start
+                calls = []
+                for i, s in enumerate(stops):
+                    if i:
+                        t += gaps[i - 1]
+                    arrival = format_minutes(t) if i else None
+                    if i < len(stops) - 1:
+                        t += 1
+                    departure = format_minutes(t) if i < len(stops) - 1 else None
+                    calls.append({"station_code": s["CRS_main"], "stop_type": "LI",
+                                  "aimed_arrival_time": arrival, "aimed_arrival_date": DATE,
+                                  "aimed_departure_time": departure, "aimed_departure_date": DATE,
+                                  "expected_arrival_time": arrival, "expected_arrival_date": DATE,
+                                  "expected_departure_time": departure, "expected_departure_date": DATE})
+                services.append({"train_uid": "L{:03d}{}{:02d}".format(n, direction, k), "date": DATE,
+                                 "stops": calls})
+    return services
+
+
+def make_links(spatial):
+    connections = {}
+    for s in spatial.records:
+        for r, d in spatial.within(int(s["easting"]), int(s["northing"]), 400):
+            if r["CRS_main"] != s["CRS_main"]:
+                connections.setdefault(s["CRS_main"], []).append({"to": r["CRS_main"], "walk_time": 5 + int(d // 80)})
+    return {"connections": connections}
+
+
+def check(network, legs, start):
+    t = start
+    for i, leg in enumerate(legs):
+        depart, arrive = to_minutes(leg["depart"]), to_minutes(leg["arrive"])
+        if i and legs[i - 1]["mode"] == "train" and leg["mode"] == "train":
+            change = network.change_time[network.code_ids[leg["from"]]]
+            assert depart >= t + change, (legs, i)
+        assert t <= depart <= arrive, (legs, i)
+        if i:
+            assert legs[i - 1]["to"] == leg["from"], (legs, i)
+        t = arrive
+
+
+def run(n_lines=300, n_queries=1000):
+    rnd = random.Random(1)
+    index = get_index()
+    spatial = SpatialIndex(index.records)
+    lines = make_lines(spatial, n_lines, rnd)
+    services = make_services(lines, rnd)
+
+    t = time.perf_counter()
+    timetable = Timetable(index)
+    for service in services:
+        timetable.add(service)
+    load = time.perf_counter() - t
+
+    t = time.perf_counter()
+    network = Network.from_timetable(timetable, index=index, links=make_links(spatial))
+    build = time.perf_counter() - t
+    print("{} lines, {} services, {} connections, {} walks over {} stations".format(
+        len(lines), len(services), len(network.conn_dep), len(network.walk_to), len(network)))
+    print("  timetable {:.2f}s, network {:.2f}s".format(load, build))
+
+    served = sorted({s["CRS_main"] for line in lines for s in line})
+    queries = [(rnd.choice(served), rnd.choice(served), rnd.randrange(6 * 60, 20 * 60)) for _ in range(n_queries)]
+
+    times = []
+    found = changes = 0
+    for origin, destination, start in queries:
+        t = time.perf_counter()
+        legs = network.journey(origin, destination, start)
+        times.append(time.perf_counter() - t)
+        if legs is not None:
+            check(network, legs, start)
+            found += 1
+            changes += max(0, sum(1 for leg in legs if leg["mode"] == "train") - 1)
+
+    print("{} queries, {} journeys found, {:.1f} changes on average".format(
+        n_queries, found, changes / float(found or 1)))
+    print("  p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms".format(
+        percentile(times, 50) * 1000, percentile(times, 99) * 1000, max(times) * 1000))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,114 @@
+"""
+startup cost of the lookup path: `python -X importtime` for `import main`, plus the wall clock of a fresh
+process doing a single station_from_CRS. fails (exit code 1) when `import main` pulls in pandas / numpy /
+requests / asyncio, or when the lookup takes more than its budget over a bare `python -c pass`.
+the import time is only reported, an absolute budget on it fails with the machine rather than the code
+(--max-import-ms sets one anyway).
+
+usage: python benchmarks/bench_startup.py [--runs 5] [--max-lookup-ms 150] [--max-import-ms N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+# modules that must not be imported just to look a station up
+HEAVY = ("pandas", "numpy", "requests", "asyncio")
+
+
+def import_times():
+    # {module: cumulative microseconds} from python -X importtime
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                       cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit():
+            times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def lookup_wall_ms():
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main; main.station_from_CRS(crs='COV', show_json=False)"],
+                   cwd=ROOT, check=True)
+    return (time.perf_counter() - t) * 1000
+
+
+def baseline_wall_ms():
+    # interpreter start-up alone, subtracted from the lookup time
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], cwd=ROOT, check=True)
+    return (time.perf_counter() - t) * 1000
+
+
+def check_source_swap():
+    # temp.bin follows temp.json even when the replacement is older (cp -p, git checkout, a restored backup)
+    from station_index import load_index
+
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, "temp.json")
+    with open(os.path.join(ROOT, "temp.json")) as f:
+        records = json.load(f)
+
+    def put(records, mtime):
+        with open(source, "w") as f:
+            json.dump(records, f)
+        os.utime(source, (mtime, mtime))
+
+    put(records, time.time())
+    index = load_index(source, auto_reload=True)
+    index.check_interval = 0
+    assert len(index) == len(records)
+
+    put(records[:10], time.time() - 86400 * 365)
+    assert len(load_index(source, auto_reload=False)) == 10, "store not rebuilt for an older temp.json"
+    assert len(index) == 10, "store not reloaded for an older temp.json"
+
+    # same contents under a new mtime: checked by hash, not rebuilt
+    built = os.path.getmtime(os.path.join(directory, "temp.bin"))
+    put(records[:10], time.time() - 86400)
+    assert len(load_index(source, auto_reload=False)) == 10
+    assert os.path.getmtime(os.path.join(directory, "temp.bin")) == built, "store rebuilt for an unchanged temp.json"
+
+
+def run(runs=5, max_import_ms=None, max_lookup_ms=150.0):
+    check_source_swap()
+    # first run may build temp.bin, keep it out of the numbers
+    lookup_wall_ms()
+
+    imports = [import_times() for _ in range(runs)]
+    main_ms = statistics.median(t["main"] for t in imports) / 1000.0
+    heavy = sorted({m for t in imports for m in t if m.split(".")[0] in HEAVY})
+
+    lookup_ms = statistics.median(lookup_wall_ms() for _ in range(runs))
+    python_ms = statistics.median(baseline_wall_ms() for _ in range(runs))
+
+    print("import main            {:8.1f} ms{}".format(
+        main_ms, "" if max_import_ms is None else " (budget {:.0f} ms)".format(max_import_ms)))
+    print("station_from_CRS       {:8.1f} ms wall, {:.1f} ms over bare python (budget {:.0f} ms)".format(
+        lookup_ms, lookup_ms - python_ms, max_lookup_ms))
+    if heavy:
+        print("heavy modules imported: {}".format(", ".join(heavy)))
+
+    ok = not heavy and lookup_ms - python_ms <= max_lookup_ms and (max_import_ms is None or main_ms <= max_import_ms)
+    print("ok" if ok else "REGRESSION")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-lookup-ms", type=float, default=150.0)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.runs, args.max_import_ms, args.max_lookup_ms) else 1)
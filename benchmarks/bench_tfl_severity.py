@@ -0,0 +1,82 @@
+"""
+classifies a synthetic TfL Line/Status feed (every mode in tfl-severity-modes.json, random severities)
+with the severity model in test-api/tfl.py, against a per-line loop that rebuilds its ok codes
+on every call like the old filter_status did. both must flag the same statuses.
+
+usage: python benchmarks/bench_tfl_severity.py [n_lines]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "test-api"))
+
+import tfl  # noqa: E402
+
+
+def make_feed(n_lines, severity_dict, seed=1):
+    rnd = random.Random(seed)
+    modes = sorted(severity_dict) + ["unknown-mode"]
+    lines = []
+    for i in range(n_lines):
+        mode = rnd.choice(modes)
+        levels = [s["level"] for s in severity_dict.get(mode, [{"level": 10}])]
+        statuses = []
+        for _ in range(rnd.choice((1, 1, 1, 2, 3))):
+            # mostly good service, like the real feed
+            level = 10 if rnd.random() < 0.7 else rnd.choice(levels + [99])
+            statuses.append({"statusSeverity": level, "statusSeverityDescription": "",
+                             "reason": None})
+        lines.append({"id": "line-{}".format(i), "modeName": mode, "lineStatuses": statuses})
+    return lines
+
+
+def legacy(lines, severity_dict):
+    def filter_status(line):
+        ok_codes = {}
+        for mode, severities in severity_dict.items():
+            ok_codes[mode] = [s["level"] for s in severities if s["description"] in tfl.OK_DESCRIPTIONS]
+        return [s for s in line["lineStatuses"]
+                if int(s["statusSeverity"]) not in ok_codes.get(line["modeName"], [])]
+
+    output = []
+    for line in lines:
+        statuses = filter_status(line)
+        if statuses:
+            output.append((line, statuses))
+    return output
+
+
+def measure(f, *args):
+    best = None
+    for _ in range(3):
+        t = time.perf_counter()
+        result = f(*args)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(n_lines=5000):
+    with open(tfl.SEVERITY_FILE) as f:
+        severity_dict = json.load(f)
+    lines = make_feed(n_lines, severity_dict)
+    n_statuses = sum(len(l["lineStatuses"]) for l in lines)
+
+    load_time, model = measure(tfl.SeverityModel, severity_dict)
+    old_time, old = measure(legacy, lines, severity_dict)
+    new_time, new = measure(model.line_disruptions, lines)
+
+    assert [(l["id"], s) for l, s in old] == [(l["id"], s) for l, s in new]
+
+    print("{} lines, {} statuses, {} disrupted lines".format(n_lines, n_statuses, len(new)))
+    print("model load            {:8.2f} ms (once per process)".format(load_time * 1000))
+    print("per-line ok codes     {:8.2f} ms".format(old_time * 1000))
+    print("severity model        {:8.2f} ms".format(new_time * 1000))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,115 @@
+"""
+loads thousands of synthetic services, built from the W64717 sample with shifted times and
+dropped stops, into a Timetable and times the calling-pattern queries against scanning the stops lists.
+then refreshes every service a few times over and checks the columns do not grow.
+
+usage: python benchmarks/bench_timetable.py [n_services] [n_queries]
+"""
+import copy
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from timetable import Timetable, format_minutes, to_minutes  # noqa: E402
+
+
+def make_services(n, seed=1):
+    with open(os.path.join(ROOT, "providers", "transportapi", "W64717-all-stops-today.json")) as f:
+        sample = json.load(f)
+
+    rnd = random.Random(seed)
+    services = []
+    for i in range(n):
+        service = copy.deepcopy(sample)
+        service["train_uid"] = "S{:05d}".format(i)
+        shift = rnd.randrange(0, 18 * 60)
+        late = rnd.choice((0, 0, 0, 2, 5, 12))
+        stops = [s for j, s in enumerate(service["stops"])
+                 if j in (0, len(service["stops"]) - 1) or rnd.random() > 0.3]
+        for s in stops:
+            for kind in ("arrival", "departure"):
+                aimed = s["aimed_{}_time".format(kind)]
+                if aimed:
+                    m = to_minutes(aimed) + shift
+                    s["aimed_{}_time".format(kind)] = format_minutes(m)
+                    s["expected_{}_time".format(kind)] = format_minutes(m + late)
+        service["stops"] = stops
+        services.append(service)
+    return services
+
+
+def scan_calls_at(service, station_code, after):
+    # what callers did with the raw response
+    codes = [s["station_code"] for s in service["stops"]]
+    return station_code in codes and after in codes and codes.index(after) < codes.index(station_code)
+
+
+def run(n_services=5000, n_queries=100000):
+    services = make_services(n_services)
+    codes = sorted({s["station_code"] for s in services[0]["stops"]} | {"KGX", "WIM", "STP"})
+
+    t = time.perf_counter()
+    timetable = Timetable()
+    for service in services:
+        timetable.add(service)
+    load = time.perf_counter() - t
+
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    second = Timetable()
+    for service in services:
+        second.add(service)
+    memory = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(snapshot, "filename"))
+    tracemalloc.stop()
+
+    rnd = random.Random(2)
+    queries = [(rnd.randrange(n_services), rnd.choice(codes), rnd.choice(codes)) for _ in range(n_queries)]
+
+    t = time.perf_counter()
+    fast = [timetable.calls_at(i, x, after=y) for i, x, y in queries]
+    calls_at = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for i, x, _ in queries:
+        timetable.arrival(i, x)
+    arrival = time.perf_counter() - t
+
+    t = time.perf_counter()
+    slow = [scan_calls_at(services[i], x, y) for i, x, y in queries]
+    scan = time.perf_counter() - t
+    assert fast == slow
+
+    # a live refresh loop re-adding every service (with other stops dropped each time) must not grow the columns
+    stops = len(timetable.station)
+    refresh = 0.0
+    for seed in range(2, 7):
+        refreshed = make_services(n_services, seed)
+        t = time.perf_counter()
+        for service in refreshed:
+            timetable.add(service)
+        refresh += time.perf_counter() - t
+        assert len(timetable) == n_services
+        assert len(timetable.station) <= 2 * stops, "replaced services left their rows behind"
+    refresh /= 5
+    fresh = Timetable()
+    for service in refreshed:
+        fresh.add(service)
+    assert all(timetable.stops(i) == fresh.stops(i) for i in range(n_services))
+
+    print("{} services, {} stops".format(n_services, stops))
+    print("load                  {:8.3f}s".format(load))
+    print("refresh all           {:8.3f}s ({} stops held)".format(refresh, len(timetable.station)))
+    print("memory                {:8.1f} MB ({:.0f} bytes per stop)".format(memory / 1e6, memory / float(stops)))
+    print("calls_at              {:8.3f} us per query".format(calls_at / n_queries * 1e6))
+    print("arrival               {:8.3f} us per query".format(arrival / n_queries * 1e6))
+    print("scanning stops        {:8.3f} us per query".format(scan / n_queries * 1e6))
+
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,91 @@
+"""
+offline fixtures for the benchmarks, built from temp.json and the sample responses under providers/.
+nothing here touches the network.
+"""
+import copy
+import json
+import os
+import random
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PROVIDERS = os.path.join(ROOT, "providers")
+
+
+def _json(*path):
+    with open(os.path.join(ROOT, *path)) as f:
+        return json.load(f)
+
+
+def stations():
+    return _json("temp.json")
+
+
+def msn_line(s):
+    # one station record back as a type "A" row of the .msn file
+    from msn import interchange_status_structure, msn_record_pos
+
+    codes = {v: str(k) for k, v in interchange_status_structure.items()}
+    row = [" "] * 82
+    values = dict(s, interchange_size=codes[s["interchange_size"]],
+                  is_estimate="E" if s["is_estimate"] == "1" else " ")
+    for k, pos in msn_record_pos.items():
+        start, end = pos[0], pos[-1] + 1
+        row[start:end] = values[k].rjust(end - start) if k in ("easting", "northing", "change_time") \
+            else values[k].ljust(end - start)
+    return "".join(row).rstrip()
+
+
+def write_msn(path, records, copies=1):
+    """
+    an .msn file holding the station records (copies times over, for a bigger file). returns the number of rows.
+    """
+    lines = [msn_line(s) + "\n" for s in records]
+    with open(path, "w") as f:
+        f.write("/!! Start of file\n")
+        for _ in range(copies):
+            f.writelines(lines)
+    return len(lines) * copies
+
+
+def board():
+    return _json("providers", "transportapi", "ZFD-all-trains.json")
+
+
+def board_sequence(n, seed=1):
+    """
+    n successive polls of the ZFD board: platforms change, trains run late and leave, new ones appear.
+    """
+    rnd = random.Random(seed)
+    current = board()
+    boards = [current]
+    for i in range(1, n):
+        current = copy.deepcopy(current)
+        departures = current["departures"]["all"]
+        for d in departures:
+            r = rnd.random()
+            if r < 0.1:
+                d["platform"] = str(rnd.randrange(1, 5))
+            elif r < 0.2:
+                d["status"] = "LATE"
+                d["expected_departure_time"] = "23:{:02d}".format(rnd.randrange(60))
+        if departures and rnd.random() < 0.5:
+            departures.pop(0)
+            new = dict(rnd.choice(departures) if departures else boards[0]["departures"]["all"][0],
+                       train_uid="N{:05d}".format(i), service="9{:07d}".format(i))
+            departures.append(new)
+        boards.append(current)
+    return boards
+
+
+def darwin_delays():
+    return _json("providers", "darwin", "all-delays.json")
+
+
+def tfl_lines(copies=1):
+    """
+    the Line/Status sample (tfl-all-lines.json), repeated copies times with distinct ids.
+    """
+    lines = _json("providers", "tfl", "tfl-all-lines.json")
+    if copies == 1:
+        return lines
+    return [dict(line, id="{}-{}".format(line["id"], i)) for i in range(copies) for line in lines]
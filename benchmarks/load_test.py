@@ -0,0 +1,137 @@
+"""
+load test for the lookup service (server.py): starts it on a free port over a copy of temp.json,
+with /live pointed at the stub server, and runs keep-alive clients sending a mix of
+CRS / TIPLOC / name / nearest / live requests. halfway through, the dataset is rewritten
+so the run also covers a hot swap of the index. reports p50 / p99 latency and requests per second.
+
+usage: python benchmarks/load_test.py [clients] [seconds] [url]
+with a url (e.g. http://127.0.0.1:8080) an already running service is tested instead.
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from stub_server import StubServer  # noqa: E402
+
+PATHS = [
+    "/crs/ZFD", "/crs/KGX", "/crs/EDB", "/crs/LON",
+    "/tiploc/FRNDNLT", "/tiploc/KNGX",
+    "/name?q=coventry", "/name?q=kings+cross", "/name?q=edinburh", "/name?q=lond&limit=5",
+    "/nearest?lat=51.5308&lon=-0.1238&k=5", "/nearest?easting=15300&northing=61800",
+    "/live/ZFD", "/live/SAC",
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+async def client(host, port, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    rnd = random.Random()
+    try:
+        while time.perf_counter() < deadline:
+            path = rnd.choice(PATHS)
+            t = time.perf_counter()
+            writer.write("GET {} HTTP/1.1\r\nHost: {}\r\n\r\n".format(path, host).encode("latin-1"))
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b"\r\n":
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            body = await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t)
+            if status != 200:
+                errors.append((path, status, body[:100]))
+    finally:
+        writer.close()
+
+
+async def load(host, port, clients, seconds, halfway=None):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    tasks = [asyncio.ensure_future(client(host, port, deadline, latencies, errors)) for _ in range(clients)]
+    if halfway is not None:
+        await asyncio.sleep(seconds / 2.0)
+        await asyncio.get_running_loop().run_in_executor(None, halfway)
+    await asyncio.gather(*tasks)
+    return latencies, errors
+
+
+def report(latencies, errors, seconds, clients):
+    print("{} clients, {:.1f}s".format(clients, seconds))
+    print("requests      {:10d}".format(len(latencies)))
+    print("requests/s    {:10.0f}".format(len(latencies) / seconds))
+    print("p50           {:10.2f} ms".format(percentile(latencies, 50) * 1000))
+    print("p99           {:10.2f} ms".format(percentile(latencies, 99) * 1000))
+    print("max           {:10.2f} ms".format(max(latencies) * 1000))
+    print("errors        {:10d}".format(len(errors)))
+    for e in errors[:5]:
+        print("  ", e)
+
+
+def run_local(clients=50, seconds=10.0):
+    from server import LookupService
+    from transport_client import TransportClient
+    from response_cache import ResponseCache
+
+    workdir = tempfile.mkdtemp()
+    dict_file = os.path.join(workdir, "temp.json")
+    shutil.copy(os.path.join(ROOT, "temp.json"), dict_file)
+
+    with StubServer(delay=0.02) as stub:
+        upstream = TransportClient(base_url=stub.url, concurrency=20, cache=ResponseCache())
+        service = LookupService(dict_file, watch_interval=0.5, client=upstream)
+        started = threading.Event()
+        ports = []
+        loop = asyncio.new_event_loop()
+
+        def ready(port):
+            ports.append(port)
+            started.set()
+
+        thread = threading.Thread(target=lambda: loop.run_until_complete(service.serve("127.0.0.1", 0, ready)),
+                                  daemon=True)
+        thread.start()
+        started.wait()
+        first_load = service.loaded_at
+
+        def rewrite():
+            # what parse_CRS does: write a new dataset over the old one
+            with open(dict_file) as f:
+                records = json.load(f)
+            with open(dict_file + ".tmp", "w") as f:
+                json.dump(records, f, ensure_ascii=False)
+            os.replace(dict_file + ".tmp", dict_file)
+
+        latencies, errors = asyncio.run(load("127.0.0.1", ports[0], clients, seconds, rewrite))
+        report(latencies, errors, seconds, clients)
+        print("index swapped {:>9}".format("yes" if service.loaded_at != first_load else "no"))
+
+        upstream.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    if len(sys.argv) > 3:
+        url = urlsplit(sys.argv[3])
+        report(*asyncio.run(load(url.hostname, url.port or 80, clients, seconds)), seconds=seconds, clients=clients)
+    else:
+        run_local(clients, seconds)
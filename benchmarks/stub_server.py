@@ -0,0 +1,78 @@
+"""
+local stand-in for the TransportAPI, serving the sample responses under providers/transportapi.
+
+    /station/<CRS>/live.json                              -> ZFD-all-trains.json (station_code set to CRS)
+    /service/train_uid:<uid>/<date>/timetable.json        -> W64717-all-stops-today.json
+
+every response is delayed by `delay` seconds and a `fail_rate` share of them answer 503,
+to exercise timeouts, pooling and retries without touching the network.
+"""
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FIXTURES = os.path.join(ROOT, "providers", "transportapi")
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+class StubServer(object):
+
+    def __init__(self, delay=0.0, fail_rate=0.0, port=0):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.requests = 0
+
+        board = _load("ZFD-all-trains.json")
+        timetable = _load("W64717-all-stops-today.json")
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # send headers and body in one segment, otherwise keep-alive connections stall on delayed acks
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                path = self.path.split("?")[0].strip("/").split("/")
+                if stub.fail_rate and random.random() < stub.fail_rate:
+                    status, body = 503, {"error": "stub failure"}
+                elif len(path) == 3 and path[0] == "station":
+                    status, body = 200, dict(board, station_code=path[1].upper())
+                elif len(path) == 4 and path[0] == "service":
+                    status, body = 200, dict(timetable, train_uid=path[1].split(":")[-1], date=path[2])
+                else:
+                    status, body = 404, {"error": "not found"}
+
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
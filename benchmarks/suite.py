@@ -0,0 +1,277 @@
+"""
+the benchmark suite: parsing, lookups, search and live-data processing on offline fixtures (fixtures.py).
+
+every case is timed `--repeat` times (more for cases under MIN_SECONDS in total) and its best run kept, as microseconds per operation. results are
+saved to benchmarks/results/<time>.json and compared with a baseline (by default the previous results
+file); a case slower than the baseline by more than --threshold fails the run (exit code 1).
+
+    python benchmarks/suite.py                      # all cases
+    python benchmarks/suite.py lookup --quick       # cases matching "lookup", without the 100k sizes
+    python benchmarks/suite.py --baseline benchmarks/results/20181101T090000.json --threshold 0.1
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "test-api"))
+os.chdir(ROOT)
+
+import fixtures  # noqa: E402
+
+RESULTS = os.path.join(ROOT, "benchmarks", "results")
+QUERY_SIZES = (1, 1000, 100000)
+MIN_SECONDS = 0.2
+
+CASES = []
+
+
+def case(name):
+    """
+    registers setup(tmp) -> (run, operations). run() is what gets timed.
+    """
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+
+def _queries(values, n, seed=1):
+    rnd = random.Random(seed)
+    return [rnd.choice(values) for _ in range(n)]
+
+
+# parsing
+
+def _parse_case(mode):
+    def setup(tmp):
+        from main import parse_CRS
+
+        path = os.path.join(tmp, "bench.msn")
+        rows = fixtures.write_msn(path, fixtures.stations(), copies=10)
+        output = os.path.join(tmp, "parsed.json")
+        return (lambda: parse_CRS(filepath=path, mode=mode, output_file=output)), rows
+    return setup
+
+
+case("parse_CRS/stream")(_parse_case("stream"))
+case("parse_CRS/bulk")(_parse_case("bulk"))
+
+
+@case("darwin/board_from_json")
+def _darwin(tmp):
+    from darwin import board_from_json
+
+    data = fixtures.darwin_delays()
+    data = dict(data, delayedTrains=data["delayedTrains"] * 500)
+    return (lambda: board_from_json(data)), len(data["delayedTrains"])
+
+
+# lookups, through the functions the CLI calls
+
+def _lookup_case(function, field, argument, n):
+    def setup(tmp):
+        import main
+
+        lookup = getattr(main, function)
+        values = [s[field] for s in fixtures.stations() if s[field]]
+        queries = _queries(values, n)
+        lookup(**{argument: queries[0], "show_json": False})  # loads the index, not part of the timing
+
+        def run():
+            for q in queries:
+                lookup(**{argument: q, "show_json": False})
+        return run, n
+    return setup
+
+
+def _search_values():
+    # prefixes of station names, as typed
+    rnd = random.Random(2)
+    return [s["station_name"][:rnd.randrange(3, 10)].lower() for s in fixtures.stations()]
+
+
+for n in QUERY_SIZES:
+    case("lookup/crs/{}".format(n))(_lookup_case("station_from_CRS", "CRS_main", "crs", n))
+    case("lookup/tiploc/{}".format(n))(_lookup_case("station_from_TIPLOC", "TIPLOC", "tiploc", n))
+
+
+def _search_case(n):
+    def setup(tmp):
+        import main
+
+        queries = _queries(_search_values(), n)
+        main.station_from_name(station_name=queries[0], show_json=False)
+
+        def run():
+            for q in queries:
+                main.station_from_name(station_name=q, show_json=False)
+        return run, n
+    return setup
+
+
+for n in QUERY_SIZES:
+    case("search/name/{}".format(n))(_search_case(n))
+
+
+@case("lookup/nearest/1000")
+def _nearest(tmp):
+    import main
+
+    points = [(int(s["easting"]), int(s["northing"])) for s in fixtures.stations() if s["easting"] != "00000"]
+    queries = _queries(points, 1000)
+    main.nearest_stations(*queries[0], show_json=False)
+
+    def run():
+        for e, n in queries:
+            main.nearest_stations(e, n, show_json=False)
+    return run, len(queries)
+
+
+# live-data processing
+
+@case("boards/diff")
+def _board_diff(tmp):
+    from board_watch import diff_boards
+
+    boards = [b["departures"]["all"] for b in fixtures.board_sequence(200)]
+
+    def run():
+        for before, after in zip(boards, boards[1:]):
+            diff_boards("ZFD", before, after)
+    return run, len(boards) - 1
+
+
+@case("boards/timetable")
+def _timetable(tmp):
+    from timetable import Timetable
+
+    with open(os.path.join(fixtures.PROVIDERS, "transportapi", "W64717-all-stops-today.json")) as f:
+        sample = json.load(f)
+    services = [dict(sample, train_uid="S{:05d}".format(i)) for i in range(500)]
+
+    def run():
+        timetable = Timetable()
+        for s in services:
+            timetable.add(s)
+    return run, len(services)
+
+
+@case("tfl/line_disruptions")
+def _tfl(tmp):
+    import tfl
+    from bench_tfl_severity import make_feed
+
+    # the samples carry no line statuses, the feed is synthetic: every mode, mostly good service
+    with open(tfl.SEVERITY_FILE) as f:
+        lines = make_feed(len(fixtures.tfl_lines()) * 100, json.load(f))
+    model = tfl.severity_model()
+    assert any(model.line_disruptions(lines))
+    return (lambda: model.line_disruptions(lines)), len(lines)
+
+
+def measure(setup, repeat):
+    tmp = tempfile.mkdtemp()
+    try:
+        run, operations = setup(tmp)
+        best = None
+        runs = 0
+        spent = 0.0
+        # small cases run until they add up to MIN_SECONDS, so their best run is not noise
+        while runs < repeat or (spent < MIN_SECONDS and runs < 10000):
+            t = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+            runs += 1
+            spent += elapsed
+        return {"operations": operations, "seconds": best, "us_per_op": best / operations * 1e6,
+                "ops_per_s": operations / best if best else None}
+    finally:
+        shutil.rmtree(tmp)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    [(case, baseline us/op, current us/op, change)] for cases slower than baseline by more than threshold.
+    """
+    regressions = []
+    for name, r in results["cases"].items():
+        before = baseline["cases"].get(name)
+        if before is None or not before["us_per_op"]:
+            continue
+        change = r["us_per_op"] / before["us_per_op"] - 1
+        if change > threshold:
+            regressions.append((name, before["us_per_op"], r["us_per_op"], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("filter", nargs="*", help="run only cases containing one of these")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="skip the 100k query cases")
+    parser.add_argument("--baseline", help="results file to compare with (default: the latest one)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    selected = [(name, setup) for name, setup in CASES
+                if (not args.filter or any(f in name for f in args.filter))
+                and not (args.quick and name.endswith("/100000"))]
+
+    baseline_file = args.baseline
+    if baseline_file is None:
+        previous = sorted(glob.glob(os.path.join(RESULTS, "*.json")))
+        baseline_file = previous[-1] if previous else None
+
+    results = {"created": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _commit(),
+               "python": platform.python_version(), "machine": platform.machine(), "cases": {}}
+    for name, setup in selected:
+        r = results["cases"][name] = measure(setup, args.repeat)
+        print("{:28s} {:10.2f} us/op {:14,.0f} ops/s  ({} ops)".format(
+            name, r["us_per_op"], r["ops_per_s"] or 0, r["operations"]), flush=True)
+
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok=True)
+        path = os.path.join(RESULTS, "{}.json".format(datetime.datetime.now().strftime("%Y%m%dT%H%M%S")))
+        with open(path, "w") as f:
+            json.dump(results, f, indent=4)
+        print("saved {}".format(os.path.relpath(path, ROOT)))
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print("compared with {} ({})".format(os.path.relpath(baseline_file, ROOT), baseline.get("commit")))
+        for name, before, after, change in regressions:
+            print("  REGRESSION {:28s} {:10.2f} -> {:10.2f} us/op (+{:.0%})".format(name, before, after, change))
+        if regressions:
+            return 1
+        print("  no case slower by more than {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    if "PYTHONHASHSEED" not in os.environ:
+        # set and dict iteration order changes the work some cases do, fix it so runs compare
+        os.execve(sys.executable, [sys.executable] + sys.argv, dict(os.environ, PYTHONHASHSEED="0"))
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+watches departure boards and emits only what changed.
+
+every interval the boards of all watched stations are fetched concurrently (TransportClient.stations),
+each departure is matched with the previous board by train_uid + service, and one event is emitted per change:
+
+    {"event": "new", ...}            departure appeared on the board
+    {"event": "gone", ...}           departure left the board (departed, or dropped off the end)
+    {"event": "platform", ...}       platform changed
+    {"event": "status", ...}         status changed, e.g. ON TIME -> LATE or CANCELLED
+    {"event": "expected", ...}       expected departure time changed
+
+    python main.py watch ZFD SAC --interval 30 > events.jsonl
+    python main.py watch ZFD --replay board1.json board2.json
+
+every event carries station, train_uid, service, aimed_departure_time, destination_name and, for changes,
+"before" / "after". the first board of a station is a snapshot: all its departures come out as "new".
+"""
+import argparse
+import json
+import sys
+
+# fields compared between boards, and the event each one raises
+WATCHED_FIELDS = (
+    ("platform", "platform"),
+    ("status", "status"),
+    ("expected_departure_time", "expected"),
+)
+
+
+def departure_key(d):
+    return (d["train_uid"], d["service"])
+
+
+def _event(event, station, d, **extra):
+    e = {"event": event, "station": station, "train_uid": d["train_uid"], "service": d["service"],
+         "aimed_departure_time": d.get("aimed_departure_time"), "destination_name": d.get("destination_name")}
+    e.update(extra)
+    return e
+
+
+def diff_boards(station, before, after):
+    """
+    change events between two departures.all lists of one station, in the order of the new board
+    (departures that left the board last).
+    """
+    previous = {departure_key(d): d for d in before}
+    events = []
+    seen = set()
+    for d in after:
+        key = departure_key(d)
+        seen.add(key)
+        old = previous.get(key)
+        if old is None:
+            events.append(_event("new", station, d, platform=d.get("platform"), status=d.get("status"),
+                                 expected_departure_time=d.get("expected_departure_time")))
+            continue
+        for field, event in WATCHED_FIELDS:
+            if old.get(field) != d.get(field):
+                events.append(_event(event, station, d, before=old.get(field), after=d.get(field)))
+    for key, d in previous.items():
+        if key not in seen:
+            events.append(_event("gone", station, d))
+    return events
+
+
+class BoardWatcher(object):
+    """
+    polls stations and keeps the last board of each.
+    fetch is a coroutine function taking the list of CRS codes and returning one board (search_by_station
+    response) per code, or an exception for a station that failed; by default the shared TransportClient.
+    """
+
+    def __init__(self, stations, interval=30.0, count=10, fetch=None, on_event=None):
+        self.stations = [s.upper() for s in stations]
+        self.interval = interval
+        self.count = count
+        self.fetch = fetch
+        self.on_event = on_event
+        self.boards = {}
+        self.polls = 0
+
+    async def _fetch(self):
+        if self.fetch is not None:
+            return await self.fetch(self.stations)
+        from transport_client import get_client
+        return await get_client().stations(self.stations, self.count)
+
+    async def poll(self):
+        """
+        fetches every board once and returns the events since the previous poll.
+        a station whose request failed keeps its last board, so its departures are not reported gone.
+        """
+        boards = await self._fetch()
+        events = []
+        for station, board in zip(self.stations, boards):
+            if isinstance(board, Exception) or "departures" not in board:
+                continue
+            departures = board["departures"]["all"] or []
+            events += diff_boards(station, self.boards.get(station, []), departures)
+            self.boards[station] = departures
+        self.polls += 1
+
+        if self.on_event is not None:
+            for e in events:
+                self.on_event(e)
+        return events
+
+    async def events(self, polls=None):
+        """
+        async iterator over change events, polling every interval seconds (polls times, or forever).
+        """
+        import asyncio
+
+        while polls is None or self.polls < polls:
+            for e in await self.poll():
+                yield e
+            if polls is None or self.polls < polls:
+                await asyncio.sleep(self.interval)
+
+
+def replay(boards_by_station):
+    """
+    a fetch for BoardWatcher that answers from recorded boards instead of the api:
+    {CRS: [board, board, ...]}, one board per poll, the last one repeating.
+    """
+    served = {}
+
+    async def fetch(stations):
+        output = []
+        for s in stations:
+            boards = boards_by_station.get(s)
+            if not boards:
+                output.append(KeyError(s))
+                continue
+            i = served.get(s, 0)
+            output.append(boards[min(i, len(boards) - 1)])
+            served[s] = i + 1
+        return output
+
+    return fetch
+
+
+def watch_main(argv):
+    import asyncio
+
+    parser = argparse.ArgumentParser(prog="main.py watch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stations", nargs="+", help="CRS codes to watch")
+    parser.add_argument("--interval", type=float, default=30.0, help="seconds between polls")
+    parser.add_argument("--count", type=int, default=10, help="departures per board")
+    parser.add_argument("--polls", type=int, help="stop after this many polls")
+    parser.add_argument("--replay", nargs="+", metavar="BOARD",
+                        help="recorded boards (JSON files) replayed in order instead of calling the api")
+    args = parser.parse_args(argv)
+
+    fetch = None
+    if args.replay:
+        boards = {}
+        for filepath in args.replay:
+            with open(filepath) as f:
+                board = json.load(f)
+            boards.setdefault(board["station_code"].upper(), []).append(board)
+        fetch = replay(boards)
+        if args.polls is None:
+            args.polls = max(len(b) for b in boards.values())
+            args.interval = 0
+
+    watcher = BoardWatcher(args.stations, interval=args.interval, count=args.count, fetch=fetch)
+
+    async def run():
+        async for e in watcher.events(args.polls):
+            sys.stdout.write(json.dumps(e, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,538 @@
+# parser for the schedules in the ATOC timetable (CIF) file of the same download as the .msn file
+# ref: http://data.atoc.org/sites/all/themes/atoc/files/rsps5041%20-%20Timetable%20Data.pdf
+# every row is 80 characters, the first two are the record type. a schedule is a "BS" (basic schedule) row,
+# an optional "BX" (extra details) row, then its locations: "LO" (origin), "LI" (intermediate) and "LT" (terminating).
+#
+# the file is read in byte ranges that start on a "BS" row, so every range holds whole schedules and
+# the ranges are parsed in parallel by a process pool, then appended to disk one by one. the result is a
+# columnar store: a directory of .npy columns (behind a symlink, switched when a new store is complete),
+# one row per schedule and one row per location, with the locations also ordered by TIPLOC so
+# everything at a station is one slice (joined to the station index by TIPLOC).
+#
+#     parse_cif("./data/ttis074/ttisf074.mca", "timetable.cif")
+#     store = CifStore("timetable.cif")
+#     store.at_station("SAC", get_index())
+import os
+import random
+import re
+import shutil
+import time
+
+import numpy as np
+
+from timetable import MINUTES_PER_DAY, NO_TIME
+
+# the below are indices. to slice, the end_index = end_index + 1 (same convention as msn.py)
+cif_schedule_pos = {
+    "transaction_type": [2],
+    "train_uid": [3, 8],
+    "runs_from": [9, 14],
+    "runs_to": [15, 20],
+    "days_run": [21, 27],
+    "bank_holiday_running": [28],
+    "train_status": [29],
+    "train_category": [30, 31],
+    "headcode": [32, 35],
+    "service_code": [41, 48],
+    "power_type": [50, 52],
+    "speed": [57, 59],
+    "stp_indicator": [79],
+}
+
+cif_extra_pos = {
+    "uic_code": [6, 10],
+    "atoc_code": [11, 12],
+    "applicable_timetable": [13],
+}
+
+# location rows: TIPLOC [2, 8] and its suffix [9] (which visit, for loops), times are "HHMM" or "HHMMH" (+30 s)
+cif_origin_pos = {
+    "TIPLOC": [2, 8],
+    "departure": [10, 14],
+    "public_departure": [15, 18],
+    "platform": [19, 21],
+    "activity": [29, 40],
+}
+
+cif_intermediate_pos = {
+    "TIPLOC": [2, 8],
+    "arrival": [10, 14],
+    "departure": [15, 19],
+    "pass": [20, 24],
+    "public_arrival": [25, 28],
+    "public_departure": [29, 32],
+    "platform": [33, 35],
+    "activity": [42, 53],
+}
+
+cif_terminating_pos = {
+    "TIPLOC": [2, 8],
+    "arrival": [10, 14],
+    "public_arrival": [15, 18],
+    "platform": [19, 21],
+    "activity": [25, 36],
+}
+
+_location_pos = {b"LO": cif_origin_pos, b"LI": cif_intermediate_pos, b"LT": cif_terminating_pos}
+
+# columns of the store and their dtypes
+schedule_columns = {
+    "train_uid": "S6", "transaction_type": "S1", "stp_indicator": "S1", "runs_from": "S6", "runs_to": "S6",
+    "days_run": "S7", "bank_holiday_running": "S1", "train_status": "S1", "train_category": "S2",
+    "headcode": "S4", "service_code": "S8", "power_type": "S3", "speed": "S3", "atoc_code": "S2",
+    "first_stop": "i4", "n_stops": "i2",
+}
+stop_columns = {
+    "schedule": "i4", "tiploc": "i4",
+    # minutes since midnight of the day the train starts, past 1440 after midnight, NO_TIME if blank
+    "arrival": "i2", "departure": "i2", "pass": "i2", "public_arrival": "i2", "public_departure": "i2",
+    "platform": "S3", "activity": "S12",
+}
+_time_fields = ("arrival", "departure", "pass", "public_arrival", "public_departure")
+_working_times = ("arrival", "departure", "pass")
+
+# ~16 MB of file per task keeps every worker's lists small
+CHUNK_BYTES = 16 << 20
+# rows per block when columns are copied or renumbered on disk
+BLOCK_ROWS = 1 << 20
+
+
+def _slices(pos):
+    return [(k, slice(v[0], v[-1] + 1)) for k, v in pos.items()]
+
+
+_schedule_slices = _slices(cif_schedule_pos)
+_extra_slices = dict(_slices(cif_extra_pos))
+
+
+def _location_layout(pos):
+    # (TIPLOC, platform, activity, [(time field, slice or None)]) of one location record type
+    s = dict(_slices(pos))
+    return s["TIPLOC"], s["platform"], s["activity"], [(field, s.get(field)) for field in _time_fields]
+
+
+_location_slices = {kind: _location_layout(pos) for kind, pos in _location_pos.items()}
+
+
+def _minutes(value):
+    # b"0932H" -> 572, the half minute is dropped; public times of "0000" mean no public time
+    value = value.strip()
+    if not value:
+        return NO_TIME
+    return int(value[:2]) * 60 + int(value[2:4])
+
+
+def chunk_offsets(filepath, chunk_bytes=CHUNK_BYTES):
+    """
+    byte offsets splitting the file into ranges of about chunk_bytes, each starting on a "BS" row
+    (the first at 0). returns [(start, end)].
+    """
+    size = os.path.getsize(filepath)
+    starts = [0]
+    with open(filepath, "rb") as f:
+        target = chunk_bytes
+        while target < size:
+            f.seek(target)
+            f.readline()  # rest of the row the target fell in
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    offset = size
+                    break
+                if line[:2] == b"BS":
+                    break
+            if offset >= size:
+                break
+            if offset > starts[-1]:
+                starts.append(offset)
+            target = offset + chunk_bytes
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _parse_range(task):
+    """
+    parses the schedules in one byte range into numpy columns. schedule numbers are local to the range,
+    TIPLOCs are returned as strings and numbered when the ranges are merged.
+    """
+    filepath, start, end = task
+    schedules = {k: [] for k in schedule_columns}
+    stops = {k: [] for k in stop_columns}
+    stops["tiploc"] = tiplocs = []
+
+    n_schedules = -1
+    last = -1
+    day = 0
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            kind = line[:2]
+
+            layout = _location_slices.get(kind)
+            if layout is not None:
+                if n_schedules < 0:
+                    continue
+                tiploc, platform, activity, times = layout
+                tiplocs.append(line[tiploc].strip())
+                stops["schedule"].append(n_schedules)
+                stops["platform"].append(line[platform].strip())
+                stops["activity"].append(line[activity].rstrip())
+                for field, s in times:
+                    t = NO_TIME if s is None else _minutes(line[s])
+                    if t == NO_TIME:
+                        pass
+                    elif field in _working_times:
+                        # times wrap at midnight, a working time earlier than the last one is the next day
+                        t += day
+                        if t < last:
+                            day += MINUTES_PER_DAY
+                            t += MINUTES_PER_DAY
+                        last = t
+                    elif line[s] == b"0000":
+                        # not a public call
+                        t = NO_TIME
+                    else:
+                        # public times follow the working time of the same row
+                        t += day
+                        if t < last - 12 * 60:
+                            t += MINUTES_PER_DAY
+                    stops[field].append(t)
+                schedules["n_stops"][-1] += 1
+
+            elif kind == b"BS":
+                n_schedules += 1
+                last = -1
+                day = 0
+                for k, s in _schedule_slices:
+                    schedules[k].append(line[s].strip())
+                schedules["atoc_code"].append(b"")
+                schedules["first_stop"].append(len(tiplocs))
+                schedules["n_stops"].append(0)
+
+            elif kind == b"BX" and n_schedules >= 0:
+                schedules["atoc_code"][-1] = line[_extra_slices["atoc_code"]].strip()
+
+    columns = {"schedules": {k: np.array(v, dtype=schedule_columns[k]) for k, v in schedules.items()},
+               "stops": {k: np.array(v, dtype=stop_columns[k] if k != "tiploc" else "S7") for k, v in stops.items()}}
+    return columns
+
+
+class _ColumnFile(object):
+    """
+    one column of the store, appended to a raw file range by range and turned into a .npy file
+    at the end, so no more than one range of it is ever in memory.
+    """
+
+    def __init__(self, directory, name, dtype):
+        self.path = os.path.join(directory, name + ".npy")
+        self.raw = self.path + ".raw"
+        self.dtype = np.dtype(dtype)
+        self.file = open(self.raw, "wb")
+        self.n = 0
+
+    def append(self, values):
+        np.ascontiguousarray(values, dtype=self.dtype).tofile(self.file)
+        self.n += len(values)
+
+    def close(self):
+        self.file.close()
+        column = np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype, shape=(self.n,))
+        for start in range(0, self.n, BLOCK_ROWS):
+            block = np.fromfile(self.raw, dtype=self.dtype, count=min(BLOCK_ROWS, self.n - start),
+                                offset=start * self.dtype.itemsize)
+            column[start:start + len(block)] = block
+        column.flush()
+        del column
+        os.remove(self.raw)
+
+
+def _parsed_ranges(tasks, processes):
+    if processes == 1 or len(tasks) == 1:
+        for task in tasks:
+            yield _parse_range(task)
+        return
+
+    from multiprocessing import Pool
+
+    with Pool(processes) as pool:
+        # in file order, each range is written out as soon as it arrives
+        for part in pool.imap(_parse_range, tasks):
+            yield part
+
+
+def _index_tiplocs(directory, tiploc_ids, n_stops):
+    """
+    renumbers the stops' TIPLOCs (numbered as first seen) in sorted TIPLOC order and writes the
+    stop rows grouped by TIPLOC (a counting sort, block by block over the memory-mapped column).
+    """
+    names = np.array(list(tiploc_ids), dtype="S7")
+    order = np.argsort(names, kind="stable")
+    rank = np.empty(len(order), dtype="i4")
+    rank[order] = np.arange(len(order), dtype="i4")
+    np.save(os.path.join(directory, "tiplocs.npy"), names[order])
+
+    ids = np.load(os.path.join(directory, "tiploc.npy"), mmap_mode="r+")
+    counts = np.zeros(len(names), dtype=np.int64)
+    for start in range(0, n_stops, BLOCK_ROWS):
+        block = rank[ids[start:start + BLOCK_ROWS]]
+        ids[start:start + len(block)] = block
+        counts += np.bincount(block, minlength=len(names))
+    ids.flush()
+
+    tiploc_start = np.zeros(len(names) + 1, dtype="i4")
+    np.cumsum(counts, out=tiploc_start[1:])
+    np.save(os.path.join(directory, "tiploc_start.npy"), tiploc_start)
+
+    # the locations again, grouped by TIPLOC (in schedule order within one)
+    by_tiploc = np.lib.format.open_memmap(os.path.join(directory, "by_tiploc.npy"), mode="w+", dtype="i4",
+                                          shape=(n_stops,))
+    cursor = tiploc_start[:-1].astype(np.int64)
+    for start in range(0, n_stops, BLOCK_ROWS):
+        block = np.asarray(ids[start:start + BLOCK_ROWS])
+        rows = np.argsort(block, kind="stable")
+        sorted_ids = block[rows]
+        n = np.bincount(sorted_ids, minlength=len(names))
+        within = np.arange(len(block)) - (np.cumsum(n) - n)[sorted_ids]
+        by_tiploc[cursor[sorted_ids] + within] = rows + start
+        cursor += n
+    by_tiploc.flush()
+
+
+def _switch(directory, version):
+    """
+    points directory (a symlink) at its sibling version, replacing the link in one rename as
+    refresh.switch does: a reader finds the old store or the new one, never none. the store it
+    replaces is kept, a reader that resolved the link before the switch may still be loading it,
+    and older versions are removed.
+    """
+    old = None
+    if os.path.islink(directory):
+        old = os.path.realpath(directory)
+    elif os.path.isdir(directory):
+        # a store from before the link, moved aside once
+        old = "{}.{}.old".format(directory, os.getpid())
+        os.rename(directory, old)
+    tmp = "{}.{}.link".format(directory, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(version, tmp)
+    os.replace(tmp, directory)
+
+    parent = os.path.dirname(directory) or "."
+    keep = {os.path.realpath(directory), old and os.path.realpath(old)}
+    versions = re.compile(re.escape(os.path.basename(directory)) + r"\.[0-9a-f]+(\.old)?$")
+    for name in os.listdir(parent):
+        path = os.path.join(parent, name)
+        if versions.match(name) and os.path.isdir(path) and not os.path.islink(path) \
+                and os.path.realpath(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def parse_cif(filepath, output_dir, processes=None, chunk_bytes=CHUNK_BYTES):
+    """
+    parses every schedule of a CIF file into the columnar store in output_dir.
+    processes=1 parses in this process, otherwise the byte ranges go to a pool (default: one per CPU).
+    every range's columns are appended to disk as it comes back, so memory stays at a few ranges
+    whatever the size of the file. the store is built in a sibling directory (output_dir.<version>)
+    and output_dir is a symlink switched to it when complete.
+    returns (number of schedules, number of locations).
+    """
+    output_dir = output_dir.rstrip("/")
+    version = "{}.{:x}".format(os.path.basename(output_dir), time.time_ns())
+    directory = os.path.join(os.path.dirname(output_dir), version)
+    os.makedirs(directory)
+
+    try:
+        schedules = {k: _ColumnFile(directory, k, dtype) for k, dtype in schedule_columns.items()}
+        stops = {k: _ColumnFile(directory, k, dtype) for k, dtype in stop_columns.items()}
+        tiploc_ids = {}
+        n_schedules = n_stops = 0
+
+        tasks = [(filepath, start, end) for start, end in chunk_offsets(filepath, chunk_bytes)]
+        for part in _parsed_ranges(tasks, processes):
+            part_schedules, part_stops = part["schedules"], part["stops"]
+            # local schedule and stop numbers continue from the previous range
+            part_schedules["first_stop"] += n_stops
+            part_stops["schedule"] += n_schedules
+            # TIPLOCs numbered as first seen, sorted once all are known
+            codes, inverse = np.unique(part_stops["tiploc"], return_inverse=True)
+            ids = np.array([tiploc_ids.setdefault(c, len(tiploc_ids)) for c in codes.tolist()], dtype="i4")
+            part_stops["tiploc"] = ids[inverse]
+
+            for k, column in schedules.items():
+                column.append(part_schedules[k])
+            for k, column in stops.items():
+                column.append(part_stops[k])
+            n_schedules += len(part_schedules["train_uid"])
+            n_stops += len(part_stops["schedule"])
+
+        for column in list(schedules.values()) + list(stops.values()):
+            column.close()
+        _index_tiplocs(directory, tiploc_ids, n_stops)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    _switch(output_dir, version)
+    return n_schedules, n_stops
+
+
+class CifStore(object):
+    """
+    a store written by parse_cif, memory-mapped column by column.
+        schedules   train_uid, runs_from, runs_to, days_run, stp_indicator, atoc_code, ..., first_stop, n_stops
+        stops       schedule, tiploc, arrival, departure, pass, public_*, platform, activity
+        tiplocs     sorted TIPLOC codes, stops["tiploc"] indexes it. by_tiploc[tiploc_start[t]:tiploc_start[t + 1]]
+                    are the stop rows at TIPLOC t
+    """
+
+    def __init__(self, directory):
+        # the link is resolved once, every column comes from the same version even if it is switched meanwhile
+        version = os.path.realpath(directory)
+
+        def load(name):
+            return np.load(os.path.join(version, name + ".npy"), mmap_mode="r")
+
+        self.directory = directory
+        self.version = version
+        self.schedules = {k: load(k) for k in schedule_columns}
+        self.stops = {k: load(k) for k in stop_columns}
+        self.tiplocs = load("tiplocs")
+        self.by_tiploc = load("by_tiploc")
+        self.tiploc_start = load("tiploc_start")
+        self.tiploc_ids = {t.decode("latin-1"): i for i, t in enumerate(self.tiplocs.tolist())}
+
+    def __len__(self):
+        return len(self.schedules["train_uid"])
+
+    def schedule(self, i):
+        """
+        one schedule as a dict, its locations under "stops" with times as "HH:MM".
+        """
+        from timetable import format_minutes
+
+        header = {k: (v[i].decode("latin-1") if v.dtype.kind == "S" else int(v[i]))
+                  for k, v in self.schedules.items() if k not in ("first_stop", "n_stops")}
+        first = int(self.schedules["first_stop"][i])
+        rows = range(first, first + int(self.schedules["n_stops"][i]))
+        header["stops"] = [self._stop(r, format_minutes) for r in rows]
+        return header
+
+    def _stop(self, row, format_minutes):
+        stop = {"TIPLOC": self.tiplocs[self.stops["tiploc"][row]].decode("latin-1")}
+        for field in _time_fields:
+            stop[field] = format_minutes(int(self.stops[field][row]))
+        stop["platform"] = self.stops["platform"][row].decode("latin-1") or None
+        stop["activity"] = self.stops["activity"][row].decode("latin-1")
+        return stop
+
+    def rows_at(self, tiploc):
+        """
+        stop rows (numpy array) at a TIPLOC, empty if no schedule goes there.
+        """
+        t = self.tiploc_ids.get(tiploc.upper())
+        if t is None:
+            return np.zeros(0, dtype="i4")
+        return self.by_tiploc[self.tiploc_start[t]:self.tiploc_start[t + 1]]
+
+    def calls_at(self, tiploc):
+        """
+        numbers of the schedules that call at (not just pass) a TIPLOC.
+        """
+        rows = self.rows_at(tiploc)
+        calls = (self.stops["arrival"][rows] != NO_TIME) | (self.stops["departure"][rows] != NO_TIME)
+        return np.unique(self.stops["schedule"][rows[calls]])
+
+    def at_station(self, crs, index):
+        """
+        schedules calling at any TIPLOC of a station, through the station index.
+        """
+        tiplocs = {s["TIPLOC"] for s in index.by_crs(crs)}
+        found = [self.calls_at(t) for t in tiplocs]
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype="i4")
+
+    def tiploc_crs(self, index):
+        """
+        CRS code of every TIPLOC in the store (aligned with tiplocs), "" where the station index has none.
+        """
+        crs = [(index.by_tiploc(t.decode("latin-1")) or [{"CRS_main": ""}])[0]["CRS_main"]
+               for t in self.tiplocs.tolist()]
+        return np.array(crs, dtype="U3")
+
+
+def _format_record(kind, pos, values):
+    row = bytearray(kind + b" " * 78)
+    for k, v in values.items():
+        start, end = pos[k][0], pos[k][-1] + 1
+        row[start:end] = v.encode("latin-1").ljust(end - start)[:end - start]
+    return bytes(row) + b"\n"
+
+
+def _hhmm(minutes, half=False):
+    minutes %= MINUTES_PER_DAY
+    return "{:02d}{:02d}".format(minutes // 60, minutes % 60) + ("H" if half else "")
+
+
+def write_synthetic_cif(filepath, n_schedules, tiplocs=None, seed=1):
+    """
+    writes a CIF file of n_schedules made-up schedules (BS, BX, LO, LI..., LT), for tests and benchmarks.
+    tiplocs: the TIPLOCs to route through, by default those of temp.json. returns the file size.
+    """
+    if tiplocs is None:
+        import json
+
+        with open("temp.json") as f:
+            tiplocs = sorted({s["TIPLOC"] for s in json.load(f) if s["TIPLOC"]})
+    rnd = random.Random(seed)
+
+    with open(filepath, "wb") as f:
+        f.write(b"HDTPS.UDFROC1.PD1811010111181234DFROC1F       FA011118311218".ljust(80) + b"\n")
+        for i in range(n_schedules):
+            f.write(_format_record(b"BS", cif_schedule_pos, {
+                "transaction_type": "N", "train_uid": "{}{:05d}".format("CGLPWY"[i % 6], i % 100000),
+                "runs_from": "181101", "runs_to": "181231", "days_run": rnd.choice(("1111100", "0000010", "0000001")),
+                "bank_holiday_running": "", "train_status": "P", "train_category": "OO",
+                "headcode": "{}{}{:02d}".format(rnd.randrange(1, 10), "ABCDEFGHJKLMNPRSTUVWXYZ"[i % 23], i % 100),
+                "service_code": "{:08d}".format(21000000 + i % 900000), "power_type": "EMU", "speed": "100",
+                "stp_indicator": "P"}))
+            f.write(_format_record(b"BX", cif_extra_pos, {"uic_code": "", "atoc_code": rnd.choice(("TL", "SW", "GW")),
+                                                          "applicable_timetable": "Y"}))
+
+            n = rnd.randrange(2, 30)
+            t = rnd.randrange(5 * 60, 24 * 60)
+            route = rnd.sample(tiplocs, n)
+            for j, tiploc in enumerate(route):
+                platform = str(rnd.randrange(1, 9))
+                if j == 0:
+                    f.write(_format_record(b"LO", cif_origin_pos, {
+                        "TIPLOC": tiploc, "departure": _hhmm(t), "public_departure": _hhmm(t),
+                        "platform": platform, "activity": "TB"}))
+                elif j == n - 1:
+                    f.write(_format_record(b"LT", cif_terminating_pos, {
+                        "TIPLOC": tiploc, "arrival": _hhmm(t), "public_arrival": _hhmm(t),
+                        "platform": platform, "activity": "TF"}))
+                elif rnd.random() < 0.3:
+                    f.write(_format_record(b"LI", cif_intermediate_pos, {"TIPLOC": tiploc, "pass": _hhmm(t, True)}))
+                else:
+                    f.write(_format_record(b"LI", cif_intermediate_pos, {
+                        "TIPLOC": tiploc, "arrival": _hhmm(t), "departure": _hhmm(t + 1),
+                        "public_arrival": _hhmm(t), "public_departure": _hhmm(t + 1),
+                        "platform": platform, "activity": "T"}))
+                    t += 1
+                t += rnd.randrange(2, 9)
+        f.write(b"ZZ" + b" " * 78 + b"\n")
+        return f.tell()
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # python cif.py ./data/ttis074/ttisf074.mca timetable.cif [processes]
+    n_schedules, n_stops = parse_cif(sys.argv[1], sys.argv[2], *[int(a) for a in sys.argv[3:4]])
+    print("{} schedules, {} locations".format(n_schedules, n_stops))
+    print(json.dumps(CifStore(sys.argv[2]).schedule(0), indent=4, ensure_ascii=False))
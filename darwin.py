@@ -0,0 +1,218 @@
+"""
+National Rail Darwin / Knowledgebase responses (samples in providers/darwin) in the same shapes as the TransportAPI ones.
+
+    parse_station_board(xml)       LDBWS GetStationBoard / GetDepartureBoard SOAP response
+    board_from_json(data)          the same board as JSON (huxley), or its delays variant (all-delays.json)
+    iter_disruptions(xml)          Knowledgebase disruption responses (With_CRS.xml, all-status-station-soap.xml, ...)
+
+boards come back like search_by_station: {"station_code", "station_name", "date", "time_of_day", "request_time",
+"departures": {"all": [...]}} with TransportAPI departure fields. Darwin has no train_uid, the service's
+rsid (or its serviceID) stands in for it and serviceID is the "service".
+
+XML is read with iterparse: each service / disruption element is converted and dropped as soon as it is
+complete, so a large board never exists as a whole tree in memory.
+"""
+import re
+import xml.etree.ElementTree as ET
+
+
+_local_names = {}
+
+
+def _local(tag):
+    # "{namespace}name" -> "name", the same few tags repeat in every record
+    name = _local_names.get(tag)
+    if name is None:
+        name = _local_names[tag] = tag.rsplit("}", 1)[-1]
+    return name
+
+
+def _iter_records(source, record_tag, context=None):
+    """
+    yields (element, context) for every record_tag element of an XML file or file object, as each one ends.
+    context maps (parent tag, tag) of leaf elements seen before the record, e.g. the board's crs,
+    to a key in the context dict. yielded elements are removed from the tree afterwards.
+    """
+    context = context or {}
+    values = {}
+    # open elements outside records, inside a record only its end matters
+    stack = []
+    inside = False
+    for event, el in ET.iterparse(source, events=("start", "end")):
+        if inside:
+            if event == "end" and el is record:
+                inside = False
+                yield el, values
+                stack[-1].remove(el)
+            continue
+        if event == "start":
+            if _local(el.tag) == record_tag:
+                inside = True
+                record = el
+            else:
+                stack.append(el)
+            continue
+        stack.pop()
+        if stack:
+            key = context.get((_local(stack[-1].tag), _local(el.tag)))
+            if key is not None:
+                values[key] = el.text
+
+
+def _locations(el):
+    # <origin><location><locationName/><crs/><via/></location>...</origin>
+    return [{_local(c.tag): c.text for c in location} for location in el]
+
+
+def _service(el):
+    # a service element as the JSON (huxley) service dict
+    service = {}
+    for child in el:
+        tag = _local(child.tag)
+        if tag in ("origin", "destination", "currentOrigins", "currentDestinations"):
+            service[tag] = _locations(child)
+        elif len(child) == 0:
+            service[tag] = child.text
+    return service
+
+
+_time = re.compile(r"^\d\d:\d\d$")
+
+
+def _status(std, etd, cancelled):
+    # etd is "On time", "Delayed", "Cancelled" or the expected time; any other text ("No report") says nothing
+    if cancelled or etd == "Cancelled":
+        return "CANCELLED", None
+    if etd in (None, "On time"):
+        return "ON TIME", std
+    if etd == "Delayed":
+        return "LATE", None
+    if not _time.match(etd):
+        return "NO REPORT", None
+    if std and _time.match(std) and etd != std:
+        # past midnight the expected time wraps, a difference of more than 12 hours is the other way round
+        late = (etd > std) != (abs(int(etd[:2]) - int(std[:2])) > 12)
+        return "LATE" if late else "EARLY", etd
+    return "ON TIME", etd
+
+
+def _names(locations):
+    return " & ".join(l["locationName"] for l in locations or [] if l.get("locationName")) or None
+
+
+def departure_from_darwin(service):
+    """
+    one Darwin service (JSON shape) as a TransportAPI departure.
+    """
+    cancelled = service.get("isCancelled") in (True, "true")
+    status, expected_departure = _status(service.get("std"), service.get("etd"), cancelled)
+    _, expected_arrival = _status(service.get("sta"), service.get("eta"), cancelled)
+    return {
+        "mode": "train" if service.get("serviceType") in (None, 0, "train") else service["serviceType"],
+        "service": service.get("serviceID"),
+        "train_uid": service.get("rsid") or service.get("serviceID"),
+        "platform": service.get("platform"),
+        "operator": service.get("operatorCode"),
+        "operator_name": service.get("operator"),
+        "aimed_departure_time": service.get("std"),
+        "aimed_arrival_time": service.get("sta"),
+        "aimed_pass_time": None,
+        "origin_name": _names(service.get("origin")),
+        "destination_name": _names(service.get("destination")),
+        "source": "Darwin",
+        "category": None,
+        "status": status,
+        "expected_arrival_time": expected_arrival,
+        "expected_departure_time": expected_departure,
+    }
+
+
+def _board(crs, name, generated_at, departures):
+    generated_at = generated_at or ""
+    return {
+        "date": generated_at[:10] or None,
+        "time_of_day": generated_at[11:16] or None,
+        "request_time": generated_at or None,
+        "station_name": name,
+        "station_code": crs,
+        "departures": {"all": departures},
+    }
+
+
+def board_from_json(data):
+    """
+    a JSON station board (trainServices) or delays response (delayedTrains) as a TransportAPI board.
+    """
+    services = (data.get("trainServices") or []) + (data.get("delayedTrains") or [])
+    return _board(data.get("crs"), data.get("locationName"), data.get("generatedAt"),
+                  [departure_from_darwin(s) for s in services])
+
+
+_board_context = {(result, field): field
+                  for result in ("GetStationBoardResult", "GetDepartureBoardResult")
+                  for field in ("crs", "locationName", "generatedAt")}
+
+
+def iter_departures(source):
+    """
+    yields (departure, board context) for every service of a SOAP station board, streaming.
+    """
+    for el, context in _iter_records(source, "service", _board_context):
+        yield departure_from_darwin(_service(el)), context
+
+
+def parse_station_board(source):
+    departures = []
+    context = {}
+    for departure, context in iter_departures(source):
+        departures.append(departure)
+    return _board(context.get("crs"), context.get("locationName"), context.get("generatedAt"), departures)
+
+
+_disruption_context = {
+    ("disruptionsForCrs", "stationCRS"): "crs",
+    ("allDisruptionsForCrs", "stationCRS"): "crs",
+}
+
+
+def iter_disruptions(source):
+    """
+    yields one dict per disruption element, with the crs of the station it was listed under (None in
+    responses by date), its operators and links as lists, and the validity period flattened.
+    """
+    for el, context in _iter_records(source, "disruption", _disruption_context):
+        d = {"crs": context.get("crs"), "operators": [], "links": []}
+        for child in el:
+            tag = _local(child.tag)
+            if tag == "operators":
+                d["operators"].append({_local(c.tag): c.text for c in child})
+            elif tag == "infoLinks":
+                d["links"].append({_local(c.tag): c.text for c in child})
+            elif tag == "validityPeriod":
+                d.update((_local(c.tag), c.text) for c in child)
+            elif tag == "planned":
+                d[tag] = child.text == "true"
+            elif len(child) == 0:
+                d[tag] = child.text
+        yield d
+
+
+def parse_disruptions(source):
+    return list(iter_disruptions(source))
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # python darwin.py providers/darwin/With_CRS.xml providers/darwin/all-delays.json
+    for filepath in sys.argv[1:]:
+        if filepath.endswith(".json"):
+            with open(filepath) as f:
+                result = board_from_json(json.load(f))
+        else:
+            with open(filepath, "rb") as f:
+                head = f.read(4096)
+            result = parse_station_board(filepath) if b"StationBoard" in head or b"DepartureBoard" in head \
+                else parse_disruptions(filepath)
+        print(json.dumps(result, indent=4, ensure_ascii=False))
@@ -0,0 +1,333 @@
+"""
+bulk enrichment of movement records (a TIPLOC and / or CRS column per row) with station details from the
+station table built by parse_CRS: name, CRS, TIPLOC, coordinates (.msn units), interchange size, change time.
+
+    table = StationTable.load("temp.json")
+    enriched = enrich(movements, table, tiploc_column="tiploc", crs_column="crs")
+
+the join is vectorised: each key column is factorised, only its distinct values are looked up (through
+pandas Indexes over TIPLOC and the principal record of every CRS) and the station columns are gathered
+with one numpy take. a row is matched by TIPLOC first, by CRS where the TIPLOC is missing or unknown;
+unmatched rows get missing values.
+
+big inputs are streamed in chunks (CSV, or Parquet with pyarrow installed) through a process pool. the
+station table is placed once in shared memory and every worker maps it, the output is written chunk by
+chunk in input order with a bounded number of chunks in flight, so memory stays flat whatever the size.
+
+    python main.py enrich movements.csv enriched.csv --tiploc-column tiploc --crs-column crs --processes 4
+"""
+import argparse
+import os
+import sys
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from msn import interchange_status_structure
+
+# station columns added to the input, prefixed with "station_"
+OUTPUT_COLUMNS = ("name", "crs", "tiploc", "easting", "northing", "is_estimate", "interchange", "change_time")
+CHUNKSIZE = 500000
+
+_interchange_codes = {v: k for k, v in interchange_status_structure.items()}
+
+
+class StationTable(object):
+    """
+    the station records as aligned numpy columns:
+        tiploc, crs, name       fixed-width strings
+        easting, northing       int32, .msn units
+        is_estimate             bool
+        interchange             int8 code of the .msn file (0-3, 9 for a subsidiary TIPLOC)
+        change_time             int8 minutes
+    and the lookup structures derived from them, built once by from_records and shared with the rest,
+    so a worker attached to shared memory searches the mapped arrays without copying them:
+        tiploc_keys, tiploc_rows    sorted TIPLOC codes and the row of each
+        crs_keys, crs_rows          sorted CRS codes and the row of the station's principal record
+        names, name_codes           distinct station names and the index of every row's name in them
+        interchange_codes           every row's interchange code as an index into interchanges
+    """
+
+    interchanges = [interchange_status_structure[c] for c in sorted(interchange_status_structure)]
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._names = None
+
+    @classmethod
+    def from_records(cls, records):
+        subsidiary = interchange_status_structure[9]
+        principal = {}
+        for i, s in enumerate(records):
+            # a station's principal TIPLOC is the one that is not marked as subsidiary
+            code = s["CRS_main"]
+            if code not in principal or (records[principal[code]]["interchange_size"] == subsidiary
+                                         and s["interchange_size"] != subsidiary):
+                principal[code] = i
+        crs_keys = sorted(principal)
+        columns = {
+            "tiploc": np.array([s["TIPLOC"] for s in records], dtype="U7"),
+            "crs": np.array([s["CRS_main"] for s in records], dtype="U3"),
+            "name": np.array([s["station_name"] for s in records], dtype="U30"),
+            "easting": np.array([int(s["easting"] or 0) for s in records], dtype="i4"),
+            "northing": np.array([int(s["northing"] or 0) for s in records], dtype="i4"),
+            "is_estimate": np.array([s["is_estimate"] == "1" for s in records], dtype="?"),
+            "interchange": np.array([_interchange_codes[s["interchange_size"]] for s in records], dtype="i1"),
+            "change_time": np.array([int(s["change_time"] or 0) for s in records], dtype="i1"),
+            "crs_keys": np.array(crs_keys, dtype="U3"),
+            "crs_rows": np.array([principal[c] for c in crs_keys], dtype="i4"),
+        }
+        order = np.argsort(columns["tiploc"], kind="stable")
+        columns["tiploc_keys"] = columns["tiploc"][order]
+        columns["tiploc_rows"] = order.astype("i4")
+        # station names repeat across a station's TIPLOCs, the output holds them as a categorical
+        name_codes, names = pd.factorize(columns["name"])
+        columns["name_codes"] = name_codes.astype("i4")
+        columns["names"] = np.asarray(names, dtype="U30")
+        columns["interchange_codes"] = np.searchsorted(sorted(interchange_status_structure),
+                                                       columns["interchange"]).astype("i1")
+        return cls(columns)
+
+    @classmethod
+    def load(cls, dict_file="temp.json"):
+        from station_index import get_index
+
+        return cls.from_records(get_index(dict_file).records)
+
+    def __len__(self):
+        return len(self.columns["tiploc"])
+
+    @property
+    def names(self):
+        # categories of the name column, built on first use in each process (one entry per station name)
+        if self._names is None:
+            self._names = pd.Index(self.columns["names"].tolist())
+        return self._names
+
+    @staticmethod
+    def _find(sorted_keys, key_rows, values):
+        # distinct values only: tens of millions of rows hold a few thousand codes
+        codes, uniques = pd.factorize(values)
+        if len(uniques) == 0 or len(sorted_keys) == 0:
+            # every key missing
+            return np.full(len(codes), -1, dtype=np.int64)
+        keys = pd.Index(uniques).astype(str).str.strip().str.upper().to_numpy(dtype=str)
+        position = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        found = np.where(sorted_keys[position] == keys, key_rows[position], -1)
+        return np.where(codes >= 0, found[np.maximum(codes, 0)], -1)
+
+    def rows(self, tiplocs=None, crs=None):
+        """
+        row of the station table for every input row (-1 without a match): by TIPLOC, then by CRS.
+        """
+        c = self.columns
+        n = len(tiplocs if tiplocs is not None else crs)
+        rows = np.full(n, -1, dtype=np.int64)
+        if tiplocs is not None:
+            rows = self._find(c["tiploc_keys"], c["tiploc_rows"], tiplocs)
+        if crs is not None:
+            missing = rows < 0
+            if missing.any():
+                rows[missing] = self._find(c["crs_keys"], c["crs_rows"], np.asarray(crs)[missing])
+        return rows
+
+    def gather(self, rows, index=None, prefix="station_"):
+        """
+        the station columns for table rows as a DataFrame (missing values where a row is -1).
+        """
+        missing = rows < 0
+        take = np.maximum(rows, 0)
+        c = self.columns
+
+        def strings(values):
+            # fixed-width to categorical, cheap and small for repeated codes
+            codes, uniques = pd.factorize(values[take])
+            return pd.Categorical.from_codes(np.where(missing, -1, codes), categories=pd.Index(uniques))
+
+        def integers(values, dtype):
+            return pd.arrays.IntegerArray(values[take].astype(dtype), missing)
+
+        data = {
+            "name": pd.Categorical.from_codes(np.where(missing, -1, c["name_codes"][take]), categories=self.names),
+            "crs": strings(c["crs"]),
+            "tiploc": strings(c["tiploc"]),
+            "easting": integers(c["easting"], "int32"),
+            "northing": integers(c["northing"], "int32"),
+            "is_estimate": pd.arrays.BooleanArray(c["is_estimate"][take], missing),
+            "interchange": pd.Categorical.from_codes(np.where(missing, -1, c["interchange_codes"][take]),
+                                                     categories=self.interchanges),
+            "change_time": integers(c["change_time"], "int8"),
+        }
+        return pd.DataFrame({prefix + k: data[k] for k in OUTPUT_COLUMNS}, index=index)
+
+    # shared memory
+
+    def share(self):
+        """
+        copies the columns into one shared memory block. returns (block, layout); workers call
+        StationTable.attach(block.name, layout). the caller closes and unlinks the block.
+        """
+        from multiprocessing import shared_memory
+
+        layout = []
+        offset = 0
+        for name, values in self.columns.items():
+            layout.append((name, values.dtype.str, values.shape, offset))
+            # 8 byte alignment for every column
+            offset += (values.nbytes + 7) // 8 * 8
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for name, dtype, shape, start in layout:
+            np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)[...] = self.columns[name]
+        return block, layout
+
+    @classmethod
+    def attach(cls, block_name, layout):
+        from multiprocessing import shared_memory
+
+        block = shared_memory.SharedMemory(name=block_name)
+        columns = {name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+                   for name, dtype, shape, start in layout}
+        table = cls(columns)
+        # the arrays point into the block, keep it mapped as long as the table lives
+        table.block = block
+        return table
+
+
+def enrich(df, table, tiploc_column=None, crs_column=None, prefix="station_"):
+    """
+    df with the station columns appended (a new DataFrame, same index and row order).
+    """
+    if tiploc_column is None and crs_column is None:
+        raise ValueError("need a tiploc_column or a crs_column")
+    rows = table.rows(df[tiploc_column].to_numpy() if tiploc_column else None,
+                      df[crs_column].to_numpy() if crs_column else None)
+    return pd.concat([df, table.gather(rows, index=df.index, prefix=prefix)], axis=1)
+
+
+# chunked, multi-process streaming
+
+_worker = {}
+
+
+def _init_worker(block_name, layout, tiploc_column, crs_column):
+    _worker["table"] = StationTable.attach(block_name, layout)
+    _worker["args"] = (tiploc_column, crs_column)
+
+
+def _enrich_chunk(chunk):
+    tiploc_column, crs_column = _worker["args"]
+    return enrich(chunk, _worker["table"], tiploc_column, crs_column)
+
+
+def read_chunks(source, chunksize=CHUNKSIZE, columns=None):
+    """
+    DataFrames of up to chunksize rows from a CSV or Parquet file (or a CSV file object).
+    key columns are read as strings.
+    """
+    if isinstance(source, str) and source.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("reading parquet needs pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False, na_values=[""]):
+        yield chunk
+
+
+class ChunkWriter(object):
+    """
+    appends DataFrames to a CSV (header once) or Parquet file.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.parquet = isinstance(target, str) and target.endswith(".parquet")
+        self.file = None
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            t = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.target, t.schema)
+            self.writer.write_table(t)
+        else:
+            if self.file is None:
+                self.file = open(self.target, "w", newline="") if isinstance(self.target, str) else self.target
+                df.to_csv(self.file, index=False)
+            else:
+                df.to_csv(self.file, index=False, header=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None and self.file is not self.target:
+            self.file.close()
+
+
+def enrich_file(source, target, table=None, tiploc_column=None, crs_column=None, processes=None,
+                chunksize=CHUNKSIZE, in_flight=None):
+    """
+    streams source (CSV / Parquet) through enrich into target, chunk by chunk. processes=1 enriches in
+    this process; otherwise a pool of workers shares the table through shared memory, with at most
+    in_flight chunks (default 2 per worker) read ahead. returns the number of rows written.
+    """
+    if table is None:
+        table = StationTable.load()
+    writer = ChunkWriter(target)
+    chunks = read_chunks(source, chunksize)
+    try:
+        if processes == 1:
+            for chunk in chunks:
+                writer.write(enrich(chunk, table, tiploc_column, crs_column))
+            return writer.rows
+
+        from multiprocessing import Pool
+
+        processes = processes or os.cpu_count() or 1
+        in_flight = in_flight or processes * 2
+        block, layout = table.share()
+        try:
+            with Pool(processes, _init_worker, (block.name, layout, tiploc_column, crs_column)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_enrich_chunk, (chunk,)))
+                    if len(pending) >= in_flight:
+                        # results are written in input order
+                        writer.write(pending.popleft().get())
+                while pending:
+                    writer.write(pending.popleft().get())
+        finally:
+            block.close()
+            block.unlink()
+        return writer.rows
+    finally:
+        writer.close()
+
+
+def enrich_main(argv):
+    parser = argparse.ArgumentParser(prog="main.py enrich", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or .parquet file of movement records")
+    parser.add_argument("output", help="CSV or .parquet file to write, - for stdout (CSV)")
+    parser.add_argument("--tiploc-column", help="column holding TIPLOC codes")
+    parser.add_argument("--crs-column", help="column holding CRS codes")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU, 1 for none)")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="rows per chunk")
+    parser.add_argument("--dict-file", default="temp.json", help="station dataset (.json or .bin)")
+    args = parser.parse_args(argv)
+    if not args.tiploc_column and not args.crs_column:
+        parser.error("need --tiploc-column and / or --crs-column")
+
+    rows = enrich_file(args.input, sys.stdout if args.output == "-" else args.output,
+                       StationTable.load(args.dict_file), args.tiploc_column, args.crs_column,
+                       processes=args.processes, chunksize=args.chunksize)
+    print('{} rows enriched'.format(rows), file=sys.stderr)
@@ -0,0 +1,153 @@
+"""
+single origin, multiple destinations: where does each destination's route leave the others?
+
+a group leaving one station (a search_by_station board) for several destinations travels together
+as far as their trains share calling points, and splits at the last shared one, e.g. from
+London Liverpool Street to Braintree and Walton-on-the-Naze the portions part at Witham.
+
+each departure's calling pattern (the stations after the origin) is kept as a set for intersections
+and a {station: position} map for ordering, with an inverted index station -> trains, so finding
+the trains to a destination and the stations they share with the others are hash lookups, not list scans.
+
+    finder = JourneyFinder(board["departures"]["all"], patterns)
+    finder.split_points(["BTR", "WON"])
+"""
+from name_search import interchange_rank
+
+
+class JourneyFinder(object):
+    """
+    departures: the departures.all list of a search_by_station response
+    patterns: {train_uid: [CRS codes the train calls at after the origin, in order]}
+    index: station index (station_index.get_index) for ranking interchanges, optional
+    """
+
+    def __init__(self, departures, patterns, index=None):
+        self.index = index
+        self.departures = {}
+        self.routes = {}
+        self.positions = {}
+        self.calls = {}
+        self.trains_at = {}
+
+        for d in departures:
+            uid = d["train_uid"]
+            codes = patterns.get(uid)
+            if codes is None or uid in self.departures:
+                continue
+            self.departures[uid] = d
+            self.routes[uid] = list(codes)
+            positions = {}
+            for i, code in enumerate(codes):
+                positions.setdefault(code, i)
+            self.positions[uid] = positions
+            self.calls[uid] = frozenset(positions)
+            for code in positions:
+                self.trains_at.setdefault(code, set()).add(uid)
+
+        self._stations = {}
+
+    def trains_to(self, destination):
+        return self.trains_at.get(destination, set())
+
+    def _station(self, code):
+        # interchange_size / change_time of a CRS code, from the principal record
+        station = self._stations.get(code)
+        if station is None:
+            station = {"CRS": code, "station_name": None, "interchange_size": None, "change_time": None}
+            records = self.index.by_crs(code) if self.index is not None else []
+            for s in records:
+                if s["CRS_main"] == code and s["interchange_size"] in interchange_rank:
+                    station.update(station_name=s["station_name"], interchange_size=s["interchange_size"],
+                                   change_time=int(s["change_time"]) if s["change_time"] else None)
+                    break
+            self._stations[code] = station
+        return station
+
+    def _rank(self, candidate):
+        # bigger stations and shorter change times first, later splits break ties (longer together)
+        station = self._station(candidate["CRS"])
+        change_time = station["change_time"]
+        return (-interchange_rank.get(station["interchange_size"], -1),
+                change_time if change_time is not None else 99,
+                -candidate["position"])
+
+    def split_points(self, destinations):
+        """
+        for every destination: {"destination", "trains" (uids calling there), "split" (the last station
+        its route shares with another destination's route, None if it shares none or is not served),
+        "interchanges" (every shared station before the destination, ranked as places to change or part)}.
+        """
+        destinations = [d.upper() for d in destinations]
+        serving = {d: self.trains_to(d) for d in destinations}
+
+        # stations each destination's trains call at up to and including it,
+        # and for every station how many destinations' routes pass it
+        before = {}
+        shared_by = {}
+        for d in destinations:
+            stations = set()
+            for uid in serving[d]:
+                stations.update(self.routes[uid][:self.positions[uid][d] + 1])
+            before[d] = stations
+            for code in stations:
+                shared_by[code] = shared_by.get(code, 0) + 1
+
+        output = {}
+        for d in destinations:
+            # on another destination's route too
+            others = {code for code in before[d] if shared_by[code] > 1}
+
+            candidates = {}
+            for uid in serving[d]:
+                positions = self.positions[uid]
+                limit = positions[d]
+                for code in self.calls[uid] & others:
+                    i = positions[code]
+                    if i <= limit and (code not in candidates or candidates[code]["position"] < i):
+                        candidates[code] = {"CRS": code, "position": i, "train_uid": uid}
+
+            split = max(candidates.values(), key=lambda c: c["position"])["CRS"] if candidates else None
+            interchanges = []
+            for c in sorted(candidates.values(), key=self._rank):
+                station = self._station(c["CRS"])
+                interchanges.append(dict(station, train_uid=c["train_uid"], stop=c["position"] + 1))
+
+            output[d] = {"destination": d, "trains": sorted(serving[d]), "split": split,
+                         "interchanges": interchanges}
+        return output
+
+
+def patterns_from_timetable(timetable, origin):
+    """
+    {train_uid: [CRS after origin]} for every service in a timetable.Timetable that calls at origin.
+    """
+    patterns = {}
+    origin = origin.upper()
+    for service, header in enumerate(timetable.services):
+        codes = [timetable.codes[i] for i in timetable.station_sequence(service)]
+        if origin in codes:
+            patterns[header["train_uid"]] = codes[codes.index(origin) + 1:]
+    return patterns
+
+
+def load_patterns(board, client=None):
+    """
+    fetches the timetable of every departure on a search_by_station board concurrently
+    and returns its calling patterns after the board's station.
+    """
+    import asyncio
+
+    from timetable import Timetable
+
+    if client is None:
+        from transport_client import get_client
+        client = get_client()
+
+    departures = board["departures"]["all"]
+    responses = asyncio.run(client.trains([(d["train_uid"], board["date"]) for d in departures]))
+    timetable = Timetable()
+    for r in responses:
+        if not isinstance(r, Exception) and r.get("stops"):
+            timetable.add(r)
+    return patterns_from_timetable(timetable, board["station_code"])
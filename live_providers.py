@@ -0,0 +1,305 @@
+"""
+one interface over the live data sources: TransportAPI, Darwin (huxley JSON) and TfL.
+
+every provider answers in the normalised shapes used across the repo:
+    board(crs, count)   a search_by_station style board, departures in the TransportAPI fields
+    status(modes)       line statuses [{"id", "name", "mode", "severity", "description", "reason"}]
+a provider that has no data of a kind raises Unsupported and is skipped for it.
+
+ProviderRouter sends each request to the provider with the best recent latency. if that one has not answered
+within the hedge budget (by default its own p90), the request is also sent to the next provider and the first
+answer wins; a provider that fails is replaced by the next one straight away. every attempt is recorded
+in the provider's LatencyHistogram, which in turn decides the order.
+
+    router = ProviderRouter([TransportApiProvider(), DarwinProvider(token=...)])
+    board = asyncio.run(router.board("ZFD"))
+    board["provider"]     # "transportapi"
+    asyncio.run(router.status(["tube"]))[0]["provider"]   # every line status names its provider too
+"""
+import asyncio
+import bisect
+import time
+
+from transport_client import TransportClient
+
+DARWIN_URL = "https://huxley.apphb.com"
+TFL_URL = "https://api.tfl.gov.uk"
+
+# 1 ms to ~80 s, 25% apart
+LATENCY_BOUNDS = [0.001 * 1.25 ** i for i in range(51)]
+
+
+class Unsupported(Exception):
+    pass
+
+
+class ProviderError(Exception):
+
+    def __init__(self, errors):
+        Exception.__init__(self, "; ".join("{}: {}".format(name, e) for name, e in errors))
+        self.errors = errors
+
+
+class LatencyHistogram(object):
+    """
+    counts of request latencies (seconds) in fixed, exponentially growing buckets, plus failures.
+    every `window` requests all counts are halved, so the histogram follows the provider's recent behaviour.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS, window=1000):
+        self.bounds = bounds
+        self.window = window
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def _age(self):
+        if self.total + self.errors >= self.window:
+            self.counts = [n // 2 for n in self.counts]
+            self.sum = self.sum / 2
+            self.total = sum(self.counts)
+            self.errors //= 2
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        self._age()
+
+    def record_error(self):
+        self.errors += 1
+        self._age()
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q-th quantile, None without samples.
+        """
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+        return self.bounds[-1]
+
+    def error_rate(self):
+        attempts = self.total + self.errors
+        return self.errors / float(attempts) if attempts else 0.0
+
+    def snapshot(self):
+        return {"count": self.total, "errors": self.errors,
+                "mean": self.sum / self.total if self.total else None,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class Provider(object):
+    name = "provider"
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+
+    async def board(self, crs, count=10):
+        raise Unsupported(self.name)
+
+    async def status(self, modes):
+        raise Unsupported(self.name)
+
+
+class TransportApiProvider(Provider):
+    name = "transportapi"
+
+    def __init__(self, client=None):
+        Provider.__init__(self)
+        if client is None:
+            from transport_client import get_client
+            client = get_client()
+        self.client = client
+
+    async def board(self, crs, count=10):
+        return await self.client.fetch_async(self.client.station_url(crs, count),
+                                             key=self.client.station_key(crs, count))
+
+
+class DarwinProvider(Provider):
+    """
+    Darwin through a huxley proxy (JSON), converted by darwin.board_from_json.
+    """
+    name = "darwin"
+
+    def __init__(self, base_url=DARWIN_URL, token=None, client=None):
+        Provider.__init__(self)
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.client = client or TransportClient(base_url=self.base_url)
+
+    async def board(self, crs, count=10):
+        from darwin import board_from_json
+
+        url = "{}/departures/{}/{}".format(self.base_url, crs, count)
+        if self.token:
+            url += "?accessToken={}".format(self.token)
+        return board_from_json(await self.client.fetch_async(url))
+
+
+def normalise_line_status(line):
+    return [{"id": line["id"], "name": line.get("name"), "mode": line.get("modeName"),
+             "severity": s["statusSeverity"], "description": s["statusSeverityDescription"],
+             "reason": s.get("reason")} for s in line.get("lineStatuses") or []]
+
+
+class TflProvider(Provider):
+    name = "tfl"
+
+    def __init__(self, base_url=TFL_URL, app_keys=None, client=None):
+        Provider.__init__(self)
+        self.base_url = base_url.rstrip("/")
+        self.app_keys = app_keys
+        self.client = client or TransportClient(base_url=self.base_url)
+
+    async def status(self, modes):
+        url = "{}/Line/Mode/{}/Status".format(self.base_url, ",".join(modes))
+        if self.app_keys:
+            url += "?" + self.app_keys
+        lines = await self.client.fetch_async(url)
+        return [s for line in lines for s in normalise_line_status(line)]
+
+
+class StubProvider(Provider):
+    """
+    local provider for testing: answers with fixed data after `delay` seconds (a callable is called
+    for each request, for latency distributions), failing a `fail_rate` share of requests.
+    """
+
+    def __init__(self, name, board=None, statuses=None, delay=0.0, fail_rate=0.0, seed=None):
+        import random
+
+        Provider.__init__(self)
+        self.name = name
+        self._board = board
+        self._statuses = statuses
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    async def _answer(self, value):
+        self.requests += 1
+        if value is None:
+            raise Unsupported(self.name)
+        await asyncio.sleep(self.delay() if callable(self.delay) else self.delay)
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            raise IOError("{} stub failure".format(self.name))
+        return value
+
+    async def board(self, crs, count=10):
+        board = await self._answer(self._board)
+        return dict(board, station_code=crs.upper())
+
+    async def status(self, modes):
+        return await self._answer(self._statuses)
+
+
+class ProviderRouter(object):
+    """
+    providers: tried in order of their recent latency, the list order breaks ties and goes first while
+    there is no history.
+    hedge_after: seconds before a request is also sent to the next provider, None for the
+    current provider's hedge_quantile latency (0.5 s until it has min_samples requests).
+    """
+
+    def __init__(self, providers, hedge_after=None, hedge_quantile=0.9, timeout=10.0, min_samples=20):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.hedge_quantile = hedge_quantile
+        self.timeout = timeout
+        self.min_samples = min_samples
+
+    def ranked(self):
+        def score(item):
+            position, p = item
+            h = p.latency
+            if h.total + h.errors < self.min_samples:
+                return (0, position)
+            if not h.total:
+                # nothing but failures lately
+                return (2, position)
+            # expected time to an answer, failures cost a retry elsewhere
+            return (1, h.quantile(0.5) / max(0.05, 1 - h.error_rate()), position)
+        return [p for _, p in sorted(enumerate(self.providers), key=score)]
+
+    def _budget(self, provider):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if provider.latency.total < self.min_samples:
+            return 0.5
+        return provider.latency.quantile(self.hedge_quantile)
+
+    async def _timed(self, provider, method, args):
+        t = time.perf_counter()
+        try:
+            result = await getattr(provider, method)(*args)
+        except Unsupported:
+            raise
+        except asyncio.CancelledError:
+            # lost the race, not a failure and no latency sample either
+            raise
+        except Exception:
+            provider.latency.record_error()
+            raise
+        provider.latency.record(time.perf_counter() - t)
+        return result
+
+    async def request(self, method, *args):
+        """
+        (provider name, result) of the first provider to answer method(*args).
+        """
+        waiting = self.ranked()
+        running = {}
+        errors = []
+        deadline = time.perf_counter() + self.timeout
+
+        def start_next():
+            if waiting:
+                p = waiting.pop(0)
+                running[asyncio.ensure_future(self._timed(p, method, args))] = p
+
+        start_next()
+        try:
+            while running:
+                budget = self._budget(running[next(reversed(running))]) if waiting else None
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    errors.append(("timeout", "no answer within {}s".format(self.timeout)))
+                    break
+                done, _ = await asyncio.wait(list(running), timeout=min(budget or remaining, remaining),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # hedge: the latest provider is slower than usual, ask the next one too
+                    start_next()
+                    continue
+                for task in done:
+                    p = running.pop(task)
+                    if task.exception() is None:
+                        return p.name, task.result()
+                    if not isinstance(task.exception(), Unsupported):
+                        errors.append((p.name, task.exception()))
+                    # fall back straight away
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+        raise ProviderError(errors or [("router", Unsupported(method))])
+
+    async def board(self, crs, count=10):
+        name, board = await self.request("board", crs, count)
+        return dict(board, provider=name)
+
+    async def status(self, modes):
+        name, statuses = await self.request("status", modes)
+        return [dict(s, provider=name) for s in statuses]
+
+    def latency(self):
+        return {p.name: p.latency.snapshot() for p in self.providers}
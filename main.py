@@ -1,5 +1,12 @@
-import pandas as pd
 import json
+import os
+
+from metrics import timed
+from msn import (iter_msn_records, link_records, links_file, load_line_cache, msn_record_pos, read_msn_columns,
+                 save_line_cache, write_stations_json)
+from spatial import latlon_to_msn
+from station_index import get_index
+from station_store import write_store
 
 # main ref: http://www.railwaycodes.org.uk/index.shtml
 # data source: http://data.atoc.org/data-download
@@ -53,43 +60,51 @@ Space 	                    1	Space
 """
 
 
+def print_json(output):
+    # serialising big result sets costs more than finding them, timed on its own
+    with timed("serialise"):
+        text = json.dumps(output, indent=4, ensure_ascii=False)
+    print(text)
+
+
 # train UIDs are used to identify trains on this API
 
 
 def search_by_train(train_uid="W64533", date_str="2018-10-30", show_json=True):
-    import requests
-    import json
+    from transport_client import get_client
 
-    url = "https://fcc.transportapi.com/v3/uk/train/service/train_uid:{}/{}/timetable.json?live=true".format(
-        train_uid, date_str)
+    client = get_client()
+    url = client.train_url(train_uid, date_str)
 
     print('searching train by GET: {}'.format(url))
-    r = requests.get(url).json()
+    r = client.train(train_uid, date_str)
     if show_json:
-        print(json.dumps(r, indent=4, ensure_ascii=False))
+        print_json(r)
 
     return r
 
 
 def search_by_station(station_CRS="ZFD", count=10, show_json=True):
-    import requests
-    import json
+    from transport_client import get_client
 
-    url = "https://fcc.transportapi.com/v3/uk/train/station/{}/live.json?limit={}".format(
-        station_CRS, count)
+    client = get_client()
+    url = client.station_url(station_CRS, count)
 
     print('searching station by GET: {}'.format(url))
-    r = requests.get(url).json()
+    r = client.station(station_CRS, count)
     if show_json:
-        print(json.dumps(r, indent=4, ensure_ascii=False))
+        print_json(r)
 
     return r
 
 
-def parse_CRS(debug=False):
+def parse_CRS(debug=False, filepath="./data/ttis074/ttisf074.msn", mode="stream", output_file="temp.json",
+              cache_file=None):
     # ref: http://data.atoc.org/sites/all/themes/atoc/files/rsps5041%20-%20Timetable%20Data.pdf
-    filepath = "./data/ttis074/ttisf074.msn"
-    # every row in the .msn file is 82 characters
+    # layout of the .msn file lives in msn.py
+    # mode="stream" parses every record type line by line, mode="bulk" slices the station columns at once with numpy
+    # an output_file ending in .bin is written as the compact binary store (station_store.py)
+    # with a cache_file, only lines that changed since the last run are parsed again
 
     # json structure suggested
     output_json_structure = {
@@ -108,127 +123,126 @@ def parse_CRS(debug=False):
         "change_time": 3
     }
 
-    interchange_status_structure = {
-        0: "none",
-        1: "small",
-        2: "medium",
-        3: "large",
-        9: "This is a subsidiary TIPLOC at a station which has more than one TIPLOC. Stations which have more than one TIPLOC always have the same principal 3- Alpha Code."
-    }
-
-    with open(filepath) as f:
-        dataset = f.readlines()
-    header = dataset[0]
-
-    content = dataset[1:]
-    content = [c.strip('\n') for c in content]
-
-    # we only want to get record type "A" and record type "L"
     # type A is the main train station reference data (station details)
-    # type L is the alias data
-
-    # the below are indices. to slice, the end_index = end_index + 1
-    msn_record_pos = {
-        "record_type": [0],
-        "station_name": [5, 34],
-        "interchange_size": [35],
-        "TIPLOC": [36, 42],
-        "CRS_secondary": [43, 45],
-        "CRS_main": [49, 51],
-        "easting": [52, 56],
-        "is_estimate": [57],
-        "northing": [58, 62],
-        "change_time": [64]
-    }
+    # type L is the alias data, V the station groups, M the connections and R the routeing groups
 
     def print_record(key, value):
         print("{:10}: {}".format(key, value))
 
-    output = []
-    for c in content:
-        record_dict = {}
-        # parse record type A
-        record_type = msn_record_pos["record_type"][0]
-        type_check = c[record_type]
-
-        # based on type, parse content, c
-        if type_check.lower() == "a":
-            for k, v in msn_record_pos.items():
-                if len(v) == 1:
-                    if debug:
-                        print_record(k, c[v[0]])
-                    record_value = c[v[0]]
-                    # format interchange_size
-                    if k == "interchange_size":
-                        try:
-                            record_value = interchange_status_structure[int(
-                                record_value)]
-                        except:
-                            raise SystemExit(
-                                'interchange type unknown. interchange code:{}'.format(record_value))
-                    # format is_estimate
-                    elif k == "is_estimate":
-                        if record_value.lower() == "e":
-                            record_value = "1"
-                        else:
-                            record_value = "0"
+    # station rows are written as they are parsed, as tuples in the order of keys
+    keys = list(msn_record_pos)
+    if mode == "bulk":
+        columns, others = read_msn_columns(filepath, other_records=True)
+        rows = zip(*[columns[k] for k in keys])
+    elif mode == "stream":
+        # lines are only hashed and tracked to keep a cache
+        cache = load_line_cache(cache_file) if cache_file else None
+        seen = {} if cache_file else None
+        stats = {"reused": 0, "parsed": 0, "removed": 0}
+        others = {"aliases": [], "groups": [], "connections": [], "routeing_groups": []}
+
+        def station_rows():
+            for kind, record in iter_msn_records(filepath, cache, seen, stats):
+                if kind == "stations":
+                    yield tuple(record.values())
                 else:
-                    if debug:
-                        print_record(k, c[v[0]:v[-1]+1])
-                    record_value = c[v[0]:v[-1] + 1]  # +1 because slice
+                    others[kind].append(record)
+        rows = station_rows()
+    else:
+        raise SystemExit('unknown parse mode: {}'.format(mode))
 
-                record_value = record_value.strip()
-                record_dict[k] = record_value
-            output.append(record_dict)
+    if debug:
+        rows = list(rows)
+        for row in rows:
+            for k, v in zip(keys, row):
+                print_record(k, v)
 
     # save type A record
-    with open('temp.json', "w") as f:
-        json.dump(output, f, indent=4, ensure_ascii=False)
-
-    # parse record type L
+    if output_file.endswith(".bin"):
+        write_store([dict(zip(keys, row)) for row in rows], output_file)
+    else:
+        # written next to the target and renamed over it: the index auto-reload and the lookup service
+        # watch this file and must never read it half-written
+        tmp = "{}.{}.tmp".format(output_file, os.getpid())
+        with open(tmp, "w") as f:
+            write_stations_json(keys, rows, f)
+        os.replace(tmp, output_file)
+
+    if mode == "stream" and cache_file:
+        stats["removed"] = len(set(cache) - set(seen))
+        save_line_cache(cache_file, seen)
+        print('{parsed} lines parsed, {reused} unchanged, {removed} removed'.format(**stats))
+
+    # save alias, group and connection records next to it, in both modes so it always matches the dataset
+    path = links_file(output_file)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(link_records(others), f, ensure_ascii=False)
+    os.replace(tmp, path)
 
 
 def station_from_CRS(dict_file="temp.json", crs="COV", show_json=True):
-    output = []
-    with open(dict_file) as f:
-        station_names = json.load(f)
-
-    for s in station_names:
-        if s['CRS_main'] == crs.upper() or s['CRS_secondary'] == crs.upper():
-            output.append(s)
+    index = get_index(dict_file)
+    with timed("query"):
+        output = index.by_crs(crs)
 
     if show_json:
-        print(json.dumps(output, indent=4, ensure_ascii=False))
+        print_json(output)
 
     return output
 
 
 def station_from_TIPLOC(dict_file="temp.json", tiploc="ABWD", show_json=True):
-    output = []
-    with open(dict_file) as f:
-        station_names = json.load(f)
+    index = get_index(dict_file)
+    with timed("query"):
+        output = index.by_tiploc(tiploc)
+
+    if show_json:
+        print_json(output)
+
+    return output
 
-    for s in station_names:
-        if s['TIPLOC'] == tiploc.upper():
-            output.append(s)
+
+def station_from_name(dict_file="temp.json", station_name="coventry", show_json=True, limit=None):
+    # ranked: exact > prefix > word prefix > substring, typos are matched when nothing else is
+    index = get_index(dict_file)
+    with timed("query"):
+        output = index.search(station_name, limit=limit)
 
     if show_json:
-        print(json.dumps(output, indent=4, ensure_ascii=False))
+        print_json(output)
 
     return output
 
 
-def station_from_name(dict_file="temp.json", station_name="coventry", show_json=True):
-    output = []
-    with open(dict_file) as f:
-        station_names = json.load(f)
+def _with_distance(found):
+    return [dict(s, distance=int(round(d))) for s, d in found]
+
+
+def nearest_stations(easting=None, northing=None, k=5, lat=None, lon=None, dict_file="temp.json", show_json=True):
+    # easting / northing in the .msn file's 100m units, or WGS84 lat / lon. distances in metres
+    if lat is not None and lon is not None:
+        easting, northing = latlon_to_msn(lat, lon)
+    index = get_index(dict_file)
+    with timed("query"):
+        output = _with_distance(index.nearest(easting, northing, k))
+
+    if show_json:
+        print_json(output)
+
+    return output
+
 
-    for s in station_names:
-        if station_name.upper() in s["station_name"]:
-            output.append(s)
+def stations_within(easting=None, northing=None, radius=1000, lat=None, lon=None, dict_file="temp.json", show_json=True):
+    # radius in metres
+    if lat is not None and lon is not None:
+        easting, northing = latlon_to_msn(lat, lon)
+    index = get_index(dict_file)
+    with timed("query"):
+        output = _with_distance(index.within(easting, northing, radius))
 
     if show_json:
-        print(json.dumps(output, indent=4, ensure_ascii=False))
+        print_json(output)
 
     return output
 
@@ -251,6 +265,7 @@ def describe():
         - CRS -> ZFD
         - TIPLOC -> STALBCY
     station search by geolocation
+        - nearest_stations / stations_within (local, from the .msn coordinates)
         - https://developer.transportapi.com/docs?raml=https://transportapi.com/v3/raml/transportapi.raml##uk_places_json
     updates fares data
         - http://data.atoc.org/fares-data
@@ -407,4 +422,39 @@ if __name__ == "__main__":
 
     #showcase()
 
-    CLI()
+    import sys
+
+    def run(argv):
+        if len(argv) > 1 and argv[1] == "batch":
+            from batch import batch_main
+            batch_main(argv[2:])
+        elif len(argv) > 1 and argv[1] == "serve":
+            from server import serve_main
+            serve_main(argv[2:])
+        elif len(argv) > 1 and argv[1] == "watch":
+            from board_watch import watch_main
+            watch_main(argv[2:])
+        elif len(argv) > 1 and argv[1] == "refresh":
+            from refresh import refresh_main
+            refresh_main(argv[2:])
+        elif len(argv) > 1 and argv[1] == "enrich":
+            from enrich import enrich_main
+            enrich_main(argv[2:])
+        elif len(argv) > 1 and argv[1] == "replay":
+            from replay import replay_main
+            replay_main(argv[2:])
+        else:
+            CLI()
+
+    # --profile [out.prof] runs the command under cProfile, --metrics prints the stage timings afterwards
+    from metrics import cli_options, profiled, report
+    argv, profile, show_metrics = cli_options(sys.argv)
+    try:
+        if profile:
+            with profiled(profile if profile is not True else None):
+                run(argv)
+        else:
+            run(argv)
+    finally:
+        if show_metrics:
+            report()
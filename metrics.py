@@ -0,0 +1,206 @@
+"""
+where the time goes: per-stage timings of the hot paths, kept as histograms for the life of the process.
+
+    load        reading a dataset into an index (get_index, a reload in the lookup service)
+    index       building the derived structures (name search engine, spatial grid)
+    query       lookups: station_from_*, nearest_stations, stations_within
+    serialise   json.dumps of results, for printing (show_json) or an HTTP response
+    upstream    one HTTP request to a live API, per attempt
+    request     a whole request to the lookup service
+
+    with timed("query"):
+        ...
+    print(prometheus())                 # text format, also served on the lookup service's /metrics
+    print(json.dumps(snapshot()))       # the same as JSON (/metrics?format=json)
+
+counters (count("upstream_retry")) record events without a duration.
+`python main.py --profile out.prof <command>` runs one CLI invocation under cProfile and
+`--metrics` prints the stage timings when it finishes.
+"""
+import bisect
+import sys
+import threading
+import time
+
+# seconds, Prometheus "le" bounds: 10 us to 30 s
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "raildata"
+
+
+class Histogram(object):
+    """
+    counts of observations per bucket (the last one is +Inf), their sum and count. never reset,
+    so scrapes can take differences.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q-th quantile, None without observations.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        h = self.histograms.get(stage)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(stage, Histogram())
+        return h
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+
+    def count(self, event, n=1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+
+REGISTRY = Registry()
+
+
+class timed(object):
+    """
+    times a block (with timed("query"): ...) into a stage of the registry.
+    """
+    __slots__ = ("stage", "registry", "start")
+
+    def __init__(self, stage, registry=None):
+        self.stage = stage
+        self.registry = registry or REGISTRY
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def count(event, n=1):
+    REGISTRY.count(event, n)
+
+
+def snapshot(registry=None):
+    registry = registry or REGISTRY
+    return {"stages": {k: h.snapshot() for k, h in sorted(registry.histograms.items())},
+            "counters": dict(sorted(registry.counters.items()))}
+
+
+def prometheus(registry=None):
+    """
+    the registry in the Prometheus text exposition format.
+    """
+    registry = registry or REGISTRY
+    name = PREFIX + "_stage_seconds"
+    lines = ["# HELP {} time spent per stage".format(name), "# TYPE {} histogram".format(name)]
+    for stage, h in sorted(registry.histograms.items()):
+        cumulative = 0
+        for bound, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+            cumulative += n
+            lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, bound, cumulative))
+        lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, repr(h.sum)))
+        lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, h.count))
+
+    name = PREFIX + "_events_total"
+    lines += ["# HELP {} events counted".format(name), "# TYPE {} counter".format(name)]
+    for event, n in sorted(registry.counters.items()):
+        lines.append('{}{{event="{}"}} {}'.format(name, event, n))
+    return "\n".join(lines) + "\n"
+
+
+def report(registry=None, out=None):
+    # a table of the stage timings, for --metrics
+    out = out or sys.stderr
+    for stage, s in snapshot(registry)["stages"].items():
+        out.write("{:10s} {:7d} calls  {:9.3f} ms total  {:8.3f} ms mean  p99 <= {} s\n".format(
+            stage, s["count"], s["sum"] * 1000, (s["mean"] or 0) * 1000, s["p99"]))
+    for event, n in snapshot(registry)["counters"].items():
+        out.write("{:10s} {:7d}\n".format(event, n))
+
+
+class profiled(object):
+    """
+    runs a block under cProfile. the stats go to path (for pstats / snakeviz), or the top `limit`
+    functions by cumulative time are printed to stderr.
+    """
+
+    def __init__(self, path=None, limit=30):
+        self.path = path
+        self.limit = limit
+
+    def __enter__(self):
+        import cProfile
+
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return self.profile
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        if self.path:
+            self.profile.dump_stats(self.path)
+        else:
+            import pstats
+
+            pstats.Stats(self.profile, stream=sys.stderr).sort_stats("cumulative").print_stats(self.limit)
+        return False
+
+
+def cli_options(argv):
+    """
+    strips --profile [file] and --metrics from argv. returns (remaining argv, profile path or True or None,
+    print metrics).
+    """
+    argv = list(argv)
+    profile = None
+    show = False
+    if "--metrics" in argv:
+        argv.remove("--metrics")
+        show = True
+    if "--profile" in argv:
+        i = argv.index("--profile")
+        argv.pop(i)
+        profile = True
+        if i < len(argv) and argv[i].endswith((".prof", ".pstats")):
+            profile = argv.pop(i)
+    return argv, profile, show
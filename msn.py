@@ -0,0 +1,329 @@
+# parsers for the ATOC Master Stations Names (.msn) file
+# ref: http://data.atoc.org/sites/all/themes/atoc/files/rsps5041%20-%20Timetable%20Data.pdf
+# every row in the .msn file is 82 characters, the first row is the header
+import hashlib
+import json
+import os
+
+interchange_status_structure = {
+    0: "none",
+    1: "small",
+    2: "medium",
+    3: "large",
+    9: "This is a subsidiary TIPLOC at a station which has more than one TIPLOC. Stations which have more than one TIPLOC always have the same principal 3- Alpha Code."
+}
+
+# the below are indices. to slice, the end_index = end_index + 1
+msn_record_pos = {
+    "record_type": [0],
+    "station_name": [5, 34],
+    "interchange_size": [35],
+    "TIPLOC": [36, 42],
+    "CRS_secondary": [43, 45],
+    "CRS_main": [49, 51],
+    "easting": [52, 56],
+    "is_estimate": [57],
+    "northing": [58, 62],
+    "change_time": [64]
+}
+
+# (key, slice) pairs, computed once instead of per field per line
+_record_slices = [(k, slice(v[0], v[-1] + 1))
+                  for k, v in msn_record_pos.items()]
+
+# layouts of the other record types, same index convention as msn_record_pos
+# "L" alias: another name the station is known by
+msn_alias_pos = {
+    "station_name": [5, 34],
+    "alias_name": [36, 65]
+}
+
+# "V" group: stations sharing a group 3-Alpha code, e.g. LON
+# followed by the member 3-Alpha codes, 4 characters each (code + space), from members_start
+msn_group_pos = {
+    "group_name": [5, 34],
+    "group_CRS": [36, 38]
+}
+msn_group_members_start = 40
+
+# "M" connection: minimum walk time in minutes between two stations
+msn_connection_pos = {
+    "from_CRS": [5, 7],
+    "to_CRS": [9, 11],
+    "walk_time": [13, 14]
+}
+
+# "R" routeing group: same layout as a group record
+msn_routeing_group_pos = msn_group_pos
+
+# table number ("T") and comment ("C") records are not kept
+
+
+def _slice_record(line, pos):
+    return {k: line[v[0]:v[-1] + 1].strip() for k, v in pos.items()}
+
+
+def _parse_group(line):
+    record = _slice_record(line, msn_group_pos)
+    members = line[msn_group_members_start:].split()
+    record["members"] = [m.upper() for m in members if len(m) == 3]
+    return record
+
+
+def _parse_connection(line):
+    record = _slice_record(line, msn_connection_pos)
+    try:
+        record["walk_time"] = int(record["walk_time"])
+    except ValueError:
+        record["walk_time"] = None
+    return record
+
+
+def _interchange_size(code):
+    try:
+        return interchange_status_structure[int(code)]
+    except (ValueError, KeyError):
+        raise SystemExit(
+            'interchange type unknown. interchange code:{}'.format(code))
+
+
+def parse_msn_line(line):
+    """
+    parses a single type "A" (station detail) row into a record dict.
+    returns None for every other record type.
+    """
+    if line[:1] not in ("A", "a"):
+        return None
+
+    record = {k: line[s].strip() for k, s in _record_slices}
+    record["interchange_size"] = _interchange_size(record["interchange_size"])
+    record["is_estimate"] = "1" if record["is_estimate"] in ("E", "e") else "0"
+    return record
+
+
+def iter_msn(filepath):
+    """
+    streams station records from the .msn file line by line,
+    so the whole file never has to be held in memory.
+    """
+    with open(filepath) as f:
+        next(f, None)  # header
+        for line in f:
+            record = parse_msn_line(line.rstrip("\n"))
+            if record is not None:
+                yield record
+
+
+def read_msn_columns(filepath, other_records=False):
+    """
+    bulk parser: views the whole .msn file as a fixed-width byte array with numpy
+    and slices every column in one pass. returns {field: [values]} for the type "A" rows.
+    with other_records, returns (columns, records): records holds the alias, group, connection and
+    routeing group records as parse_msn returns them (without "stations"), parsed line by line.
+    """
+    import numpy as np
+
+    with open(filepath, "rb") as f:
+        lines = f.read().split(b"\n")[1:]  # skip header
+
+    width = max(s.stop for _, s in _record_slices)
+    rows = np.array(lines, dtype="S{}".format(width)).view(np.uint8)
+    rows = rows.reshape(-1, width)
+    # lower-casing the first byte matches both "A" and "a"
+    kinds = rows[:, 0] | 0x20
+    rows = rows[kinds == ord("a")]
+
+    columns = {}
+    for k, s in _record_slices:
+        col = np.ascontiguousarray(rows[:, s]).view(
+            "S{}".format(s.stop - s.start)).ravel()
+        columns[k] = [v.strip().decode("latin-1") for v in col.tolist()]
+
+    sizes = {}
+    for code in set(columns["interchange_size"]):
+        sizes[code] = _interchange_size(code)
+    columns["interchange_size"] = [sizes[c] for c in columns["interchange_size"]]
+    columns["is_estimate"] = ["1" if e in ("E", "e") else "0"
+                              for e in columns["is_estimate"]]
+
+    if not other_records:
+        return columns
+    # a few thousand rows at the end of the file, not worth vectorising
+    records = {kind: [] for kind, _ in _record_parsers.values() if kind != "stations"}
+    other = np.isin(kinds, np.frombuffer(b"lvmr", dtype=np.uint8))
+    for i in np.flatnonzero(other).tolist():
+        line = lines[i].decode("latin-1").rstrip("\r")
+        kind, parse = _record_parsers[line[:1].upper()]
+        records[kind].append(parse(line))
+    return columns, records
+
+
+def read_msn_bulk(filepath):
+    """
+    same records as iter_msn, built from read_msn_columns.
+    """
+    columns = read_msn_columns(filepath)
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+_record_parsers = {
+    "A": ("stations", parse_msn_line),
+    "L": ("aliases", lambda line: _slice_record(line, msn_alias_pos)),
+    "V": ("groups", _parse_group),
+    "M": ("connections", _parse_connection),
+    "R": ("routeing_groups", _parse_group),
+}
+
+
+def _line_hash(line):
+    return hashlib.blake2b(line.encode("latin-1"), digest_size=10).hexdigest()
+
+
+def load_line_cache(cache_file):
+    # {line hash: [kind, record]} as written by save_line_cache, empty before the first run
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+    return {}
+
+
+def save_line_cache(cache_file, seen):
+    tmp = "{}.{}.tmp".format(cache_file, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(seen, f, ensure_ascii=False)
+    os.replace(tmp, cache_file)
+
+
+def iter_msn_records(filepath, cache=None, seen=None, stats=None):
+    """
+    streams (kind, record) for every record type of the .msn file, kind as in parse_msn.
+
+    lines found in cache ({line hash: [kind, record]}) are not parsed again, every line read is
+    added to seen in the same shape, and stats counts the lines "reused" and "parsed".
+    without a cache or seen, lines are not hashed at all.
+    """
+    track = cache is not None or seen is not None
+    with open(filepath) as f:
+        next(f, None)  # header
+        for line in f:
+            line = line.rstrip("\n")
+            parser = _record_parsers.get(line[:1].upper())
+            if parser is None:
+                continue
+            kind, parse = parser
+
+            h = _line_hash(line) if track else None
+            cached = cache.get(h) if cache else None
+            if cached is not None:
+                record = cached[1]
+                if stats is not None:
+                    stats["reused"] += 1
+            else:
+                record = parse(line)
+                if stats is not None:
+                    stats["parsed"] += 1
+            if seen is not None:
+                seen[h] = (kind, record)
+            yield kind, record
+
+
+def parse_msn(filepath, cache_file=None):
+    """
+    parses every record type of the .msn file in a single pass.
+
+    returns (records, stats), where records holds the raw record lists keyed by
+    "stations", "aliases", "groups", "connections" and "routeing_groups".
+
+    with a cache_file, parsed records are stored keyed by the content hash of their line.
+    re-running on a new weekly drop only parses lines whose hash is not in the cache,
+    stats reports how many lines were reused, parsed or dropped since the last run.
+    """
+    # lines are only hashed and tracked to keep a cache
+    cache = load_line_cache(cache_file) if cache_file else None
+    seen = {} if cache_file else None
+    records = {kind: [] for kind, _ in _record_parsers.values()}
+    stats = {"reused": 0, "parsed": 0, "removed": 0}
+
+    for kind, record in iter_msn_records(filepath, cache, seen, stats):
+        records[kind].append(record)
+
+    if cache_file:
+        stats["removed"] = len(set(cache) - set(seen))
+        save_line_cache(cache_file, seen)
+
+    return records, stats
+
+
+def write_stations_json(keys, rows, f):
+    """
+    writes station rows (tuples of string values, in the order of keys) to f exactly as
+    json.dump(records, f, indent=4, ensure_ascii=False) writes the record dicts, without building them.
+    returns the number of rows written.
+    """
+    from json.encoder import encode_basestring
+
+    heads = ["        {}: ".format(encode_basestring(k)) for k in keys]
+    n = 0
+    for row in rows:
+        f.write(",\n    {\n" if n else "[\n    {\n")
+        f.write(",\n".join([h + encode_basestring(v) for h, v in zip(heads, row)]))
+        f.write("\n    }")
+        n += 1
+    f.write("\n]" if n else "[]")
+    return n
+
+
+def link_records(records):
+    """
+    builds the lookup structures used by name search from the non-station records:
+        aliases         alias name -> station name
+        groups          group 3-Alpha code and group name -> member 3-Alpha codes
+        connections     3-Alpha code -> [{"to": 3-Alpha code, "walk_time": minutes}]
+    connections are stored both ways.
+    """
+    aliases = {}
+    for a in records["aliases"]:
+        aliases[a["alias_name"].upper()] = a["station_name"].upper()
+
+    groups = {}
+    for g in records["groups"] + records["routeing_groups"]:
+        for key in (g["group_CRS"], g["group_name"]):
+            if key:
+                groups.setdefault(key.upper(), [])
+                for m in g["members"]:
+                    if m not in groups[key.upper()]:
+                        groups[key.upper()].append(m)
+
+    connections = {}
+    for c in records["connections"]:
+        for a, b in ((c["from_CRS"], c["to_CRS"]), (c["to_CRS"], c["from_CRS"])):
+            connections.setdefault(a, []).append(
+                {"to": b, "walk_time": c["walk_time"]})
+
+    return {"aliases": aliases, "groups": groups, "connections": connections}
+
+
+def links_file(dict_file):
+    # temp.json -> temp.links.json, stations.bin -> stations.links.json
+    return os.path.splitext(dict_file)[0] + ".links.json"
+
+
+def load_links(dict_file):
+    path = links_file(dict_file)
+    if not os.path.exists(path):
+        return {"aliases": {}, "groups": {}, "connections": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def resolve_links(query, links):
+    """
+    returns (station names, 3-Alpha codes) that query resolves to as an alias or a group.
+    """
+    query = query.upper().strip()
+    station_names = []
+    alias = links["aliases"].get(query)
+    if alias:
+        station_names.append(alias)
+    return station_names, list(links["groups"].get(query, []))
@@ -0,0 +1,212 @@
+"""
+station name search engine, built once from the station records.
+
+results are ranked exact > prefix > token prefix > substring > fuzzy (edit distance),
+with the interchange size as tie-breaker, so "coventy" still finds COVENTRY
+and "st al" puts ST ALBANS CITY ahead of every name merely containing "ST AL".
+"""
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+
+# tiers, lower is better
+EXACT = 0
+PREFIX = 1
+TOKEN = 2
+SUBSTRING = 3
+FUZZY = 4
+
+interchange_rank = {
+    "large": 3,
+    "medium": 2,
+    "small": 1,
+    "none": 0,
+}
+
+
+def _normalise(name):
+    return " ".join(name.upper().split())
+
+
+def _trigrams(text):
+    text = " {} ".format(text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# fuzzy matching only kicks in from this many characters, shorter queries are still being typed
+MIN_FUZZY_LENGTH = 4
+# how many of the names sharing the most trigrams with the query get an edit distance check
+FUZZY_CANDIDATES = 32
+
+
+def _max_distance(query):
+    if len(query) <= 4:
+        return 1
+    if len(query) <= 8:
+        return 2
+    return 3
+
+
+def edit_distance(a, b, limit):
+    """
+    levenshtein distance between a and b, or limit + 1 if they are further apart than limit.
+    uses the bit-parallel algorithm (one column of the DP table per big-int operation).
+    ref: Hyyro, "Explaining and extending the bit-parallel approximate string matching algorithm of Myers"
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a:
+        return len(b)
+
+    peq = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    mask = (1 << len(a)) - 1
+    high = 1 << (len(a) - 1)
+    pv = mask
+    mv = 0
+    score = len(a)
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+    return score if score <= limit else limit + 1
+
+
+class NameSearch(object):
+
+    def __init__(self, records, links=None):
+        self.records = records
+        links = links or {"aliases": {}, "groups": {}}
+
+        # every searchable name (station names and their aliases) points at a record
+        entries = []
+        by_name = {}
+        for i, s in enumerate(records):
+            name = _normalise(s["station_name"])
+            entries.append((name, i))
+            by_name.setdefault(name, []).append(i)
+        for alias, station_name in links["aliases"].items():
+            for i in by_name.get(_normalise(station_name), []):
+                entries.append((_normalise(alias), i))
+
+        self._names = sorted(entries)
+        self._name_keys = [n for n, _ in self._names]
+        self._name_tokens = [name.split() for name in self._name_keys]
+
+        tokens = set()
+        for name, i in entries:
+            for t in name.split():
+                tokens.add((t, i))
+        self._tokens = sorted(tokens)
+        self._token_keys = [t for t, _ in self._tokens]
+
+        self._trigrams = {}
+        for n, (name, i) in enumerate(self._names):
+            for g in _trigrams(name):
+                self._trigrams.setdefault(g, []).append(n)
+
+        crs = {}
+        for i, s in enumerate(records):
+            for code in (s["CRS_main"], s["CRS_secondary"]):
+                crs.setdefault(code, []).append(i)
+        self._groups = {}
+        for key, members in links["groups"].items():
+            self._groups[_normalise(key)] = [i for c in members for i in crs.get(c, [])]
+
+        self._interchange = [interchange_rank.get(s["interchange_size"], -1)
+                             for s in records]
+
+    def _prefixed(self, keys, items, prefix):
+        start = bisect_left(keys, prefix)
+        for n in range(start, len(keys)):
+            if not keys[n].startswith(prefix):
+                break
+            yield items[n]
+
+    def _substring(self, query):
+        grams = _trigrams(query)
+        # leading/trailing padding only matches at word boundaries, not inside a name
+        grams = [g for g in grams if " " not in (g[0], g[-1])] or grams
+        if len(query) < 3 or not grams:
+            return [(name, i) for name, i in self._names if query in name]
+
+        postings = sorted((self._trigrams.get(g, []) for g in grams), key=len)
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates.intersection_update(p)
+            if not candidates:
+                break
+        return [self._names[n] for n in candidates if query in self._names[n][0]]
+
+    def _fuzzy(self, query):
+        limit = _max_distance(query)
+
+        shared = Counter(chain.from_iterable(
+            self._trigrams.get(g, ()) for g in _trigrams(query)))
+
+        # only the names sharing the most trigrams are worth an edit distance check,
+        # single words are also compared against every word of the name
+        single_word = " " not in query
+        for n, _ in shared.most_common(FUZZY_CANDIDATES):
+            name, i = self._names[n]
+            strings = [name, name[:len(query)]]
+            if single_word:
+                strings += self._name_tokens[n]
+            distance = min(edit_distance(query, s, limit) for s in strings)
+            if distance <= limit:
+                yield distance, i
+
+    def search(self, query, limit=10, fuzzy=True):
+        """
+        returns up to limit records (all of them if limit is None) ranked by how well they match query.
+        fuzzy matches only fill up the results when there are fewer than limit direct matches
+        (or none at all when limit is None).
+        """
+        query = _normalise(query)
+        if not query:
+            return []
+
+        best = {}
+
+        def add(i, tier, distance=0):
+            key = (tier, distance)
+            if i not in best or key < best[i]:
+                best[i] = key
+
+        def full():
+            # results are ordered by tier first, so once the better tiers fill the limit
+            # the remaining tiers cannot change the outcome
+            return limit is not None and len(best) >= limit
+
+        for i in self._groups.get(query, []):
+            add(i, EXACT)
+        for name, i in self._prefixed(self._name_keys, self._names, query):
+            add(i, EXACT if name == query else PREFIX)
+        if not full():
+            for _, i in self._prefixed(self._token_keys, self._tokens, query):
+                add(i, TOKEN)
+        if not full():
+            for _, i in self._substring(query):
+                add(i, SUBSTRING)
+
+        if fuzzy and len(query) >= MIN_FUZZY_LENGTH and not full() and (limit is not None or not best):
+            for distance, i in self._fuzzy(query):
+                add(i, FUZZY, distance)
+
+        ranked = sorted(best, key=lambda i: (best[i], -self._interchange[i],
+                                             len(self.records[i]["station_name"]), i))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.records[i] for i in ranked]
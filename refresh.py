@@ -0,0 +1,280 @@
+"""
+weekly refresh of the ATOC dataset: ingest a new drop, build everything from it in a background worker
+and switch readers over in one step.
+
+    data/releases/
+        versions/20181101T090000-3fa1c2d4/     one directory per drop
+            temp.json, temp.links.json         parse_CRS output
+            temp.bin                           binary station store
+            timetable.cif/                     CIF schedules (cif.py), when the drop has a .mca file
+            manifest.json                      source, file hashes, counts
+            diff.json                          changes against the release it replaced
+        current -> versions/20181101T090000-3fa1c2d4
+
+a drop is a directory or a zip holding the .msn file (and optionally the .mca timetable). a release is
+built in a staging directory and renamed into versions/ when complete, then the "current" symlink is
+replaced atomically, so anything reading data/releases/current/temp.json (the lookup service,
+get_index with auto_reload) sees either the old or the new dataset, never a half-written one.
+
+    python main.py refresh ./downloads/ttis074.zip
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+RELEASES = os.path.join("data", "releases")
+DATASET_FILE = "temp.json"
+# the timetable and station files of an ATOC drop, by extension
+DROP_FILES = (".msn", ".mca")
+
+
+def _sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def current_dir(root=RELEASES):
+    """
+    directory of the current release, None before the first refresh.
+    """
+    path = os.path.join(root, "current")
+    return os.path.realpath(path) if os.path.exists(path) else None
+
+
+def current_dataset(root=RELEASES):
+    """
+    the stable path of the current dataset, to pass as dict_file.
+    """
+    return os.path.join(root, "current", DATASET_FILE)
+
+
+def _manifest(release):
+    try:
+        with open(os.path.join(release, "manifest.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ingest(source, directory):
+    """
+    copies the .msn / .mca files of a drop (directory or zip) into directory. returns {extension: path}.
+    """
+    found = {}
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as z:
+            for info in z.infolist():
+                ext = os.path.splitext(info.filename)[1].lower()
+                if ext in DROP_FILES and ext not in found:
+                    target = os.path.join(directory, os.path.basename(info.filename))
+                    with z.open(info) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                    found[ext] = target
+    elif os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            ext = os.path.splitext(name)[1].lower()
+            if ext in DROP_FILES and ext not in found:
+                target = os.path.join(directory, name)
+                shutil.copyfile(os.path.join(source, name), target)
+                found[ext] = target
+    else:
+        raise SystemExit("not a directory or zip: {}".format(source))
+
+    if ".msn" not in found:
+        raise SystemExit("no .msn file in {}".format(source))
+    return found
+
+
+def _key(s):
+    return s["TIPLOC"]
+
+
+def diff_stations(old, new):
+    """
+    changes between two lists of station records, joined on TIPLOC through dicts (one pass over each list):
+        added / removed     stations whose TIPLOC appears / disappears
+        recoded             same TIPLOC, different CRS codes
+        renamed             same TIPLOC, different name
+        moved               same TIPLOC, different coordinates (distance in metres)
+    """
+    old_by = {_key(s): s for s in old}
+    new_by = {_key(s): s for s in new}
+
+    def brief(s):
+        return {"TIPLOC": s["TIPLOC"], "CRS": s["CRS_main"], "station_name": s["station_name"]}
+
+    diff = {"added": [brief(new_by[k]) for k in sorted(new_by.keys() - old_by.keys())],
+            "removed": [brief(old_by[k]) for k in sorted(old_by.keys() - new_by.keys())],
+            "recoded": [], "renamed": [], "moved": []}
+
+    for k in sorted(old_by.keys() & new_by.keys()):
+        a, b = old_by[k], new_by[k]
+        if a == b:
+            continue
+        if (a["CRS_main"], a["CRS_secondary"]) != (b["CRS_main"], b["CRS_secondary"]):
+            diff["recoded"].append(dict(brief(b), was=a["CRS_main"],
+                                        secondary=b["CRS_secondary"], was_secondary=a["CRS_secondary"]))
+        if a["station_name"] != b["station_name"]:
+            diff["renamed"].append(dict(brief(b), was=a["station_name"]))
+        if (a["easting"], a["northing"]) != (b["easting"], b["northing"]):
+            de = int(b["easting"] or 0) - int(a["easting"] or 0)
+            dn = int(b["northing"] or 0) - int(a["northing"] or 0)
+            # grid units are 100 m
+            diff["moved"].append(dict(brief(b), was=[a["easting"], a["northing"]], now=[b["easting"], b["northing"]],
+                                      distance=int(round((de * de + dn * dn) ** 0.5 * 100))))
+
+    diff["summary"] = {k: len(v) for k, v in diff.items()}
+    return diff
+
+
+def build_release(source, root=RELEASES, force=False):
+    """
+    builds a release from a drop and makes it current. returns its manifest, with "diff" holding
+    the summary of changes; a drop identical to the current release is not rebuilt (unless force)
+    and comes back with "unchanged": True.
+    """
+    from main import parse_CRS
+    from station_store import source_identity, write_store
+
+    versions = os.path.join(root, "versions")
+    os.makedirs(versions, exist_ok=True)
+    staging = os.path.join(root, "staging.{}".format(os.getpid()))
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    try:
+        files = ingest(source, staging)
+        hashes = {os.path.basename(p): _sha1(p) for p in files.values()}
+        previous = current_dir(root)
+        manifest = _manifest(previous) if previous else None
+        if manifest and manifest["files"] == hashes and not force:
+            return dict(manifest, unchanged=True)
+
+        dataset = os.path.join(staging, DATASET_FILE)
+        parse_CRS(filepath=files[".msn"], output_file=dataset)
+        with open(dataset) as f:
+            stations = json.load(f)
+        write_store(stations, os.path.splitext(dataset)[0] + ".bin", source_identity(dataset))
+
+        schedules = None
+        if ".mca" in files:
+            from cif import parse_cif
+            schedules, _ = parse_cif(files[".mca"], os.path.join(staging, "timetable.cif"))
+
+        old = []
+        if previous:
+            with open(os.path.join(previous, DATASET_FILE)) as f:
+                old = json.load(f)
+        diff = diff_stations(old, stations)
+        with open(os.path.join(staging, "diff.json"), "w") as f:
+            json.dump(diff, f, indent=4, ensure_ascii=False)
+
+        # the raw drop is not kept, the hashes identify it
+        for path in files.values():
+            os.remove(path)
+
+        created = datetime.datetime.now()
+        version = "{}-{}".format(created.strftime("%Y%m%dT%H%M%S"),
+                                 hashlib.sha1("".join(sorted(hashes.values())).encode()).hexdigest()[:8])
+        manifest = {"version": version, "created": created.isoformat(timespec="seconds"),
+                    "source": os.path.abspath(source), "files": hashes, "stations": len(stations),
+                    "schedules": schedules, "previous": os.path.basename(previous) if previous else None,
+                    "diff": diff["summary"]}
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+
+        release = os.path.join(versions, version)
+        os.rename(staging, release)
+        switch(root, version)
+        return manifest
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def switch(root, version):
+    """
+    points root/current at versions/<version>, replacing the link in one rename.
+    """
+    link = os.path.join(root, "current")
+    tmp = "{}.{}.tmp".format(link, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(os.path.join("versions", version), tmp)
+    os.replace(tmp, link)
+
+
+def prune(root=RELEASES, keep=3):
+    """
+    removes all but the newest `keep` releases, never the current one. returns the removed versions.
+    """
+    versions = os.path.join(root, "versions")
+    current = current_dir(root)
+    names = sorted(os.listdir(versions)) if os.path.isdir(versions) else []
+    removed = []
+    for name in names[:-keep] if keep else names:
+        path = os.path.join(versions, name)
+        if os.path.realpath(path) != current:
+            shutil.rmtree(path)
+            removed.append(name)
+    return removed
+
+
+class Refresher(object):
+    """
+    runs refreshes one at a time in a background worker, a separate process by default so parsing
+    does not hold up a service running in this one. submit() returns a concurrent.futures.Future
+    of the new release's manifest.
+    """
+
+    def __init__(self, root=RELEASES, keep=3, processes=True):
+        self.root = root
+        self.keep = keep
+        self.executor = ProcessPoolExecutor(1) if processes else ThreadPoolExecutor(1)
+
+    def submit(self, source, force=False):
+        future = self.executor.submit(build_release, source, self.root, force)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        if not future.cancelled() and future.exception() is None:
+            prune(self.root, self.keep)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def refresh_main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py refresh",
+                                     description="build a new release from an ATOC drop and make it current")
+    parser.add_argument("source", help="directory or zip with the .msn (and .mca) file")
+    parser.add_argument("--root", default=RELEASES)
+    parser.add_argument("--keep", type=int, default=3, help="releases to keep")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the drop is unchanged")
+    parser.add_argument("--diff", action="store_true", help="print the full diff")
+    args = parser.parse_args(argv)
+
+    refresher = Refresher(args.root, args.keep)
+    try:
+        manifest = refresher.submit(args.source, args.force).result()
+    finally:
+        refresher.close()
+
+    if manifest.get("unchanged"):
+        print("unchanged, current release is {}".format(manifest["version"]))
+        return manifest
+    print("{} is current: {} stations, {}".format(
+        manifest["version"], manifest["stations"],
+        ", ".join("{} {}".format(n, k) for k, n in manifest["diff"].items())))
+    if args.diff:
+        with open(os.path.join(args.root, "versions", manifest["version"], "diff.json")) as f:
+            print(f.read())
+    return manifest
@@ -0,0 +1,549 @@
+"""
+record and replay of the live APIs (TransportAPI, TfL), so the live path can be exercised offline.
+
+    with recording("live.replay"):              # every requests call is captured, real responses
+        search_by_station("ZFD")
+        tfl.check_status_of_all_lines()
+
+    with replaying("live.replay", latency=0.05, rate=200):
+        search_by_station("ZFD")                # answered from the archive, no network
+
+    with ReplayServer("live.replay", latency="recorded") as server:
+        client = TransportClient(base_url=server.url + "/v3/uk/train")
+        api = tfl.TflApi(base_url=server.url)
+
+an archive is one file: the response bodies, compressed and stored once however often they were seen,
+followed by an index of request -> responses. requests are matched by method, path and query with the api
+keys dropped (app_key, app_id, ...), falling back to the path alone. a request recorded several times
+replays its responses in the recorded order, one per request, looping round at the end (a board changing
+from poll to poll), which keeps runs deterministic.
+
+latency is a fixed number of seconds, or "recorded" for the time the real api took (times `speed`),
+with an optional +/- jitter share from a seeded generator. rate caps the requests per second, beyond
+it requests are answered 429 as a throttling api would. unknown requests get a 404.
+
+    python main.py replay import live.replay                # the samples in providers/ as an archive
+    python main.py replay list live.replay
+    python main.py replay serve live.replay --port 8081 --latency 0.02 --rate 1000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+MAGIC = b"RAILREPLAY1\n"
+# index offset and magic again at the end of the file
+FOOTER = struct.Struct("<Q12s")
+# query parameters holding credentials, never part of a key (or of a recorded url)
+SECRET_PARAMS = ("app_key", "app_id", "api_key", "key", "token")
+
+TRANSPORTAPI_URL = "https://fcc.transportapi.com/v3/uk/train"
+TFL_URL = "https://api.tfl.gov.uk"
+PROVIDERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "providers")
+
+
+def request_key(method, url):
+    """
+    "GET /path?query" with the query sorted and credentials dropped, the host is not part of it.
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in SECRET_PARAMS)
+    return "{} {}{}".format(method.upper(), parts.path or "/", "?" + urlencode(query) if query else "")
+
+
+def _path_key(key):
+    return key.split("?", 1)[0]
+
+
+class ArchiveWriter(object):
+    """
+    builds an archive. add() the responses, close() writes the index; the file is written next to
+    path and renamed into place, so a reader never sees half an archive. with append, the responses
+    of an existing archive at path are kept.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.tmp = "{}.{}.tmp".format(path, os.getpid())
+        self.entries = {}
+        self.bodies = {}
+        self.file = open(self.tmp, "wb")
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        if append and os.path.exists(path):
+            old = Archive(path)
+            for key, responses in old.index.items():
+                for status, content_type, body, elapsed, at in responses:
+                    self.entries.setdefault(key, []).append(
+                        [status, content_type, self._store(old.body(body)), elapsed, at])
+            old.close()
+
+    def _store(self, data):
+        # bodies are stored once: a poll of an unchanged board costs an index entry
+        digest = hashlib.sha1(data).digest()
+        body = self.bodies.get(digest)
+        if body is None:
+            packed = zlib.compress(data, 6)
+            body = self.bodies[digest] = [self.file.tell(), len(packed)]
+            self.file.write(packed)
+        return body
+
+    def add(self, method, url, status, body, content_type="application/json", elapsed=0.0, at=0.0):
+        """
+        body as bytes (or a JSON-serialisable object), elapsed: seconds the api took, at: seconds
+        since the recording started.
+        """
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            self.entries.setdefault(request_key(method, url), []).append(
+                [status, content_type, self._store(body), round(elapsed, 6), round(at, 6)])
+
+    def __len__(self):
+        return sum(len(v) for v in self.entries.values())
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            offset = self.file.tell()
+            self.file.write(zlib.compress(json.dumps({"version": 1, "entries": self.entries}).encode("utf-8")))
+            self.file.write(FOOTER.pack(offset, MAGIC))
+            self.file.close()
+            self.file = None
+            os.replace(self.tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class Archive(object):
+    """
+    a recorded archive, read once into memory. index: {key: [[status, content type, [offset, length],
+    elapsed, at]]}; bodies are decompressed on first use and kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = f.read()
+        if not self.data.startswith(MAGIC) or len(self.data) < len(MAGIC) + FOOTER.size:
+            raise SystemExit("not a replay archive: {}".format(path))
+        offset, magic = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != MAGIC:
+            raise SystemExit("truncated replay archive: {}".format(path))
+        self.index = json.loads(zlib.decompress(self.data[offset:len(self.data) - FOOTER.size]))["entries"]
+        self.by_path = {}
+        for key in self.index:
+            self.by_path.setdefault(_path_key(key), key)
+        self._bodies = {}
+
+    def body(self, body):
+        offset, length = body
+        data = self._bodies.get(offset)
+        if data is None:
+            data = self._bodies[offset] = zlib.decompress(self.data[offset:offset + length])
+        return data
+
+    def responses(self, method, url):
+        """
+        (key, recorded responses) for a request, ("", []) when it was never recorded.
+        """
+        key = request_key(method, url)
+        if key not in self.index:
+            key = self.by_path.get(_path_key(key), "")
+        return key, self.index.get(key, [])
+
+    def __len__(self):
+        return sum(len(v) for v in self.index.values())
+
+    def close(self):
+        self.data = b""
+        self._bodies = {}
+
+
+def _open(archive):
+    return archive if isinstance(archive, Archive) else Archive(archive)
+
+
+class Replayer(object):
+    """
+    picks the response to a request and how long to hold it back, shared by the transport and the server.
+        latency     seconds, or "recorded" (the recorded time, times speed)
+        jitter      +/- share of the latency, e.g. 0.2
+        rate        requests per second, beyond it 429 (a burst of up to `burst` passes)
+        loop        a request's responses start over after the last one, otherwise the last one repeats
+    """
+
+    def __init__(self, archive, latency=0.0, speed=1.0, jitter=0.0, rate=None, burst=None, loop=True, seed=1):
+        self.archive = _open(archive)
+        self.latency = latency
+        self.speed = speed
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst or max(1.0, (rate or 0) / 10.0)
+        self.loop = loop
+        self.random = random.Random(seed)
+
+        self.cursors = {}
+        self.tokens = self.burst
+        self.last = time.perf_counter()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.misses = 0
+        self.throttled = 0
+
+    def _allow(self):
+        # token bucket, refilled at rate per second
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def respond(self, method, url):
+        """
+        (status, headers, body bytes, seconds to wait before answering).
+        """
+        key, responses = self.archive.responses(method, url)
+        with self.lock:
+            self.requests += 1
+            if self.rate and not self._allow():
+                self.throttled += 1
+                return 429, {"Content-Type": "application/json", "Retry-After": "1"}, \
+                    b'{"error": "rate limit exceeded"}', 0.0
+            if not responses:
+                self.misses += 1
+                return 404, {"Content-Type": "application/json", "X-Replay": "miss"}, \
+                    json.dumps({"error": "not recorded", "request": request_key(method, url)}).encode(), 0.0
+
+            i = self.cursors.get(key, 0)
+            self.cursors[key] = i + 1
+            i = i % len(responses) if self.loop else min(i, len(responses) - 1)
+            status, content_type, body, elapsed, _ = responses[i]
+
+            delay = elapsed * self.speed if self.latency == "recorded" else float(self.latency or 0)
+            if self.jitter and delay:
+                delay *= 1 + self.jitter * (2 * self.random.random() - 1)
+        return status, {"Content-Type": content_type, "X-Replay": "hit"}, self.archive.body(body), delay
+
+    def reset(self):
+        with self.lock:
+            self.cursors = {}
+            self.requests = self.misses = self.throttled = 0
+
+    def stats(self):
+        return {"requests": self.requests, "misses": self.misses, "throttled": self.throttled}
+
+
+# in-process transport, for requests
+
+def _transport_adapter():
+    import requests.adapters
+
+    class ReplayAdapter(requests.adapters.BaseAdapter):
+        """
+        a requests transport answering from a Replayer; mount it on a session or use replaying().
+        a latency above the request's read timeout raises ReadTimeout, as a slow api would.
+        """
+
+        def __init__(self, replayer):
+            super(ReplayAdapter, self).__init__()
+            self.replayer = replayer
+
+        def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+            import datetime
+
+            import requests
+            from requests.structures import CaseInsensitiveDict
+
+            status, headers, body, delay = self.replayer.respond(request.method, request.url)
+            read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+            if read_timeout is not None and delay > read_timeout:
+                time.sleep(read_timeout)
+                raise requests.ReadTimeout("replayed response held back {:.3f}s".format(delay), request=request)
+            if delay > 0:
+                time.sleep(delay)
+
+            r = requests.Response()
+            r.status_code = status
+            r.headers = CaseInsensitiveDict(headers)
+            r._content = body
+            r.encoding = "utf-8"
+            r.url = request.url
+            r.request = request
+            r.reason = {200: "OK", 404: "Not Found", 429: "Too Many Requests"}.get(status, "")
+            r.elapsed = datetime.timedelta(seconds=delay)
+            return r
+
+        def close(self):
+            pass
+
+    return ReplayAdapter
+
+
+def replay_adapter(archive, **options):
+    """
+    a requests transport adapter over an archive, options as for Replayer:
+        session.mount("https://", replay_adapter("live.replay", latency=0.05))
+    """
+    return _transport_adapter()(archive if isinstance(archive, Replayer) else Replayer(archive, **options))
+
+
+class _patched_send(object):
+    # swaps requests' HTTPAdapter.send for the life of a with block, covering sessions and requests.get alike
+
+    def __enter__(self):
+        from requests.adapters import HTTPAdapter
+
+        self.original = HTTPAdapter.send
+        HTTPAdapter.send = self._send_function()
+        return self
+
+    def __exit__(self, *exc):
+        from requests.adapters import HTTPAdapter
+
+        HTTPAdapter.send = self.original
+        self.close()
+        return False
+
+    def close(self):
+        pass
+
+
+class replaying(_patched_send):
+    """
+    with replaying(archive, latency=..., rate=...) as replayer: every request made through requests
+    is answered from the archive. options as for Replayer.
+    """
+
+    def __init__(self, archive, **options):
+        self.replayer = Replayer(archive, **options)
+
+    def _send_function(self):
+        adapter = replay_adapter(self.replayer)
+
+        def send(http_adapter, request, **kwargs):
+            return adapter.send(request, **kwargs)
+        return send
+
+    def __enter__(self):
+        super(replaying, self).__enter__()
+        return self.replayer
+
+
+class recording(_patched_send):
+    """
+    with recording(path): every response received through requests is added to the archive at path
+    (appended to it with append=True), written when the block ends.
+    """
+
+    def __init__(self, path, append=False):
+        self.writer = ArchiveWriter(path, append)
+
+    def _send_function(self):
+        original = self.original
+        writer = self.writer
+        started = time.perf_counter()
+
+        def send(http_adapter, request, **kwargs):
+            at = time.perf_counter() - started
+            r = original(http_adapter, request, **kwargs)
+            # reading content here keeps it on the response for the caller
+            writer.add(request.method, request.url, r.status_code, r.content,
+                       r.headers.get("Content-Type", "application/json"), r.elapsed.total_seconds(), at)
+            return r
+        return send
+
+    def __enter__(self):
+        super(recording, self).__enter__()
+        return self.writer
+
+    def close(self):
+        self.writer.close()
+
+
+# http server
+
+class ReplayServer(object):
+    """
+    serves an archive over http on 127.0.0.1 (keep-alive, a thread per connection), for clients that
+    only take a base url: point them at server.url followed by the path of the real api's base url.
+    options as for Replayer.
+    """
+
+    def __init__(self, archive, port=0, **options):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.replayer = archive if isinstance(archive, Replayer) else Replayer(archive, **options)
+        replayer = self.replayer
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body in one segment, keep-alive connections stall on delayed acks otherwise
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def _answer(self, send_body):
+                status, headers, body, delay = replayer.respond(self.command, self.path)
+                if delay > 0:
+                    time.sleep(delay)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._answer(True)
+
+            def do_HEAD(self):
+                self._answer(False)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def base_url(self, real_url):
+        """
+        the replayed equivalent of a real api base url, e.g. base_url(transport_client.BASE_URL).
+        """
+        return self.url + urlsplit(real_url).path.rstrip("/")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+# the samples in providers/
+
+_fixture_module = None
+
+
+def _fixture_tfl():
+    # test-api/tfl.py (FixtureApi), loaded once under its own name: the top-level tfl.py owns "tfl",
+    # and the test-api directory stays off sys.path
+    global _fixture_module
+    if _fixture_module is None:
+        import importlib.util
+
+        spec = importlib.util.spec_from_file_location(
+            "test_api_tfl", os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-api", "tfl.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _fixture_module = module
+    return _fixture_module
+
+
+def import_samples(writer, providers=PROVIDERS):
+    """
+    adds the sample responses under providers/ as the requests that return them: the ZFD board and the
+    W64717 timetables (TransportAPI), the TfL severity codes, modes and line routes, and the line status
+    and station disruption polls of every train mode (all lines in good service, as tfl.FixtureApi answers).
+    returns the number of responses added.
+    """
+    def sample(*path):
+        with open(os.path.join(providers, *path), "rb") as f:
+            return f.read()
+
+    n = len(writer)
+    writer.add("GET", TRANSPORTAPI_URL + "/station/ZFD/live.json", 200,
+               sample("transportapi", "ZFD-all-trains.json"))
+    for name in ("W64717-all-stops-today.json", "W64717-all-stops-history.json"):
+        data = sample("transportapi", name)
+        date_str = json.loads(data)["date"]
+        writer.add("GET", "{}/service/train_uid:W64717/{}/timetable.json?live=true".format(TRANSPORTAPI_URL, date_str),
+                   200, data)
+
+    writer.add("GET", TFL_URL + "/Line/Meta/Modes", 200, sample("tfl", "tfl-modes.json"))
+    # the severity file holds get_severity_list's output, put back into the api's flat shape
+    severity = json.loads(sample("tfl", "tfl-severity-modes.json"))
+    writer.add("GET", TFL_URL + "/Line/Meta/Severity", 200,
+               [{"modeName": mode, "severityLevel": s["level"], "description": s["description"]}
+                for mode, levels in severity.items() for s in levels])
+
+    tfl = _fixture_tfl()
+    fixture = tfl.FixtureApi(os.path.join(providers, "tfl"))
+    paths = ["/Line/Mode/{}/Route?serviceTypes=Regular".format(",".join(tfl.TRAIN_MODES))]
+    for m in tfl.TRAIN_MODES:
+        paths += ["/Line/Mode/{}/Route?serviceTypes=Regular".format(m),
+                  "/Line/Mode/{}/Status?detail=true".format(m),
+                  "/StopPoint/Mode/{}/Disruption?includeRouteBlockedStops=true".format(m)]
+    for path in paths:
+        writer.add("GET", TFL_URL + path, 200, fixture.get(path)[2])
+    return len(writer) - n
+
+
+def replay_main(argv=None):
+    parser = argparse.ArgumentParser(prog="main.py replay", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="write the samples in providers/ into an archive")
+    p.add_argument("archive")
+    p.add_argument("--append", action="store_true", help="keep the responses already in the archive")
+
+    p = commands.add_parser("list", help="the recorded requests of an archive")
+    p.add_argument("archive")
+
+    p = commands.add_parser("serve", help="serve an archive over http")
+    p.add_argument("archive")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--latency", default="0", help='seconds, or "recorded"')
+    p.add_argument("--speed", type=float, default=1.0, help="multiplies recorded latencies")
+    p.add_argument("--jitter", type=float, default=0.0, help="+/- share of the latency")
+    p.add_argument("--rate", type=float, help="requests per second before answering 429")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        with ArchiveWriter(args.archive, args.append) as writer:
+            n = import_samples(writer)
+        print("{} responses imported into {} ({} bytes)".format(n, args.archive, os.path.getsize(args.archive)))
+    elif args.command == "list":
+        archive = Archive(args.archive)
+        for key, responses in sorted(archive.index.items()):
+            print("{:4d}  {}  {}".format(len(responses), ",".join(sorted({str(r[0]) for r in responses})), key))
+    else:
+        latency = args.latency if args.latency == "recorded" else float(args.latency)
+        server = ReplayServer(args.archive, port=args.port, latency=latency, speed=args.speed,
+                              jitter=args.jitter, rate=args.rate)
+        print("replaying {} on {} (transportapi: {}, tfl: {})".format(
+            args.archive, server.url, server.base_url(TRANSPORTAPI_URL), server.base_url(TFL_URL)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(json.dumps(server.replayer.stats()))
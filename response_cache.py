@@ -0,0 +1,177 @@
+"""
+TTL + LRU cache for TransportAPI responses.
+
+keys are (endpoint, code, date, limit) tuples, e.g. ("live", "ZFD", "", 10) or ("timetable", "W64717", "2018-10-30", "").
+each endpoint has its own time to live: live boards go stale in seconds, the timetable of a past date never changes.
+concurrent requests for the same key share one upstream call, and an optional DiskBackend keeps entries
+across CLI restarts. cached responses are shared between callers, treat them as read-only.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# seconds
+LIVE_TTL = 30
+TODAY_TIMETABLE_TTL = 60
+PAST_TIMETABLE_TTL = 6 * 60 * 60
+
+
+def default_ttl(key):
+    endpoint, _, date_str, _ = key
+    if endpoint == "timetable":
+        if date_str and date_str < str(datetime.date.today()):
+            return PAST_TIMETABLE_TTL
+        return TODAY_TIMETABLE_TTL
+    return LIVE_TTL
+
+
+class DiskBackend(object):
+    """
+    one JSON file per key under directory, written atomically.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry["expires"], entry["value"]
+
+    def set(self, key, expires, value):
+        path = self._path(key)
+        tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "w") as f:
+            json.dump({"key": key, "expires": expires, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class uncached(object):
+    """
+    returned by a fetch to hand value to the caller (and callers waiting on the same key) without
+    caching it, e.g. an error response.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class ResponseCache(object):
+
+    def __init__(self, max_entries=1024, ttl=default_ttl, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "disk_hits": 0}
+
+    def _fresh(self, key, now):
+        # caller holds the lock
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+        return None
+
+    def _store(self, key, expires, value):
+        # caller holds the lock
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._fresh(key, now)
+        if entry is None and self.backend is not None:
+            stored = self.backend.get(key)
+            if stored is not None and stored[0] > now:
+                with self._lock:
+                    self._store(key, *stored)
+                    self.counters["disk_hits"] += 1
+                entry = stored
+        return None if entry is None else entry[1]
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl(key)
+        with self._lock:
+            self._store(key, expires, value)
+        if self.backend is not None:
+            self.backend.set(key, expires, value)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        returns the cached value for key, or calls fetch() once and caches its result (unless it is
+        wrapped in uncached). callers asking for the same key while fetch() runs wait for that call
+        instead of making their own.
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.counters["hits"] += 1
+            return value
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                from concurrent.futures import Future
+                future = Future()
+                self._in_flight[key] = future
+                self.counters["misses"] += 1
+            else:
+                self.counters["coalesced"] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = fetch()
+            if isinstance(value, uncached):
+                value = value.value
+            else:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+        return stats
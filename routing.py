@@ -0,0 +1,223 @@
+"""
+fastest journeys between stations, over the calling patterns held in a timetable.Timetable
+and the interchange walks between stations ("M" records of the .msn file, saved by parse_CRS in temp.links.json).
+
+the network is kept as flat arrays:
+    connections     one row per train hop between consecutive calls (from, to, departure, arrival, service),
+                    sorted by departure time
+    walks           CSR adjacency: walk_start[s]..walk_start[s + 1] index walk_to / walk_time
+    change_time     minutes needed to change trains at each station, from the station index
+
+queries run a connection scan (CSA): one pass over the connections leaving after the start time,
+stopping as soon as no connection can improve the arrival at the destination. staying on a train is free,
+boarding another one needs the station's change time since arriving.
+
+    network = Network.from_timetable(timetable, index=get_index(), links=load_links("temp.json"))
+    network.journey("SAC", "SUO", "09:00")
+"""
+import bisect
+from array import array
+
+from timetable import NO_TIME, format_minutes, to_minutes
+
+INFINITY = 1 << 30
+# used where the station index has no change time
+DEFAULT_CHANGE_TIME = 5
+
+
+class Network(object):
+
+    def __init__(self, codes, connections, walks=(), change_times=None):
+        """
+        codes: CRS code of each station id
+        connections: (from id, to id, departure, arrival, service) in minutes since midnight
+        walks: (from id, to id, minutes), used in both directions
+        change_times: {CRS: minutes}
+        """
+        self.codes = list(codes)
+        self.code_ids = {c: i for i, c in enumerate(self.codes)}
+        n = len(self.codes)
+
+        connections = sorted(connections, key=lambda c: (c[2], c[3]))
+        self.conn_from = array("i", [c[0] for c in connections])
+        self.conn_to = array("i", [c[1] for c in connections])
+        self.conn_dep = array("i", [c[2] for c in connections])
+        self.conn_arr = array("i", [c[3] for c in connections])
+        self.conn_service = array("i", [c[4] for c in connections])
+        self.n_services = max(self.conn_service) + 1 if connections else 0
+
+        both_ways = {}
+        for a, b, minutes in walks:
+            for x, y in ((a, b), (b, a)):
+                if x != y and minutes < both_ways.get((x, y), INFINITY):
+                    both_ways[(x, y)] = minutes
+        self.walk_start = array("i", [0] * (n + 1))
+        for x, _ in both_ways:
+            self.walk_start[x + 1] += 1
+        for i in range(n):
+            self.walk_start[i + 1] += self.walk_start[i]
+        self.walk_to = array("i", [0] * len(both_ways))
+        self.walk_time = array("i", [0] * len(both_ways))
+        fill = array("i", self.walk_start[:n])
+        for (x, y), minutes in sorted(both_ways.items()):
+            self.walk_to[fill[x]] = y
+            self.walk_time[fill[x]] = minutes
+            fill[x] += 1
+
+        change_times = change_times or {}
+        self.change_time = array("i", [change_times.get(c, DEFAULT_CHANGE_TIME) for c in self.codes])
+
+    @classmethod
+    def from_timetable(cls, timetable, index=None, links=None):
+        """
+        connections from every service in the timetable, walks from the links written by parse_CRS
+        and change times from the station index's principal records.
+        """
+        connections = []
+        for service, (first, n) in enumerate(timetable.spans):
+            previous = None
+            for row in range(first, first + n):
+                arrival = timetable.aimed_arrival[row]
+                departure = timetable.aimed_departure[row]
+                if arrival == NO_TIME and departure == NO_TIME:
+                    # passing point
+                    continue
+                station = timetable.station[row]
+                if previous is not None:
+                    connections.append((previous[0], station, previous[1],
+                                        arrival if arrival != NO_TIME else departure, service))
+                previous = (station, departure if departure != NO_TIME else arrival)
+
+        codes = list(timetable.codes)
+        code_ids = dict(timetable.code_ids)
+        walks = []
+        for a, targets in ((links or {}).get("connections") or {}).items():
+            for t in targets:
+                if t["walk_time"] is None:
+                    continue
+                for code in (a, t["to"]):
+                    if code not in code_ids:
+                        code_ids[code] = len(codes)
+                        codes.append(code)
+                walks.append((code_ids[a], code_ids[t["to"]], t["walk_time"]))
+
+        change_times = {}
+        if index is not None:
+            for s in index.records:
+                if s["CRS_main"] == s["CRS_secondary"] and s["change_time"]:
+                    change_times[s["CRS_main"]] = int(s["change_time"])
+
+        return cls(codes, connections, walks, change_times)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _id(self, code):
+        i = self.code_ids.get(code.upper())
+        if i is None:
+            raise KeyError("no trains or walks at {}".format(code))
+        return i
+
+    def _scan(self, origin, target, start):
+        """
+        connection scan from origin at start (minutes). returns (arrival at target, ready, via):
+        ready[s] is when a train can be boarded at s, via[s] how s was reached.
+        """
+        n = len(self.codes)
+        ready = [INFINITY] * n
+        via = [None] * n
+        boarded = [-1] * self.n_services
+        best = INFINITY
+
+        conn_from, conn_to = self.conn_from, self.conn_to
+        conn_dep, conn_arr, conn_service = self.conn_dep, self.conn_arr, self.conn_service
+        walk_start, walk_to, walk_time = self.walk_start, self.walk_to, self.walk_time
+        change_time = self.change_time
+
+        def reach(s, time, how):
+            # arriving at s at time, trains can be boarded change_time later
+            nonlocal best
+            if s == target:
+                if time < best:
+                    best = time
+                    via[s] = how
+                return
+            t = time + change_time[s]
+            if t < ready[s]:
+                ready[s] = t
+                via[s] = how
+
+        ready[origin] = start
+        for w in range(walk_start[origin], walk_start[origin + 1]):
+            reach(walk_to[w], start + walk_time[w], ("walk", origin, start))
+
+        for i in range(bisect.bisect_left(conn_dep, start), len(conn_dep)):
+            dep = conn_dep[i]
+            if dep >= best:
+                break
+            service = conn_service[i]
+            if boarded[service] < 0:
+                if ready[conn_from[i]] > dep:
+                    continue
+                boarded[service] = i
+            arr = conn_arr[i]
+            s = conn_to[i]
+            if s == target:
+                if arr < best:
+                    best = arr
+                    via[s] = ("ride", boarded[service], i)
+                continue
+            # staying on: the next hop of this service is boarded already, ready only matters for changes
+            if arr + change_time[s] < ready[s]:
+                ready[s] = arr + change_time[s]
+                via[s] = ("ride", boarded[service], i)
+                for w in range(walk_start[s], walk_start[s + 1]):
+                    reach(walk_to[w], arr + walk_time[w], ("walk", s, arr))
+        return best, ready, via
+
+    def earliest_arrival(self, origin, destination, start):
+        """
+        earliest arrival at destination (minutes since midnight) leaving origin at or after start, None if unreachable.
+        """
+        o, d = self._id(origin), self._id(destination)
+        start = to_minutes(start) if isinstance(start, str) else start
+        if o == d:
+            return start
+        best = self._scan(o, d, start)[0]
+        return None if best == INFINITY else best
+
+    def journey(self, origin, destination, start):
+        """
+        the fastest journey as legs [{"mode": "train" / "walk", "from", "to", "depart", "arrive", "service"}],
+        [] if origin is destination, None if it cannot be reached.
+        """
+        o, d = self._id(origin), self._id(destination)
+        start = to_minutes(start) if isinstance(start, str) else start
+        if o == d:
+            return []
+        best, _, via = self._scan(o, d, start)
+        if best == INFINITY:
+            return None
+
+        legs = []
+        s = d
+        while s != o:
+            how = via[s]
+            if how[0] == "ride":
+                first, last = how[1], how[2]
+                legs.append({"mode": "train", "from": self.codes[self.conn_from[first]], "to": self.codes[s],
+                             "depart": format_minutes(self.conn_dep[first]),
+                             "arrive": format_minutes(self.conn_arr[last]),
+                             "service": self.conn_service[first]})
+                s = self.conn_from[first]
+            else:
+                _, previous, left = how
+                w = self.walk_start[previous]
+                while self.walk_to[w] != s:
+                    w += 1
+                legs.append({"mode": "walk", "from": self.codes[previous], "to": self.codes[s],
+                             "depart": format_minutes(left), "arrive": format_minutes(left + self.walk_time[w]),
+                             "service": None})
+                s = previous
+        legs.reverse()
+        return legs
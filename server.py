@@ -0,0 +1,241 @@
+"""
+long-running HTTP lookup service, holding the station index in memory.
+
+    python main.py serve --port 8080
+
+    GET /crs/<code>                          station_from_CRS
+    GET /tiploc/<code>                       station_from_TIPLOC
+    GET /name?q=<name>&limit=10              station_from_name (ranked)
+    GET /nearest?lat=..&lon=..&k=5           nearest_stations (or easting=..&northing=..)
+    GET /live/<crs>?limit=10                 search_by_station (pooled client + response cache)
+    GET /metrics                             stage timings (metrics.py), Prometheus text or ?format=json
+    POST /reload                             re-read the dataset now
+
+every response is JSON. requests never touch the dataset file: a watcher checks its mtime every few
+seconds, builds a complete new index (search engine and spatial grid included) in a worker thread
+and swaps it in with one assignment, so in-flight requests keep using the old one.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import metrics
+from spatial import latlon_to_msn
+from station_index import load_index
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 502: "Bad Gateway"}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _build_index(dict_file):
+    with metrics.timed("load"):
+        index = load_index(dict_file, auto_reload=False)
+    # build the lazily created structures now, not on the first request after a swap
+    index.search("a")
+    index.nearest(15000, 62000, 1)
+    return index
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class LookupService(object):
+
+    def __init__(self, dict_file="temp.json", watch_interval=2.0, client=None):
+        self.dict_file = dict_file
+        self.watch_interval = watch_interval
+        self.index = _build_index(dict_file)
+        self.loaded_mtime = _mtime(dict_file)
+        self.loaded_at = time.time()
+        self.requests = 0
+        self._client = client
+        self._reloading = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from transport_client import get_client
+            self._client = get_client()
+        return self._client
+
+    async def reload(self):
+        # one reload at a time, concurrent callers wait for the running one
+        if self._reloading is None:
+            self._reloading = asyncio.ensure_future(self._reload())
+        try:
+            return await asyncio.shield(self._reloading)
+        finally:
+            if self._reloading is not None and self._reloading.done():
+                self._reloading = None
+
+    async def _reload(self):
+        loop = asyncio.get_running_loop()
+        mtime = _mtime(self.dict_file)
+        index = await loop.run_in_executor(None, _build_index, self.dict_file)
+        # atomic swap, requests already running keep the index they started with
+        self.index = index
+        self.loaded_mtime = mtime
+        self.loaded_at = time.time()
+        return len(index)
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            if _mtime(self.dict_file) != self.loaded_mtime:
+                try:
+                    await self.reload()
+                except (Exception, SystemExit) as e:
+                    # half-written file or parse error, keep serving the current index
+                    print('reload of {} failed: {}'.format(self.dict_file, e))
+
+    async def route(self, method, path, query):
+        parts = [unquote(p) for p in path.strip("/").split("/") if p]
+        index = self.index
+
+        def arg(name, default=None, cast=str):
+            values = query.get(name)
+            if not values:
+                if default is None:
+                    raise HTTPError(400, "missing parameter: {}".format(name))
+                return default
+            try:
+                return cast(values[0])
+            except ValueError:
+                raise HTTPError(400, "bad parameter: {}".format(name))
+
+        if method == "POST" and parts == ["reload"]:
+            return {"stations": await self.reload()}
+        if method != "GET":
+            raise HTTPError(405, "method not allowed")
+
+        if len(parts) == 2 and parts[0] == "crs":
+            return index.by_crs(parts[1])
+        if len(parts) == 2 and parts[0] == "tiploc":
+            return index.by_tiploc(parts[1])
+        if parts == ["name"]:
+            return index.search(arg("q"), limit=arg("limit", 10, int))
+        if parts == ["nearest"]:
+            if "lat" in query:
+                easting, northing = latlon_to_msn(arg("lat", cast=float), arg("lon", cast=float))
+            else:
+                easting, northing = arg("easting", cast=float), arg("northing", cast=float)
+            return [dict(s, distance=int(round(d)))
+                    for s, d in index.nearest(easting, northing, arg("k", 5, int))]
+        if len(parts) == 2 and parts[0] == "live":
+            client = self.client
+            limit = arg("limit", 10, int)
+            try:
+                return await client.fetch_async(client.station_url(parts[1], limit),
+                                                key=client.station_key(parts[1], limit))
+            except Exception as e:
+                raise HTTPError(502, "upstream error: {}".format(e))
+        if parts == ["metrics"]:
+            if arg("format", "prometheus") == "json":
+                return metrics.snapshot()
+            # plain text, not JSON
+            return metrics.prometheus()
+        if parts == ["status"]:
+            return {"stations": len(index), "dict_file": self.dict_file,
+                    "loaded_at": self.loaded_at, "requests": self.requests}
+        raise HTTPError(404, "not found: {}".format(path))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0) or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                              or headers.get("connection", "").lower() == "keep-alive")
+
+                self.requests += 1
+                started = time.perf_counter()
+                url = urlsplit(target)
+                try:
+                    status, body = 200, await self.route(method, url.path, parse_qs(url.query))
+                except HTTPError as e:
+                    status, body = e.status, {"error": str(e)}
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+
+                if isinstance(body, str):
+                    content_type, data = "text/plain; version=0.0.4", body.encode("utf-8")
+                else:
+                    with metrics.timed("serialise"):
+                        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                metrics.REGISTRY.observe("request", time.perf_counter() - started)
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+                             "Connection: {}\r\n\r\n".format(status, REASONS.get(status, ""), content_type,
+                                                             len(data), "keep-alive" if keep_alive else "close")
+                             .encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        watcher = asyncio.ensure_future(self.watch())
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="main.py serve", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--dict-file", default="temp.json", help="station dataset (.json or .bin)")
+    parser.add_argument("--watch-interval", type=float, default=2.0,
+                        help="seconds between checks for a new dataset")
+    args = parser.parse_args(argv)
+
+    service = LookupService(args.dict_file, watch_interval=args.watch_interval)
+
+    def ready(port):
+        print('serving {} stations on http://{}:{}'.format(len(service.index), args.host, port), flush=True)
+
+    try:
+        asyncio.run(service.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,202 @@
+"""
+grid index over the station easting / northing columns for nearest-station and radius queries.
+
+coordinates are in the .msn file's units: 100 m, with the national grid origin moved to 10000 / 60000,
+e.g. ABERDEEN 13942 / 68058 is OSGB 394200 / 805800.
+stations outside the grid (both coordinates 00000) are left out.
+distances and radii are in metres.
+"""
+import math
+
+from msn import interchange_status_structure
+
+# 10 km cells, a few stations each outside the big cities
+CELL_SIZE = 100
+
+MSN_EASTING_OFFSET = 10000
+MSN_NORTHING_OFFSET = 60000
+
+_subsidiary = interchange_status_structure[9]
+
+
+def msn_to_osgb(easting, northing):
+    return ((easting - MSN_EASTING_OFFSET) * 100, (northing - MSN_NORTHING_OFFSET) * 100)
+
+
+def osgb_to_msn(easting, northing):
+    return (easting / 100.0 + MSN_EASTING_OFFSET, northing / 100.0 + MSN_NORTHING_OFFSET)
+
+
+def latlon_to_osgb(lat, lon):
+    """
+    WGS84 latitude / longitude (degrees) to OSGB36 national grid easting / northing (metres).
+    helmert datum shift followed by the transverse mercator projection, good to a few metres.
+    ref: https://www.ordnancesurvey.co.uk/documents/resources/guide-coordinate-systems-great-britain.pdf
+    """
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+
+    # WGS84 geodetic -> cartesian
+    a, b = 6378137.0, 6356752.314245
+    e2 = 1 - (b * b) / (a * a)
+    nu = a / math.sqrt(1 - e2 * math.sin(phi) ** 2)
+    x = nu * math.cos(phi) * math.cos(lam)
+    y = nu * math.cos(phi) * math.sin(lam)
+    z = (1 - e2) * nu * math.sin(phi)
+
+    # helmert transform WGS84 -> OSGB36
+    tx, ty, tz = -446.448, 125.157, -542.060
+    s = 20.4894e-6
+    rx, ry, rz = [math.radians(v / 3600.0) for v in (-0.1502, -0.2470, -0.8421)]
+    x, y, z = (tx + (1 + s) * x - rz * y + ry * z,
+               ty + rz * x + (1 + s) * y - rx * z,
+               tz - ry * x + rx * y + (1 + s) * z)
+
+    # cartesian -> airy 1830 geodetic
+    a, b = 6377563.396, 6356256.909
+    e2 = 1 - (b * b) / (a * a)
+    p = math.sqrt(x * x + y * y)
+    phi = math.atan2(z, p * (1 - e2))
+    for _ in range(10):
+        nu = a / math.sqrt(1 - e2 * math.sin(phi) ** 2)
+        phi = math.atan2(z + e2 * nu * math.sin(phi), p)
+    lam = math.atan2(y, x)
+
+    # transverse mercator onto the national grid
+    f0 = 0.9996012717
+    phi0, lam0 = math.radians(49), math.radians(-2)
+    n0, e0 = -100000.0, 400000.0
+    n = (a - b) / (a + b)
+
+    sin_phi = math.sin(phi)
+    cos_phi = math.cos(phi)
+    tan_phi = math.tan(phi)
+    nu = a * f0 / math.sqrt(1 - e2 * sin_phi ** 2)
+    rho = a * f0 * (1 - e2) / (1 - e2 * sin_phi ** 2) ** 1.5
+    eta2 = nu / rho - 1
+
+    dphi = phi - phi0
+    sphi = phi + phi0
+    m = b * f0 * (
+        (1 + n + 5.0 / 4 * n ** 2 + 5.0 / 4 * n ** 3) * dphi
+        - (3 * n + 3 * n ** 2 + 21.0 / 8 * n ** 3) * math.sin(dphi) * math.cos(sphi)
+        + (15.0 / 8 * n ** 2 + 15.0 / 8 * n ** 3) * math.sin(2 * dphi) * math.cos(2 * sphi)
+        - 35.0 / 24 * n ** 3 * math.sin(3 * dphi) * math.cos(3 * sphi))
+
+    i = m + n0
+    ii = nu / 2 * sin_phi * cos_phi
+    iii = nu / 24 * sin_phi * cos_phi ** 3 * (5 - tan_phi ** 2 + 9 * eta2)
+    iiia = nu / 720 * sin_phi * cos_phi ** 5 * (61 - 58 * tan_phi ** 2 + tan_phi ** 4)
+    iv = nu * cos_phi
+    v = nu / 6 * cos_phi ** 3 * (nu / rho - tan_phi ** 2)
+    vi = nu / 120 * cos_phi ** 5 * (5 - 18 * tan_phi ** 2 + tan_phi ** 4 + 14 * eta2 - 58 * tan_phi ** 2 * eta2)
+
+    dl = lam - lam0
+    northing = i + ii * dl ** 2 + iii * dl ** 4 + iiia * dl ** 6
+    easting = e0 + iv * dl + v * dl ** 3 + vi * dl ** 5
+    return easting, northing
+
+
+def latlon_to_msn(lat, lon):
+    return osgb_to_msn(*latlon_to_osgb(lat, lon))
+
+
+class SpatialIndex(object):
+    """
+    uniform grid over the stations that have coordinates.
+    stations with several TIPLOCs share one position, so only one record per principal CRS is kept
+    (the principal TIPLOC where there is one).
+    """
+
+    def __init__(self, records, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.records = []
+        self._points = []
+        self._cells = {}
+
+        chosen = {}
+        for s in records:
+            easting, northing = int(s["easting"] or 0), int(s["northing"] or 0)
+            if easting == 0 and northing == 0:
+                continue
+            current = chosen.get(s["CRS_main"])
+            if current is None or (current["interchange_size"] == _subsidiary
+                                   and s["interchange_size"] != _subsidiary):
+                chosen[s["CRS_main"]] = s
+
+        for s in chosen.values():
+            point = (int(s["easting"]), int(s["northing"]))
+            i = len(self.records)
+            self.records.append(s)
+            self._points.append(point)
+            self._cells.setdefault(self._cell(*point), []).append(i)
+
+        # furthest cells in each direction, bounds the ring search in nearest()
+        xs = [c[0] for c in self._cells] or [0]
+        ys = [c[1] for c in self._cells] or [0]
+        self._bounds = (min(xs), max(xs), min(ys), max(ys))
+
+    def _cell(self, easting, northing):
+        return (int(easting // self.cell_size), int(northing // self.cell_size))
+
+    def _distance(self, i, easting, northing):
+        # in metres, the grid units are 100 m
+        e, n = self._points[i]
+        return math.hypot(e - easting, n - northing) * 100
+
+    def _ring(self, cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in range(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def nearest(self, easting, northing, k=5):
+        """
+        the k stations closest to (easting, northing) as [(record, distance in metres)], closest first.
+        """
+        if not self.records or k <= 0:
+            return []
+
+        cx, cy = self._cell(easting, northing)
+        x0, x1, y0, y1 = self._bounds
+        max_ring = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+
+        found = []
+        r = 0
+        while r <= max_ring:
+            for cell in self._ring(cx, cy, r):
+                for i in self._cells.get(cell, ()):
+                    found.append((self._distance(i, easting, northing), i))
+            # everything in rings further out is at least r cells away
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= r * self.cell_size * 100:
+                    break
+            r += 1
+
+        found.sort()
+        return [(self.records[i], d) for d, i in found[:k]]
+
+    def within(self, easting, northing, radius):
+        """
+        all stations within radius metres of (easting, northing) as [(record, distance in metres)], closest first.
+        """
+        reach = radius / 100.0
+        x0, y0 = self._cell(easting - reach, northing - reach)
+        x1, y1 = self._cell(easting + reach, northing + reach)
+
+        found = []
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                for i in self._cells.get((x, y), ()):
+                    d = self._distance(i, easting, northing)
+                    if d <= radius:
+                        found.append((d, i))
+
+        found.sort()
+        return [(self.records[i], d) for d, i in found]
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+
+from metrics import timed
+from msn import load_links, resolve_links
+from station_store import DerivedIndexes, StationStore
+
+
+class StationIndex(DerivedIndexes):
+    """
+    in-memory index over the station records written by parse_CRS (temp.json).
+    the file is loaded once and CRS / TIPLOC lookups are served from hash maps.
+    if auto_reload is set, the file's mtime is checked (at most every check_interval seconds)
+    and the index is rebuilt when parse_CRS writes a new dataset.
+    """
+
+    def __init__(self, dict_file="temp.json", auto_reload=True, check_interval=1.0):
+        self.dict_file = dict_file
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+        self._state = None
+        self._derived_cache = {}
+
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.dict_file)
+        with open(self.dict_file) as f:
+            records = json.load(f)
+
+        crs = {}
+        tiploc = {}
+        names = []
+        exact_names = {}
+        for s in records:
+            # a record can be found by both its main and secondary CRS,
+            # but only once if both codes are the same
+            for code in {s['CRS_main'], s['CRS_secondary']}:
+                crs.setdefault(code, []).append(s)
+            tiploc.setdefault(s['TIPLOC'], []).append(s)
+            names.append(s['station_name'])
+            exact_names.setdefault(s['station_name'], []).append(s)
+
+        # aliases and groups written next to the dataset by parse_CRS, if any
+        links = load_links(self.dict_file)
+
+        # swap everything in one assignment so readers never see a half-built index
+        self._state = (records, crs, tiploc, names, exact_names, links)
+        self._mtime = mtime
+        self._last_check = time.monotonic()
+
+    def _maybe_reload(self):
+        if not self.auto_reload:
+            return self._state
+
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            with self._lock:
+                self._last_check = now
+                try:
+                    mtime = os.path.getmtime(self.dict_file)
+                except OSError:
+                    # file is being replaced, keep serving the current index
+                    mtime = self._mtime
+                if mtime != self._mtime:
+                    self.load()
+        return self._state
+
+    def _state_records(self, state):
+        return state[0]
+
+    def _state_links(self, state):
+        return state[5]
+
+    @property
+    def records(self):
+        self._maybe_reload()
+        return self._state[0]
+
+    def by_crs(self, crs):
+        self._maybe_reload()
+        return list(self._state[1].get(crs.upper(), []))
+
+    def by_tiploc(self, tiploc):
+        self._maybe_reload()
+        return list(self._state[2].get(tiploc.upper(), []))
+
+    def by_name(self, station_name):
+        self._maybe_reload()
+        records, crs, _, names, exact_names, links = self._state
+        query = station_name.upper()
+        output = [records[i] for i, n in enumerate(names) if query in n]
+
+        # aliases and group codes like LON resolve to their stations
+        alias_names, group_crs = resolve_links(query, links)
+        linked = [s for n in alias_names for s in exact_names.get(n, [])]
+        linked += [s for c in group_crs for s in crs.get(c, [])]
+        for s in linked:
+            if s not in output:
+                output.append(s)
+        return output
+
+    def __len__(self):
+        return len(self.records)
+
+
+def load_index(dict_file="temp.json", auto_reload=True):
+    """
+    a new (not shared) index over dict_file.
+    a .bin file is a binary store written by parse_CRS(output_file="*.bin"), queried straight from mmap.
+    temp.json is served from a binary copy next to it (temp.bin), built on first use and
+    whenever temp.json changes, so later runs skip parsing the JSON altogether.
+    """
+    if dict_file.endswith(".bin"):
+        return StationStore(dict_file, auto_reload=auto_reload)
+    try:
+        return StationStore(os.path.splitext(dict_file)[0] + ".bin", auto_reload=auto_reload, source=dict_file)
+    except OSError:
+        # read-only directory
+        return StationIndex(dict_file, auto_reload=auto_reload)
+
+
+# one index per dataset file, shared by the whole process
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(dict_file="temp.json"):
+    key = os.path.abspath(dict_file)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                with timed("load"):
+                    index = load_index(dict_file)
+                _indexes[key] = index
+    return index
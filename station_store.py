@@ -0,0 +1,359 @@
+"""
+compact, memory-mappable station store.
+
+the same records as temp.json, but with typed, fixed-width columns:
+
+    header      offsets, plus the identity of the source file (temp.json) the store was built from
+    rows        one struct per station (TIPLOC, CRS codes, coordinates as ints,
+                change time, interchange size as an enum code)
+    names       station names, 31 bytes each (30, null padded, + newline), so a name search is a single find() over the block
+    crs table   (CRS code, row) sorted by code, covers both CRS_main and CRS_secondary
+    tiploc table (TIPLOC, row) sorted by TIPLOC
+
+lookups binary search the key tables straight out of the mmap, only the matching rows are decoded.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from metrics import timed
+from msn import interchange_status_structure, load_links, resolve_links
+from name_search import NameSearch
+from spatial import SpatialIndex
+
+MAGIC = b"MSNSTORE"
+VERSION = 2
+
+# magic, version, row count, rows offset, names offset, crs offset, crs entries, tiploc offset,
+# source mtime (ns), source size, source sha1
+_header = struct.Struct("<8sHIIIIIIqQ20s")
+_no_source = (0, 0, b"\x00" * 20)
+# TIPLOC, CRS_secondary, CRS_main, easting, northing, is_estimate, change_time, interchange code
+_row = struct.Struct("<7s3s3sHIBBB")
+_crs_entry = struct.Struct("<3sI")
+_tiploc_entry = struct.Struct("<7sI")
+_name_width = 31
+
+_interchange_codes = {v: k for k, v in interchange_status_structure.items()}
+_no_change_time = 255
+
+
+def _pack_row(s):
+    change_time = s["change_time"]
+    return _row.pack(
+        s["TIPLOC"].encode("latin-1"),
+        s["CRS_secondary"].encode("latin-1"),
+        s["CRS_main"].encode("latin-1"),
+        int(s["easting"] or 0),
+        int(s["northing"] or 0),
+        int(s["is_estimate"] or 0),
+        int(change_time) if change_time.isdigit() else _no_change_time,
+        _interchange_codes[s["interchange_size"]],
+    )
+
+
+def _read_source(path):
+    # (identity, contents), the identity taken from the open file so it describes the bytes read
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    return (st.st_mtime_ns, st.st_size, hashlib.sha1(data).digest()), data
+
+
+def source_identity(path):
+    """
+    (mtime in ns, size, sha1) of a source file, as recorded in the header of a store built from it.
+    """
+    return _read_source(path)[0]
+
+
+def write_store(records, path, source=None):
+    """
+    writes records (as produced by parse_CRS) to path. the file is written next to
+    the target and renamed into place, so readers never see a half-written store.
+    source is the source_identity() of the file the records were read from, a store
+    without one is rebuilt by a StationStore that has a source.
+    """
+    rows = b"".join(_pack_row(s) for s in records)
+    names = b"".join(s["station_name"].encode("latin-1").ljust(_name_width - 1, b"\x00") + b"\n"
+                     for s in records)
+
+    crs = []
+    tiploc = []
+    for i, s in enumerate(records):
+        for code in sorted({s["CRS_main"], s["CRS_secondary"]}):
+            crs.append((code.encode("latin-1"), i))
+        tiploc.append((s["TIPLOC"].encode("latin-1"), i))
+    crs.sort()
+    tiploc.sort()
+
+    crs_block = b"".join(_crs_entry.pack(*e) for e in crs)
+    tiploc_block = b"".join(_tiploc_entry.pack(*e) for e in tiploc)
+
+    rows_off = _header.size
+    names_off = rows_off + len(rows)
+    crs_off = names_off + len(names)
+    tiploc_off = crs_off + len(crs_block)
+    header = _header.pack(MAGIC, VERSION, len(records), rows_off, names_off,
+                          crs_off, len(crs), tiploc_off, *(source or _no_source))
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(rows)
+        f.write(names)
+        f.write(crs_block)
+        f.write(tiploc_block)
+    os.replace(tmp, path)
+
+
+def convert(json_file="temp.json", path="stations.bin"):
+    identity, data = _read_source(json_file)
+    write_store(json.loads(data), path, identity)
+
+
+def _stored_source(path):
+    # source identity in the header of the store at path, None without a readable store
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_header.size)
+    except OSError:
+        return None
+    if len(header) < _header.size:
+        return None
+    fields = _header.unpack(header)
+    if fields[0] != MAGIC or fields[1] != VERSION:
+        return None
+    return fields[8:]
+
+
+class DerivedIndexes(object):
+    """
+    name search and spatial index, built from the loaded records on first use
+    and again after the dataset is reloaded.
+    expects _maybe_reload() to return the current state, plus _state_records(state) and _state_links(state).
+    """
+
+    def _derived(self, name, build):
+        state = self._maybe_reload()
+        cached = self._derived_cache.get(name)
+        if cached is None or cached[0] is not state:
+            with timed("index"):
+                cached = (state, build(state))
+            self._derived_cache[name] = cached
+        return cached[1]
+
+    def search(self, query, limit=10, fuzzy=True):
+        engine = self._derived("search", lambda state: NameSearch(
+            self._state_records(state), self._state_links(state)))
+        return engine.search(query, limit=limit, fuzzy=fuzzy)
+
+    def nearest(self, easting, northing, k=5):
+        grid = self._derived("spatial", lambda state: SpatialIndex(
+            self._state_records(state)))
+        return grid.nearest(easting, northing, k)
+
+    def within(self, easting, northing, radius):
+        grid = self._derived("spatial", lambda state: SpatialIndex(
+            self._state_records(state)))
+        return grid.within(easting, northing, radius)
+
+
+class StationStore(DerivedIndexes):
+    """
+    read-only view over a file written by write_store.
+    offers the same lookups as StationIndex (by_crs, by_tiploc, by_name) and returns
+    records in the same shape as temp.json.
+    with a source (temp.json), the store is a pre-built copy of it: written when missing
+    and rebuilt whenever the source differs from the one recorded in the store (mtime, size,
+    then sha1), older or newer.
+    """
+
+    def __init__(self, path="stations.bin", auto_reload=True, check_interval=1.0, source=None):
+        self.path = path
+        self.auto_reload = auto_reload
+        self.check_interval = check_interval
+        self.source = source
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        # source (mtime, size) whose sha1 was found to match the store, saves hashing it again
+        self._verified = None
+        self._last_check = 0.0
+        self._state = None
+        self._derived_cache = {}
+
+        self.load()
+
+    def _stale(self):
+        if self.source is None:
+            return False
+        stored = _stored_source(self.path)
+        if stored is None:
+            # no store yet, or one in an older format
+            return True
+        try:
+            st = os.stat(self.source)
+        except OSError:
+            # nothing to rebuild from, keep serving the store
+            return False
+        if (st.st_mtime_ns, st.st_size) == stored[:2] or self._verified == (st.st_mtime_ns, st.st_size, stored[2]):
+            return False
+        # touched or copied, but maybe not changed
+        mtime_ns, size, digest = source_identity(self.source)
+        if digest != stored[2]:
+            return True
+        self._verified = (mtime_ns, size, digest)
+        return False
+
+    def load(self):
+        if self._stale():
+            convert(self.source, self.path)
+
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(buf) < _header.size or buf[:8] != MAGIC or struct.unpack_from("<H", buf, 8)[0] != VERSION:
+            raise SystemExit('not a station store: {}'.format(self.path))
+        count, rows_off, names_off, crs_off, crs_count, tiploc_off = _header.unpack_from(buf, 0)[2:8]
+
+        links = load_links(self.path)
+
+        # the old mmap stays alive as long as a reader still holds a reference to the old state
+        self._state = (buf, count, rows_off, names_off,
+                       crs_off, crs_count, tiploc_off, links)
+        self._mtime = mtime
+        self._last_check = time.monotonic()
+
+    def _maybe_reload(self):
+        if not self.auto_reload:
+            return self._state
+
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            with self._lock:
+                self._last_check = now
+                try:
+                    mtime = os.path.getmtime(self.path)
+                except OSError:
+                    mtime = self._mtime
+                if mtime != self._mtime or self._stale():
+                    self.load()
+        return self._state
+
+    def _decode(self, state, i):
+        buf, _, rows_off, names_off = state[:4]
+        tiploc, crs_secondary, crs_main, easting, northing, is_estimate, change_time, code = \
+            _row.unpack_from(buf, rows_off + i * _row.size)
+        name = buf[names_off + i * _name_width:names_off + (i + 1) * _name_width - 1]
+        return {
+            "record_type": "A",
+            "station_name": name.rstrip(b"\x00").decode("latin-1"),
+            "interchange_size": interchange_status_structure[code],
+            "TIPLOC": tiploc.rstrip(b"\x00").decode("latin-1"),
+            "CRS_secondary": crs_secondary.rstrip(b"\x00").decode("latin-1"),
+            "CRS_main": crs_main.rstrip(b"\x00").decode("latin-1"),
+            "easting": "{:05d}".format(easting),
+            "is_estimate": str(is_estimate),
+            "northing": "{:05d}".format(northing),
+            "change_time": "" if change_time == _no_change_time else str(change_time),
+        }
+
+    def _lookup(self, state, offset, n, entry, key):
+        buf = state[0]
+        width = entry.size - 4
+        try:
+            key = key.upper().encode("latin-1")
+        except UnicodeEncodeError:
+            # the store only holds latin-1 codes, nothing else can match
+            return []
+        if len(key) > width:
+            return []
+        key = key.ljust(width, b"\x00")
+
+        # leftmost entry >= key
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = offset + mid * entry.size
+            if buf[pos:pos + width] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        rows = []
+        while lo < n:
+            k, i = entry.unpack_from(buf, offset + lo * entry.size)
+            if k != key:
+                break
+            rows.append(i)
+            lo += 1
+        return [self._decode(state, i) for i in sorted(rows)]
+
+    def by_crs(self, crs):
+        state = self._maybe_reload()
+        return self._lookup(state, state[4], state[5], _crs_entry, crs)
+
+    def by_tiploc(self, tiploc):
+        state = self._maybe_reload()
+        return self._lookup(state, state[6], state[1], _tiploc_entry, tiploc)
+
+    def by_name(self, station_name):
+        state = self._maybe_reload()
+        output = [self._decode(state, i)
+                  for i in self._find_names(state, station_name.upper())]
+
+        # aliases and group codes like LON resolve to their stations
+        alias_names, group_crs = resolve_links(station_name, state[7])
+        linked = []
+        for n in alias_names:
+            linked += [s for s in (self._decode(state, i) for i in self._find_names(state, n))
+                       if s["station_name"] == n]
+        for c in group_crs:
+            linked += self._lookup(state, state[4], state[5], _crs_entry, c)
+        for s in linked:
+            if s not in output:
+                output.append(s)
+        return output
+
+    def _find_names(self, state, query):
+        buf, count, _, names_off = state[:4]
+        try:
+            query = query.encode("latin-1")
+        except UnicodeEncodeError:
+            return []
+        end = names_off + count * _name_width
+
+        rows = []
+        pos = buf.find(query, names_off, end)
+        while names_off <= pos < end:
+            i = (pos - names_off) // _name_width
+            rows.append(i)
+            # skip to the next name, one hit per station is enough
+            pos = buf.find(query, names_off + (i + 1) * _name_width, end)
+        return rows
+
+    @property
+    def records(self):
+        state = self._maybe_reload()
+        return [self._decode(state, i) for i in range(state[1])]
+
+    def _state_records(self, state):
+        return [self._decode(state, i) for i in range(state[1])]
+
+    def _state_links(self, state):
+        return state[7]
+
+    def __len__(self):
+        return self._maybe_reload()[1]
+
+
+if __name__ == "__main__":
+    import sys
+
+    convert(*sys.argv[1:3])
@@ -1,6 +1,11 @@
 import requests
+import requests.adapters
 import json
-from collections import defaultdict
+import os
+import threading
+import time
+
+import numpy as np
 
 
 def get_severity_list(show_json=True):
@@ -10,16 +15,10 @@ def get_severity_list(show_json=True):
     if show_json:
         print(json.dumps(r, indent=4, ensure_ascii=False))
 
-    all_modes = list(set([m["modeName"] for m in r]))
-
     # group by transport mode
-    temp_dict = defaultdict.fromkeys(all_modes)
     severity_dict = {}
-    for k in temp_dict.keys():
-        severity_dict[k] = []
-
     for mode in r:
-        severity_dict[mode["modeName"]].append({
+        severity_dict.setdefault(mode["modeName"], []).append({
             "level": mode["severityLevel"],
             "description": mode["description"]
         })
@@ -30,6 +29,101 @@ def get_severity_list(show_json=True):
     return severity_dict
 
 
+# severity levels that mean the line is running normally, whatever the mode
+OK_DESCRIPTIONS = ("Good Service", "No Issues", "Information", "No Exceptional Delays")
+SEVERITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "providers", "tfl",
+                             "tfl-severity-modes.json")
+
+
+class SeverityModel(object):
+    """
+    the severity levels of every mode (the output of get_severity_list) as lookup tables:
+    per mode a bitset of the levels that are not disruptions, a level -> description list,
+    and the same bitsets as one boolean mode x level array for classifying many statuses at once.
+    modes or levels the model does not know are counted as disruptions.
+    """
+
+    def __init__(self, severity_dict):
+        self.modes = sorted(severity_dict)
+        self.mode_index = {m: i for i, m in enumerate(self.modes)}
+        # one spare column for out of range levels, one spare row for unknown modes, both never ok
+        self.width = max(s["level"] for v in severity_dict.values() for s in v) + 2
+
+        self.ok_bits = {}
+        self.descriptions = {}
+        self.ok_table = np.zeros((len(self.modes) + 1, self.width), dtype=bool)
+        for m, severities in severity_dict.items():
+            bits = 0
+            descriptions = [None] * self.width
+            for s in severities:
+                descriptions[s["level"]] = s["description"]
+                if s["description"] in OK_DESCRIPTIONS:
+                    bits |= 1 << s["level"]
+                    self.ok_table[self.mode_index[m], s["level"]] = True
+            self.ok_bits[m] = bits
+            self.descriptions[m] = descriptions
+
+    @classmethod
+    def load(cls, filepath=SEVERITY_FILE):
+        with open(filepath) as f:
+            return cls(json.load(f))
+
+    def is_disruption(self, mode, level):
+        return not (0 <= level < self.width and self.ok_bits.get(mode, 0) >> level & 1)
+
+    def description(self, mode, level):
+        descriptions = self.descriptions.get(mode)
+        if descriptions is None or not 0 <= level < self.width:
+            return None
+        return descriptions[level]
+
+    def disrupted(self, mode_ids, levels):
+        """
+        vectorised is_disruption over arrays of mode indices (len(self.modes) for unknown) and levels.
+        """
+        levels = np.asarray(levels, dtype=np.int64)
+        levels = np.where((levels >= 0) & (levels < self.width), levels, self.width - 1)
+        return ~self.ok_table[np.asarray(mode_ids, dtype=np.int64), levels]
+
+    def line_disruptions(self, lines):
+        """
+        [(line, [disrupted statuses])] for every line of a Line/Status response with at least one disruption.
+        """
+        unknown = len(self.modes)
+        mode_ids, levels, owners, firsts = [], [], [], []
+        for i, line in enumerate(lines):
+            m = self.mode_index.get(line["modeName"], unknown)
+            # statuses are flattened in order, firsts[i] is where line i starts
+            firsts.append(len(owners))
+            for status in line["lineStatuses"]:
+                mode_ids.append(m)
+                levels.append(status["statusSeverity"])
+                owners.append(i)
+        if not owners:
+            return []
+
+        output = []
+        for j in np.flatnonzero(self.disrupted(mode_ids, levels)).tolist():
+            line = lines[owners[j]]
+            status = line["lineStatuses"][j - firsts[owners[j]]]
+            if output and output[-1][0] is line:
+                output[-1][1].append(status)
+            else:
+                output.append((line, [status]))
+        return output
+
+
+_severity_model = None
+
+
+def severity_model():
+    # loaded once per process
+    global _severity_model
+    if _severity_model is None:
+        _severity_model = SeverityModel.load()
+    return _severity_model
+
+
 def all_modes_of_transport(show_json=True):
     url = "https://api.tfl.gov.uk/Line/Meta/Modes?app_key=9f418ee21efced9b919d6da9bef9f88b&app_id=03a0c519"
     r = requests.get(url).json()
@@ -108,34 +202,6 @@ def check_for_line_disruption(show_json=True, from_file=True):
 def check_status_of_all_lines(modes="national-rail", show_disruption_only=False, show_json=True, raw=False):
     # https://api.tfl.gov.uk/swagger/ui/index.html?url=/swagger/docs/v1#!/Line/Line_StatusByMode
 
-    def filter_status(mode="national-rail"):
-        ok_codes = {
-            "national-rail": [10, 18, 19],
-            "tflrail": [10, 18, 19],
-            "overground": [10, 18, 19],
-            "dlr": [10, 18, 19],
-            "tram": [10, 18, 19],
-            "tube": [10, 18, 19]
-        }
-
-        try:
-            ok_codes[mode]
-        except:
-            raise SystemExit('error codes not found. cannot filter.')
-
-        status_list = []
-        if mode['modeName'] == mode:
-            for status in mode["lineStatuses"]:
-                # print('checking {} against {}'.format(status["statusSeverity"], national_rail_codes))
-                if not int(status["statusSeverity"]) in ok_codes[mode]:
-                    status_list.append({
-                        "severity": status["statusSeverity"],
-                        "description": status["statusSeverityDescription"]
-                    })
-                else:
-                    continue
-        return status_list
-
     if type(modes) == list:
         modes_to_check = "%2C%20".join(modes)
     else:
@@ -150,28 +216,29 @@ def check_status_of_all_lines(modes="national-rail", show_disruption_only=False,
 
     if not raw:
         output = []
-        for mode in r:
-            if show_disruption_only:
-                # national-rail == all except code 10, 18, 19
-                status_list = filter_status(mode=modes)
-
-                if len(status_list) > 0:
-                    output.append({
-                        "id": mode['id'],
-                        "severity": status_list
-                    })
+        if show_disruption_only:
+            # every status except the mode's ok levels (good service, no issues, information)
+            for line, statuses in severity_model().line_disruptions(r):
+                output.append({
+                    "id": line['id'],
+                    "severity": [{
+                        "severity": status["statusSeverity"],
+                        "description": status["statusSeverityDescription"]
+                    } for status in statuses]
+                })
 
-            else:
+        else:
+            for line in r:
                 # show all statuses
                 status_list = []
-                for status in mode["lineStatuses"]:
+                for status in line["lineStatuses"]:
                     status_list.append({
                         "severity": status["statusSeverity"],
                         "description": status["statusSeverityDescription"]
                     })
 
                 output.append({
-                    "id": mode['id'],
+                    "id": line['id'],
                     "severity": status_list,
                 })
 
@@ -207,6 +274,256 @@ def station_by_name(station_name="st albans", show_json=True):
     return r
 
 
+# concurrent status / disruption aggregation
+# ref: https://api.tfl.gov.uk/swagger/ui/index.html?url=/swagger/docs/v1#!/Line/Line_StatusByMode
+
+TFL_URL = "https://api.tfl.gov.uk"
+APP_KEYS = "app_key=9f418ee21efced9b919d6da9bef9f88b&app_id=03a0c519"
+TRAIN_MODES = ["dlr", "national-rail", "overground", "tflrail", "tram", "tube"]
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "providers", "tfl")
+# the cached line reference, next to this module wherever it is run from
+REFERENCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tfl-all-lines.json")
+
+
+class TflApi(object):
+    """
+    the TfL unified api over one shared requests.Session, so concurrent calls reuse keep-alive connections.
+    get() sends If-None-Match / If-Modified-Since when given the validators of an earlier response
+    and returns (status, validators, body), body is None on 304.
+    """
+
+    def __init__(self, base_url=TFL_URL, concurrency=6, timeout=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, path, validators=None):
+        url = "{}{}{}{}".format(self.base_url, path, "&" if "?" in path else "?", APP_KEYS)
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        r = self.session.get(url, headers=headers, timeout=self.timeout)
+        validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+        if r.status_code == 304:
+            return 304, validators, None
+        r.raise_for_status()
+        return r.status_code, validators, r.json()
+
+
+class FixtureApi(object):
+    """
+    answers the same paths as TflApi from the sample files in providers/tfl, for running offline.
+    the samples carry no line statuses, every line reports Good Service until set_status() says otherwise.
+    the route data is versioned by the file's mtime, so conditional requests get 304 until it changes.
+    """
+
+    def __init__(self, directory=FIXTURES, concurrency=6):
+        self.directory = directory
+        self.concurrency = concurrency
+        self.statuses = {}
+        self.station_disruptions = {}
+        self.requests = 0
+
+    def _lines(self, modes):
+        with open(os.path.join(self.directory, "tfl-all-lines.json")) as f:
+            return [l for l in json.load(f) if l["modeName"] in modes]
+
+    def set_status(self, line_id, severity=10, description="Good Service", reason=None):
+        self.statuses[line_id] = [{"statusSeverity": severity, "statusSeverityDescription": description,
+                                   "reason": reason}]
+
+    def set_station_disruption(self, mode, atco_code, description=None):
+        disruptions = self.station_disruptions.setdefault(mode, {})
+        if description is None:
+            disruptions.pop(atco_code, None)
+        else:
+            disruptions[atco_code] = {"atcoCode": atco_code, "mode": mode, "description": description}
+
+    def get(self, path, validators=None):
+        self.requests += 1
+        parts = path.split("?")[0].strip("/").split("/")
+        modes = parts[2].split(",") if len(parts) > 2 else []
+
+        if parts[0] == "Line" and parts[-1] == "Route":
+            stat = os.stat(os.path.join(self.directory, "tfl-all-lines.json"))
+            version = {"etag": '"{}-{}"'.format(int(stat.st_mtime), stat.st_size), "last_modified": None}
+            if validators and validators.get("etag") == version["etag"]:
+                return 304, version, None
+            return 200, version, self._lines(modes)
+
+        if parts[0] == "Line" and parts[-1] == "Status":
+            body = []
+            for l in self._lines(modes):
+                statuses = self.statuses.get(l["id"]) or [
+                    {"statusSeverity": 10, "statusSeverityDescription": "Good Service", "reason": None}]
+                body.append({"id": l["id"], "name": l["name"], "modeName": l["modeName"],
+                             "disruptions": l["disruptions"], "lineStatuses": statuses})
+            return 200, {}, body
+
+        if parts[0] == "StopPoint" and parts[-1] == "Disruption":
+            return 200, {}, [d for m in modes for d in self.station_disruptions.get(m, {}).values()]
+
+        raise SystemExit('fixture has no data for {}'.format(path))
+
+
+class LineReference(object):
+    """
+    lines and their routes (what all_lines_and_routes fetches), kept in memory and on disk.
+    refreshed at most every max_age seconds, with a conditional request, so an unchanged
+    reference costs a 304 and the file is only rewritten when the data changed.
+    """
+
+    def __init__(self, api, modes=TRAIN_MODES, path=REFERENCE_FILE, max_age=24 * 60 * 60):
+        self.api = api
+        self.modes = modes
+        self.path = path
+        self.max_age = max_age
+
+        self.lines = None
+        self.by_id = {}
+        self.validators = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self, force=False):
+        with self.lock:
+            if self.lines is None and os.path.exists(self.path) and not force:
+                with open(self.path) as f:
+                    self._set(json.load(f))
+                # the copy on disk is as fresh as the last write
+                self.checked = os.path.getmtime(self.path)
+
+            if force or self.lines is None or time.time() - self.checked >= self.max_age:
+                path = "/Line/Mode/{}/Route?serviceTypes=Regular".format(",".join(self.modes))
+                status, self.validators, body = self.api.get(path, self.validators)
+                if body is not None:
+                    self._set(body)
+                    with open(self.path, "w") as f:
+                        json.dump(body, f, indent=4, ensure_ascii=False)
+                self.checked = time.time()
+            return self.lines
+
+    def _set(self, lines):
+        self.lines = lines
+        self.by_id = {l["id"]: l for l in lines}
+
+
+def _line_state(line):
+    # the parts of a status that make a change worth reporting
+    return tuple(sorted((s["statusSeverity"], s["statusSeverityDescription"], s.get("reason") or "")
+                        for s in line["lineStatuses"]))
+
+
+def _station_state(disruptions):
+    # the descriptions of every disruption at a station, in a stable order
+    return tuple(sorted(d.get("description") or "" for d in disruptions))
+
+
+class StatusAggregator(object):
+    """
+    polls line status and station disruptions for every mode at once, one request per mode and endpoint
+    running concurrently over the api's shared session, and reports only what changed since the last poll.
+
+        aggregator = StatusAggregator(FixtureApi())
+        aggregator.poll()    # first poll, every line is "added"
+        aggregator.poll()    # [] until a status changes
+    """
+
+    def __init__(self, api=None, modes=TRAIN_MODES, reference=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.api = api or TflApi()
+        self.modes = modes
+        self.reference = reference or LineReference(self.api, modes)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, getattr(self.api, "concurrency", 6)))
+        self.lines = {}
+        self.stations = {}
+
+    def fetch(self):
+        """
+        returns ({line id: line status}, {atco code: [station disruptions]}) for all modes.
+        """
+        paths = ["/Line/Mode/{}/Status?detail=true".format(m) for m in self.modes]
+        paths += ["/StopPoint/Mode/{}/Disruption?includeRouteBlockedStops=true".format(m) for m in self.modes]
+        bodies = list(self.pool.map(lambda p: self.api.get(p)[2], paths))
+
+        lines, stations = {}, {}
+        for body in bodies[:len(self.modes)]:
+            for line in body:
+                lines[line["id"]] = line
+        for body in bodies[len(self.modes):]:
+            for d in body:
+                # a station can have several disruptions at once, keep them all
+                stations.setdefault(d.get("atcoCode") or d.get("stationAtcoCode"), []).append(d)
+        return lines, stations
+
+    def poll(self):
+        """
+        fetches a new snapshot and returns the changes against the previous one:
+        [{"kind": "line" / "station", "id", "change": "added" / "changed" / "cleared", "name", "mode", "status"}]
+        """
+        lines, stations = self.fetch()
+        reference = self.reference.by_id if self.reference.get() else {}
+        changes = []
+
+        for line_id, line in lines.items():
+            before = self.lines.get(line_id)
+            if before is not None and _line_state(before) == _line_state(line):
+                continue
+            ref = reference.get(line_id, line)
+            changes.append({
+                "kind": "line", "id": line_id, "change": "added" if before is None else "changed",
+                "name": ref.get("name"), "mode": ref.get("modeName"),
+                "status": [{"severity": s, "description": d, "reason": r or None} for s, d, r in _line_state(line)],
+            })
+        for line_id in set(self.lines) - set(lines):
+            changes.append({"kind": "line", "id": line_id, "change": "cleared", "name": self.lines[line_id].get("name"),
+                            "mode": self.lines[line_id].get("modeName"), "status": []})
+
+        for code, found in stations.items():
+            before = self.stations.get(code)
+            if before is None or _station_state(before) != _station_state(found):
+                changes.append({"kind": "station", "id": code, "change": "added" if before is None else "changed",
+                                "name": found[0].get("commonName"), "mode": found[0].get("mode"),
+                                "status": list(_station_state(found))})
+        for code in set(self.stations) - set(stations):
+            d = self.stations[code][0]
+            changes.append({"kind": "station", "id": code, "change": "cleared", "name": d.get("commonName"),
+                            "mode": d.get("mode"), "status": []})
+
+        self.lines, self.stations = lines, stations
+        return changes
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+def watch_status(interval=60, from_file=False, show_json=True, polls=None):
+    """
+    polls every interval seconds and prints each change as it happens.
+    with from_file the sample data in providers/tfl is used instead of the live api.
+    """
+    aggregator = StatusAggregator(FixtureApi() if from_file else TflApi())
+    n = 0
+    try:
+        while polls is None or n < polls:
+            for change in aggregator.poll():
+                if show_json:
+                    print(json.dumps(change, ensure_ascii=False))
+            n += 1
+            if polls is None or n < polls:
+                time.sleep(interval)
+    finally:
+        aggregator.close()
+
+
 def describe():
     print('extra info')
     crowd_url = "https://api.tfl.gov.uk/swagger/ui/index.html?url=/swagger/docs/v1#!/StopPoint/StopPoint_Crowding"
@@ -221,4 +538,5 @@ if __name__ == "__main__":
 
     check_status_of_all_lines(modes="national-rail", show_disruption_only=True)
     # check_for_station_disruption()
+    # watch_status(from_file=True, polls=1)
     # station_by_name()
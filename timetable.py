@@ -0,0 +1,263 @@
+"""
+calling patterns of TransportAPI service timetables (search_by_train responses), held as compact arrays.
+
+every service's stops are appended to shared, flat columns:
+    station            index of the stop's CRS code in Timetable.codes (seeded from the station index)
+    aimed_arrival      minutes since midnight of the service date (past 1440 after midnight)
+    aimed_departure
+    expected_arrival, expected_departure
+    delay              expected - aimed in minutes, departure where there is one
+with NO_TIME where a time is missing. per service, a position map {station: stop position}
+answers "does this train call at X", "after Y" and "when does it arrive at X" without walking the stops.
+
+    timetable = Timetable()
+    service = timetable.add(search_by_train("W64717", "2018-11-01", show_json=False))
+    timetable.calls_at(service, "WIM", after="STP")     # True
+    timetable.arrival(service, "SUO")                   # "10:44"
+"""
+import datetime
+import json
+from array import array
+
+NO_TIME = -32768
+MINUTES_PER_DAY = 24 * 60
+
+# the per stop columns, in the order add() fills them
+COLUMNS = ("station", "aimed_arrival", "aimed_departure", "expected_arrival", "expected_departure", "delay")
+
+# stops the train only passes through, not calls at
+PASSING_STOP_TYPES = ("PP",)
+
+
+def to_minutes(time_str, date_str=None, service_date=None):
+    """
+    "HH:MM" to minutes since midnight of service_date (stops after midnight are past 1440).
+    """
+    if not time_str:
+        return NO_TIME
+    minutes = int(time_str[:2]) * 60 + int(time_str[3:5])
+    if date_str and service_date and date_str != service_date:
+        days = (datetime.date.fromisoformat(date_str) - datetime.date.fromisoformat(service_date)).days
+        minutes += days * MINUTES_PER_DAY
+    return minutes
+
+
+def format_minutes(minutes):
+    if minutes == NO_TIME:
+        return None
+    return "{:02d}:{:02d}".format(minutes // 60 % 24, minutes % 60)
+
+
+class Timetable(object):
+    """
+    any number of services, one row per stop in flat arrays (2 bytes per time, 4 per station).
+    services are numbered in the order they were added; adding a service that is already held
+    (same train_uid and date) replaces its calling pattern, reusing its rows, so refreshing the
+    same services again and again does not grow the columns.
+    """
+
+    def __init__(self, index=None):
+        self.codes = []
+        self.code_ids = {}
+        if index is not None:
+            # station indices follow the station index, so they can be shared with other modules
+            for s in index.records:
+                for code in (s["CRS_main"], s["CRS_secondary"]):
+                    self._code_id(code)
+
+        self.station = array("i")
+        self.aimed_arrival = array("h")
+        self.aimed_departure = array("h")
+        self.expected_arrival = array("h")
+        self.expected_departure = array("h")
+        self.delay = array("h")
+
+        # per service: (first stop, number of stops), {station: position}, header fields
+        self.spans = []
+        self.positions = []
+        self.services = []
+        self.service_ids = {}
+        # rows left behind by replaced services
+        self.dead = 0
+
+    def _code_id(self, code):
+        i = self.code_ids.get(code)
+        if i is None:
+            i = self.code_ids[code] = len(self.codes)
+            self.codes.append(code)
+        return i
+
+    def add(self, response):
+        """
+        adds one timetable response (the JSON of search_by_train) and returns its service number.
+        """
+        key = (response["train_uid"], response["date"])
+        date = response["date"]
+        rows = [array(getattr(self, c).typecode) for c in COLUMNS]
+        station_rows, arrival_rows, departure_rows, expected_arrival_rows, expected_departure_rows, delay_rows = rows
+
+        positions = {}
+        n = 0
+        for stop in response["stops"]:
+            station = self._code_id(stop["station_code"])
+            arrival = to_minutes(stop["aimed_arrival_time"], stop["aimed_arrival_date"], date)
+            departure = to_minutes(stop["aimed_departure_time"], stop["aimed_departure_date"], date)
+            expected_arrival = to_minutes(stop["expected_arrival_time"], stop["expected_arrival_date"], date)
+            expected_departure = to_minutes(stop["expected_departure_time"], stop["expected_departure_date"], date)
+
+            if departure != NO_TIME and expected_departure != NO_TIME:
+                delay = expected_departure - departure
+            elif arrival != NO_TIME and expected_arrival != NO_TIME:
+                delay = expected_arrival - arrival
+            else:
+                delay = NO_TIME
+
+            station_rows.append(station)
+            arrival_rows.append(arrival)
+            departure_rows.append(departure)
+            expected_arrival_rows.append(expected_arrival)
+            expected_departure_rows.append(expected_departure)
+            delay_rows.append(delay)
+
+            # first call wins, a service that calls twice at a station (loops) is asked about its first visit
+            if stop.get("stop_type") not in PASSING_STOP_TYPES:
+                positions.setdefault(station, n)
+            n += 1
+
+        header = {k: v for k, v in response.items() if k != "stops"}
+        service = self.service_ids.get(key)
+        if service is not None and n <= self.spans[service][1]:
+            # a live refresh of the same service: its new rows go over the old ones
+            first, old_n = self.spans[service]
+            for c, values in zip(COLUMNS, rows):
+                getattr(self, c)[first:first + n] = values
+            self.dead += old_n - n
+        else:
+            first = len(self.station)
+            for c, values in zip(COLUMNS, rows):
+                getattr(self, c).extend(values)
+            if service is not None:
+                self.dead += self.spans[service][1]
+
+        if service is None:
+            service = self.service_ids[key] = len(self.services)
+            self.spans.append((first, n))
+            self.positions.append(positions)
+            self.services.append(header)
+        else:
+            self.spans[service] = (first, n)
+            self.positions[service] = positions
+            self.services[service] = header
+
+        # replaced services that grew leave rows behind, drop them once they are half the columns
+        if self.dead * 2 > len(self.station):
+            self.compact()
+        return service
+
+    def compact(self):
+        """
+        drops the rows no service points at any more, keeping the services in order.
+        """
+        columns = [getattr(self, c) for c in COLUMNS]
+        compacted = [array(c.typecode) for c in columns]
+        for service, (first, n) in enumerate(self.spans):
+            self.spans[service] = (len(compacted[0]), n)
+            for old, new in zip(columns, compacted):
+                new.extend(old[first:first + n])
+        for c, values in zip(COLUMNS, compacted):
+            setattr(self, c, values)
+        self.dead = 0
+
+    def add_file(self, filepath):
+        with open(filepath) as f:
+            return self.add(json.load(f))
+
+    def service(self, train_uid, date_str):
+        return self.service_ids.get((train_uid, date_str))
+
+    def __len__(self):
+        return len(self.services)
+
+    def _position(self, service, station_code):
+        i = self.code_ids.get(station_code.upper())
+        if i is None:
+            return None
+        return self.positions[service].get(i)
+
+    def calls_at(self, service, station_code, after=None, after_time=None):
+        """
+        whether the service calls at station_code. with after (a CRS code) only if it calls there
+        later than at after, with after_time ("HH:MM") only if it arrives there after that time.
+        """
+        position = self._position(service, station_code)
+        if position is None:
+            return False
+        if after is not None:
+            before = self._position(service, after)
+            if before is None or before >= position:
+                return False
+        if after_time is not None:
+            arrival = self.arrival_minutes(service, station_code)
+            if arrival is None or arrival <= to_minutes(after_time):
+                return False
+        return True
+
+    def arrival_minutes(self, service, station_code, expected=False):
+        """
+        arrival at station_code in minutes since midnight, None if the service does not call there.
+        at the origin, which has no arrival, this is the departure.
+        """
+        position = self._position(service, station_code)
+        if position is None:
+            return None
+        row = self.spans[service][0] + position
+        arrival = (self.expected_arrival if expected else self.aimed_arrival)[row]
+        if arrival == NO_TIME:
+            arrival = (self.expected_departure if expected else self.aimed_departure)[row]
+        return None if arrival == NO_TIME else arrival
+
+    def arrival(self, service, station_code, expected=False):
+        minutes = self.arrival_minutes(service, station_code, expected)
+        return None if minutes is None else format_minutes(minutes)
+
+    def delay_at(self, service, station_code):
+        position = self._position(service, station_code)
+        if position is None:
+            return None
+        delay = self.delay[self.spans[service][0] + position]
+        return None if delay == NO_TIME else delay
+
+    def stops(self, service):
+        """
+        the calling pattern as [{"station_code", "arrival", "departure", "delay"}], in order.
+        """
+        first, n = self.spans[service]
+        output = []
+        for row in range(first, first + n):
+            delay = self.delay[row]
+            output.append({
+                "station_code": self.codes[self.station[row]],
+                "arrival": format_minutes(self.aimed_arrival[row]),
+                "departure": format_minutes(self.aimed_departure[row]),
+                "delay": None if delay == NO_TIME else delay,
+            })
+        return output
+
+    def station_sequence(self, service):
+        first, n = self.spans[service]
+        return self.station[first:first + n]
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python timetable.py providers/transportapi/W64717-all-stops-*.json
+    timetable = Timetable()
+    for filepath in sys.argv[1:]:
+        service = timetable.add_file(filepath)
+        header = timetable.services[service]
+        first, n = timetable.spans[service]
+        delays = [d for d in timetable.delay[first:first + n] if d != NO_TIME]
+        print('{} {} {} -> {}: {} stops, max delay {}'.format(
+            header["train_uid"], header["date"], header["origin_name"], header["destination_name"], n,
+            max(delays) if delays else "unknown"))
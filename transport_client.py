@@ -0,0 +1,197 @@
+"""
+pooled, concurrent client for the TransportAPI live endpoints used by search_by_station / search_by_train.
+
+one requests.Session (keep-alive connection pool) is shared by every call. the asyncio methods run the
+blocking requests in a thread pool, limited by a semaphore, so hundreds of stations can be polled at once:
+
+    client = TransportClient(concurrency=20)
+    boards = asyncio.run(client.stations(["ZFD", "SAC", "KGX"]))
+
+every request has a timeout and is retried with exponential backoff on connection errors, timeouts,
+429 and 5xx responses. base_url can point at a local stub server for testing.
+with a ResponseCache (response_cache.py), repeated station / train requests are answered from the cache.
+"""
+import os
+import random
+import threading
+import time
+
+from metrics import count, timed
+from response_cache import DiskBackend, ResponseCache, uncached
+
+BASE_URL = "https://fcc.transportapi.com/v3/uk/train"
+
+# status codes worth retrying, everything else is returned as is (the API answers errors with a JSON body)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class TransportError(Exception):
+    pass
+
+
+class TransportClient(object):
+
+    def __init__(self, base_url=BASE_URL, concurrency=10, timeout=10.0, retries=3, backoff=0.5, cache=None):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def session(self):
+        # requests is only imported once the first request is made
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def station_url(self, station_CRS, count=10):
+        return "{}/station/{}/live.json?limit={}".format(self.base_url, station_CRS, count)
+
+    def train_url(self, train_uid, date_str):
+        return "{}/service/train_uid:{}/{}/timetable.json?live=true".format(
+            self.base_url, train_uid, date_str)
+
+    def fetch(self, url):
+        """
+        blocking GET returning the decoded JSON body, with timeout and retries.
+        """
+        return self.fetch_status(url)[1]
+
+    def fetch_status(self, url):
+        """
+        as fetch, returning (status code, decoded JSON body).
+        """
+        import requests
+
+        attempt = 0
+        while True:
+            try:
+                with timed("upstream"):
+                    r = self.session.get(url, timeout=self.timeout)
+                if r.status_code not in RETRY_STATUS:
+                    return r.status_code, r.json()
+                error = TransportError("{} returned {}".format(url, r.status_code))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt >= self.retries:
+                count("upstream_error")
+                raise error
+            count("upstream_retry")
+            # exponential backoff with jitter, so retries from many requests do not line up
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+    def get(self, key, url):
+        # fetch through the cache, if there is one
+        if self.cache is None:
+            return self.fetch(url)
+        return self.cache.get_or_fetch(key, lambda: self._cacheable(*self.fetch_status(url)))
+
+    @staticmethod
+    def _cacheable(status, body):
+        # an error answer (4xx with a JSON body) is passed on but not cached, the next call asks again
+        return body if 200 <= status < 300 else uncached(body)
+
+    def station_key(self, station_CRS, count=10):
+        return ("live", station_CRS.upper(), "", count)
+
+    def train_key(self, train_uid, date_str):
+        return ("timetable", train_uid.upper(), date_str, "")
+
+    # synchronous api, used by search_by_station / search_by_train
+
+    def station(self, station_CRS, count=10):
+        return self.get(self.station_key(station_CRS, count), self.station_url(station_CRS, count))
+
+    def train(self, train_uid, date_str):
+        return self.get(self.train_key(train_uid, date_str), self.train_url(train_uid, date_str))
+
+    # asyncio api
+
+    def _pool(self):
+        if self._executor is None:
+            with self._session_lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self._executor
+
+    # asyncio is only imported by the async methods, a coroutine cannot run without it being loaded already
+
+    async def fetch_async(self, url, semaphore=None, key=None):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if key is None:
+            call = (self.fetch, url)
+        else:
+            call = (self.get, key, url)
+
+        if semaphore is None:
+            return await loop.run_in_executor(self._pool(), *call)
+        async with semaphore:
+            return await loop.run_in_executor(self._pool(), *call)
+
+    async def fetch_many(self, urls, keys=None):
+        """
+        fetches urls concurrently, at most self.concurrency at a time.
+        results come back in the order of urls; a request that failed after all retries
+        leaves its exception in the list instead of failing the whole batch.
+        with keys (one cache key per url) the responses go through the cache.
+        """
+        import asyncio
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        keys = keys or [None] * len(urls)
+        return await asyncio.gather(*[self.fetch_async(u, semaphore, k) for u, k in zip(urls, keys)],
+                                    return_exceptions=True)
+
+    async def stations(self, station_CRS_list, count=10):
+        return await self.fetch_many([self.station_url(c, count) for c in station_CRS_list],
+                                     [self.station_key(c, count) for c in station_CRS_list])
+
+    async def trains(self, trains):
+        # trains: [(train_uid, date_str)]
+        return await self.fetch_many([self.train_url(uid, d) for uid, d in trains],
+                                     [self.train_key(uid, d) for uid, d in trains])
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # process-wide client, so every search_by_* call reuses the same connection pool and cache.
+    # set RAILDATA_CACHE_DIR to keep cached responses across runs
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                cache_dir = os.environ.get("RAILDATA_CACHE_DIR")
+                backend = DiskBackend(cache_dir) if cache_dir else None
+                _client = TransportClient(cache=ResponseCache(backend=backend))
+    return _client